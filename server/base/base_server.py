@@ -22,6 +22,8 @@ from loguru import logger
 
 from ..web_configs import API_CONFIG, WEB_CONFIGS
 from .database.init_db import create_db_and_tables
+from .http_client import close_all_clients
+from .queue_thread import start_queue_workers, stop_queue_workers
 from .routers import digital_human, llm, products, streamer_info, streaming_room, users
 from .server_info import SERVER_PLUGINS_INFO
 from .utils import ChatItem, ResultCode, gen_default_data, make_return_data, streamer_sales_process
@@ -60,12 +62,21 @@ async def lifespan(app: FastAPI):
     if WEB_CONFIGS.ENABLE_RAG:
         from .modules.rag.rag_worker import load_rag_model
 
-        # 生成 rag 数据库
-        await load_rag_model(user_id=1)
+        # 加载 rag 模型，在后台按用户、商品生成 rag 数据库
+        await load_rag_model()
+
+    # 启动 TTS / 数字人 队列 worker
+    start_queue_workers()
 
     yield
 
     # 结束
+    await stop_queue_workers()
+    if WEB_CONFIGS.ENABLE_RAG:
+        from .modules.rag.rag_worker import stop_rag_worker
+
+        await stop_rag_worker()
+    await close_all_clients()
     logger.info("Base server stopped.")
 
 
@@ -151,7 +162,7 @@ async def get_dashboard_info():
 @app.get("/plugins_info", tags=["base"], summary="获取组件信息接口")
 async def get_plugins_info():
 
-    plugins_info = SERVER_PLUGINS_INFO.get_status()
+    plugins_info = await SERVER_PLUGINS_INFO.get_status()
     return make_return_data(True, ResultCode.SUCCESS, "成功", plugins_info)
 
 
@@ -197,10 +208,10 @@ async def upload_product_api(file: UploadFile = File(...), user_id: int = Depend
 
 
 @app.post("/streamer-sales/chat", tags=["base"], summary="对话接口", deprecated=True)
-async def streamer_sales_chat(chat_item: ChatItem, response: Response):
+async def streamer_sales_chat(chat_item: ChatItem, response: Response, user_id: int = Depends(users.get_current_user_info)):
     from sse_starlette import EventSourceResponse
 
     # 对话总接口
     response.headers["Content-Type"] = "text/event-stream"
     response.headers["Cache-Control"] = "no-cache"
-    return EventSourceResponse(streamer_sales_process(chat_item))
+    return EventSourceResponse(streamer_sales_process(chat_item, user_id))
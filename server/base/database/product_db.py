@@ -97,6 +97,17 @@ async def get_db_product_info(
     return product_list, total_product_num
 
 
+def get_db_product_user_ids() -> List[int]:
+    """获取持有商品的所有用户 ID
+
+    Returns:
+        List[int]: 用户 ID
+    """
+    with Session(DB_ENGINE) as session:
+        user_ids = session.exec(select(ProductInfo.user_id).where(ProductInfo.delete == False).distinct()).all()
+    return [user_id for user_id in user_ids if user_id is not None]
+
+
 async def delete_product_id(product_id: int, user_id: int) -> bool:
     """删除特定的商品 ID
 
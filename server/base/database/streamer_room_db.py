@@ -16,7 +16,7 @@ from typing import List
 from loguru import logger
 from sqlmodel import Session, and_, not_, select
 
-from ...web_configs import API_CONFIG
+from ...web_configs import API_CONFIG, WEB_CONFIGS
 from ..models.streamer_room_model import ChatMessageInfo, OnAirRoomStatusItem, SalesDocAndVideoInfo, StreamRoomInfo
 from .init_db import DB_ENGINE
 
@@ -404,6 +404,8 @@ async def get_live_room_info(user_id: int, room_id: int):
         "conversation": conversation_list,
         "currentProductInfo": streaming_room_info.product_list[prodcut_index].product_info,
         "currentStreamerVideo": video_path,
+        # HLS 直播流，渲染过程中即可播放，回答之间播放数字人空闲循环
+        "liveStreamUrl": f"{API_CONFIG.REQUEST_FILES_URL}/{WEB_CONFIGS.STREAMER_FILE_DIR}/live/{room_id}/live.m3u8",
         "currentProductIndex": streaming_room_info.status.current_product_index,
         "startTime": streaming_room_info.status.start_time,
         "currentPoductStartTime": streaming_room_info.product_list[prodcut_index].start_time,
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@File    :   http_client.py
+@Time    :   2024/09/20
+@Project :   https://github.com/PeterH0323/Streamer-Sales
+@Author  :   HinGwenWong
+@Version :   1.0
+@Desc    :   服务间调用的异步 HTTP 客户端，长连接池 + 超时 + 重试 + 并发限制
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import httpx
+from loguru import logger
+
+from ..web_configs import API_CONFIG
+
+
+class AsyncServiceClient:
+    """单个下游服务（TTS / 数字人 / ASR / LLM）的异步客户端，同一服务共用一个连接池"""
+
+    # 请求还没送达服务端的错误，重试不会导致重复执行
+    RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+    RETRY_STATUS_CODES = (502, 503, 504)
+
+    def __init__(
+        self, service_name: str, timeout: float, max_concurrency: int, max_retries: int = 2, retry_backoff: float = 0.5
+    ) -> None:
+        """
+        Args:
+            service_name (str): 服务名，用于日志
+            timeout (float): 默认读超时，单位秒
+            max_concurrency (int): 同时发往该服务的最大请求数，超出的请求排队等待
+            max_retries (int, optional): 连接失败或者 502/503/504 时的重试次数. Defaults to 2.
+            retry_backoff (float, optional): 重试间隔基数，单位秒，按 2 的指数增长. Defaults to 0.5.
+        """
+        self.service_name = service_name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 懒加载，确保在事件循环中创建
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=API_CONFIG.HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            )
+        return self._client
+
+    async def request(self, method: str, url: str, timeout: float | None = None, **kwargs) -> httpx.Response:
+        """发起请求，非 2xx 会抛出 httpx.HTTPStatusError
+
+        Args:
+            method (str): GET / POST ...
+            url (str): 请求地址
+            timeout (float | None, optional): 本次请求的读超时，为 None 则使用服务默认值. Defaults to None.
+
+        Returns:
+            httpx.Response: 返回结果
+        """
+        if timeout is not None:
+            kwargs["timeout"] = httpx.Timeout(timeout, connect=API_CONFIG.HTTP_CONNECT_TIMEOUT)
+
+        async with self._semaphore:
+            for retry_idx in range(self.max_retries + 1):
+                try:
+                    res = await self.client.request(method, url, **kwargs)
+                except self.RETRY_EXCEPTIONS as e:
+                    if retry_idx == self.max_retries:
+                        raise
+                    logger.warning(f"[{self.service_name}] {method} {url} failed: {e!r}, retry {retry_idx + 1} ...")
+                else:
+                    if res.status_code not in self.RETRY_STATUS_CODES or retry_idx == self.max_retries:
+                        res.raise_for_status()
+                        return res
+                    logger.warning(f"[{self.service_name}] {method} {url} got {res.status_code}, retry {retry_idx + 1} ...")
+
+                await asyncio.sleep(self.retry_backoff * (2**retry_idx))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, timeout: float | None = None, **kwargs) -> AsyncIterator[httpx.Response]:
+        """流式请求，退出上下文时关闭连接，下游服务据此感知请求被取消。流式请求不做重试
+
+        Args:
+            method (str): GET / POST ...
+            url (str): 请求地址
+            timeout (float | None, optional): 本次请求的读超时，为 None 则使用服务默认值. Defaults to None.
+
+        Yields:
+            httpx.Response: 未读取 body 的返回，使用 aiter_lines 等接口逐步读取
+        """
+        if timeout is not None:
+            kwargs["timeout"] = httpx.Timeout(timeout, connect=API_CONFIG.HTTP_CONNECT_TIMEOUT)
+
+        async with self._semaphore:
+            async with self.client.stream(method, url, **kwargs) as res:
+                if res.is_error:
+                    await res.aread()
+                res.raise_for_status()
+                yield res
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+TTS_CLIENT = AsyncServiceClient("tts", timeout=API_CONFIG.TTS_TIMEOUT, max_concurrency=API_CONFIG.TTS_MAX_CONCURRENCY)
+DIGITAL_HUMAN_CLIENT = AsyncServiceClient(
+    "digital_human", timeout=API_CONFIG.DIGITAL_HUMAN_TIMEOUT, max_concurrency=API_CONFIG.DIGITAL_HUMAN_MAX_CONCURRENCY
+)
+# 数字人服务中不需要等待渲染的请求单独使用连接池，避免排在渲染请求后面
+DIGITAL_HUMAN_CONTROL_CLIENT = AsyncServiceClient("digital_human_control", timeout=API_CONFIG.DIGITAL_HUMAN_CONTROL_TIMEOUT, max_concurrency=8)
+ASR_CLIENT = AsyncServiceClient("asr", timeout=API_CONFIG.ASR_TIMEOUT, max_concurrency=API_CONFIG.ASR_MAX_CONCURRENCY)
+LLM_CLIENT = AsyncServiceClient("llm", timeout=API_CONFIG.LLM_TIMEOUT, max_concurrency=API_CONFIG.LLM_MAX_CONCURRENCY)
+
+# 健康检查使用短超时，不重试
+CHECK_CLIENT = AsyncServiceClient("check", timeout=API_CONFIG.HTTP_CONNECT_TIMEOUT, max_concurrency=8, max_retries=0)
+
+
+async def close_all_clients():
+    for service_client in [TTS_CLIENT, DIGITAL_HUMAN_CLIENT, DIGITAL_HUMAN_CONTROL_CLIENT, ASR_CLIENT, LLM_CLIENT, CHECK_CLIENT]:
+        await service_client.close()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@File    :   job_bus.py
+@Time    :   2024/09/20
+@Project :   https://github.com/PeterH0323/Streamer-Sales
+@Author  :   HinGwenWong
+@Version :   1.0
+@Desc    :   任务完成事件总线，TTS / 数字人任务完成后直接通知等待方，替代轮询文件是否存在
+"""
+
+import asyncio
+import multiprocessing
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+from loguru import logger
+
+from ..web_configs import WEB_CONFIGS
+
+
+def make_job_id(stage: str, request_id: str, chunk_id: int) -> str:
+    """生成任务 ID
+
+    Args:
+        stage (str): 任务阶段，e.g. tts, dh
+        request_id (str): 请求 ID
+        chunk_id (int): 句子 ID，0 代表整段
+
+    Returns:
+        str: 任务 ID
+    """
+    return f"{stage}-{request_id}-{str(chunk_id).zfill(8)}"
+
+
+class LocalBroker:
+    """进程内 broker，发布方和等待方在同一个进程中时使用"""
+
+    def __init__(self) -> None:
+        self._callback = None
+
+    def start(self, callback: Callable[[str, Any], None]):
+        self._callback = callback
+
+    def publish(self, job_id: str, result: Any):
+        self._callback(job_id, result)
+
+    def stop(self):
+        self._callback = None
+
+
+class ProcessBroker:
+    """跨进程 broker 的本地替身，用 multiprocessing.Queue 将子进程的完成事件传回主进程。
+
+    多机部署时可以替换成 redis pub/sub 等实现，只需要提供相同的 start / publish / stop 接口。
+    """
+
+    def __init__(self, maxsize: int = 1000) -> None:
+        self.queue = multiprocessing.Queue(maxsize=maxsize)
+        self._thread = None
+
+    def __getstate__(self):
+        # 传给子进程时只需要队列，监听线程只在主进程存在
+        return {"queue": self.queue, "_thread": None}
+
+    def start(self, callback: Callable[[str, Any], None]):
+        def _listen():
+            while True:
+                message = self.queue.get()
+                if message is None:
+                    break
+                job_id, result = message
+                callback(job_id, result)
+
+        self._thread = threading.Thread(target=_listen, name="job_bus_listener", daemon=True)
+        self._thread.start()
+
+    def publish(self, job_id: str, result: Any):
+        self.queue.put((job_id, result))
+
+    def stop(self):
+        self.queue.put(None)
+
+
+class JobBus:
+    """任务完成事件总线：等待方通过 register 拿到 asyncio.Future，发布方完成后调用 publish 唤醒"""
+
+    def __init__(self, broker, max_unclaimed: int = 1000) -> None:
+        self.broker = broker
+        self.max_unclaimed = max_unclaimed
+
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = dict()
+        self._unclaimed = OrderedDict()  # 先于 register 完成的任务结果
+
+        self.broker.start(self._on_complete)
+
+    def register(self, job_id: str) -> asyncio.Future:
+        """注册等待任务，需要在事件循环中调用
+
+        Args:
+            job_id (str): 任务 ID
+
+        Returns:
+            asyncio.Future: 任务完成后 set_result 为发布方的结果
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if job_id in self._unclaimed:
+                future.set_result(self._unclaimed.pop(job_id))
+            else:
+                self._waiters[job_id] = (loop, future)
+        return future
+
+    def publish(self, job_id: str, result: Any = None):
+        """发布任务完成事件，可以在任意线程 / 进程中调用"""
+        self.broker.publish(job_id, result)
+
+    def cancel(self, job_id: str):
+        """等待方不再关心该任务，释放其 Future"""
+        with self._lock:
+            self._waiters.pop(job_id, None)
+            self._unclaimed.pop(job_id, None)
+
+    def _on_complete(self, job_id: str, result: Any):
+        with self._lock:
+            waiter = self._waiters.pop(job_id, None)
+            if waiter is None:
+                self._unclaimed[job_id] = result
+                while len(self._unclaimed) > self.max_unclaimed:
+                    self._unclaimed.popitem(last=False)
+                return
+
+        loop, future = waiter
+        loop.call_soon_threadsafe(self._set_result, future, result)
+
+    @staticmethod
+    def _set_result(future: asyncio.Future, result: Any):
+        if not future.done():
+            future.set_result(result)
+
+    def stop(self):
+        self.broker.stop()
+
+
+def get_job_broker(broker_type: str):
+    if broker_type == "local":
+        return LocalBroker()
+    elif broker_type == "process":
+        return ProcessBroker()
+    else:
+        raise ValueError(f"Unknown job broker type: {broker_type}")
+
+
+JOB_BUS = JobBus(get_job_broker(WEB_CONFIGS.JOB_BUS_BROKER))
+logger.info(f"job bus broker: {WEB_CONFIGS.JOB_BUS_BROKER}")
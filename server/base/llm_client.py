@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@File    :   llm_client.py
+@Time    :   2024/09/20
+@Project :   https://github.com/PeterH0323/Streamer-Sales
+@Author  :   HinGwenWong
+@Version :   1.0
+@Desc    :   异步 LLM 客户端，对接 lmdeploy 的 OpenAI 兼容接口，支持逐 token 流式返回
+"""
+
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Dict, List
+
+from loguru import logger
+
+from ..web_configs import API_CONFIG
+from .http_client import LLM_CLIENT, AsyncServiceClient
+
+
+class AsyncLLMClient:
+
+    def __init__(self, base_url: str, service_client: AsyncServiceClient, model_list_ttl: float) -> None:
+        """
+        Args:
+            base_url (str): LLM 服务地址，e.g. http://0.0.0.0:23333
+            service_client (AsyncServiceClient): 复用连接池的 http client
+            model_list_ttl (float): 模型列表缓存时间，单位秒
+        """
+        self.base_url = base_url.rstrip("/")
+        self.service_client = service_client
+        self.model_list_ttl = model_list_ttl
+
+        self._model_list = []
+        self._model_list_time = 0.0
+        self._model_list_lock = asyncio.Lock()
+
+    async def available_models(self) -> List[str]:
+        """获取模型列表，结果缓存 model_list_ttl 秒，避免每次推理前多一次请求"""
+        if len(self._model_list) > 0 and time.monotonic() - self._model_list_time < self.model_list_ttl:
+            return self._model_list
+
+        async with self._model_list_lock:
+            # 等锁期间其他协程可能已经更新
+            if len(self._model_list) > 0 and time.monotonic() - self._model_list_time < self.model_list_ttl:
+                return self._model_list
+
+            res = await self.service_client.get(f"{self.base_url}/v1/models")
+            self._model_list = [model_info["id"] for model_info in res.json()["data"]]
+            self._model_list_time = time.monotonic()
+            logger.info(f"LLM available models: {self._model_list}")
+
+        return self._model_list
+
+    async def chat_completions_stream(self, messages: List[Dict[str, str]], **gen_kwargs) -> AsyncIterator[str]:
+        """流式推理，逐个返回增量文本。
+
+        调用方停止迭代（e.g. SSE 客户端断开导致协程被取消）时会关闭到 LLM 服务的连接，LLM 服务随之停止生成。
+
+        Args:
+            messages (List[Dict[str, str]]): prompt，OpenAI 格式
+            gen_kwargs: 其他推理参数，e.g. top_p, temperature
+
+        Yields:
+            str: 增量文本
+        """
+        model_name = (await self.available_models())[0]
+        request_json = {"model": model_name, "messages": messages, "stream": True, **gen_kwargs}
+
+        async with self.service_client.stream("POST", f"{self.base_url}/v1/chat/completions", json=request_json) as res:
+            async for line in res.aiter_lines():
+                # SSE 格式：data: {...}，以 data: [DONE] 结束
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+
+                item = json.loads(data)
+                if len(item["choices"]) == 0:
+                    continue
+                delta = item["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    async def chat_completions(self, messages: List[Dict[str, str]], **gen_kwargs) -> str:
+        """非流式推理，返回完整文本"""
+        model_name = (await self.available_models())[0]
+        request_json = {"model": model_name, "messages": messages, "stream": False, **gen_kwargs}
+
+        res = await self.service_client.post(f"{self.base_url}/v1/chat/completions", json=request_json)
+        return res.json()["choices"][0]["message"]["content"]
+
+
+ASYNC_LLM_CLIENT = AsyncLLMClient(API_CONFIG.LLM_URL, LLM_CLIENT, API_CONFIG.LLM_MODEL_LIST_TTL)
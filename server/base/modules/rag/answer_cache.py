@@ -0,0 +1,141 @@
+"""直播间问答语义缓存
+
+直播间观众会反复询问相同的问题（e.g. 多少钱、包邮吗、什么时候发货），
+对问题进行向量化，与同一主播、同一商品下已经回答过的问题比较相似度，超过阈值直接复用之前的回答文本和数字人视频，
+不再调用 Agent、RAG、LLM、TTS 和数字人。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+
+@dataclass
+class AnswerCacheEntry:
+    question: str
+    answer: str
+    video_url: str  # 数字人视频服务器地址
+    created_time: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+@dataclass
+class AnswerCacheQuery:
+    """一次问题查询的结果，未命中时在生成回答后用于写入缓存"""
+
+    partition: str
+    question: str
+    embedding: np.ndarray | None
+    hit: AnswerCacheEntry | None = None
+    cacheable: bool = True  # 依赖实时信息的回答（e.g. Agent 查询的天气、快递时间）不缓存
+    similarity: float = 0.0
+
+
+class SemanticAnswerCache:
+    """按 主播 + 商品 分区的问答语义缓存"""
+
+    def __init__(self, embeddings, similarity_threshold: float, max_entries_per_partition: int, ttl: float) -> None:
+        """
+        Args:
+            embeddings (HuggingFaceEmbeddings): 向量化模型，复用 RAG 的 embedding 模型，输出为归一化向量
+            similarity_threshold (float): 余弦相似度超过该值视为相同问题
+            max_entries_per_partition (int): 每个商品最多缓存的问题数，超出淘汰最久未命中的
+            ttl (float): 缓存有效时间，单位秒
+        """
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.max_entries_per_partition = max_entries_per_partition
+        self.ttl = ttl
+
+        self._partitions: Dict[str, OrderedDict[int, tuple[np.ndarray, AnswerCacheEntry]]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_partition(streamer_id: int, product_id: int) -> str:
+        return f"{streamer_id}-{product_id}"
+
+    def embed(self, question: str) -> np.ndarray:
+        return np.asarray(self.embeddings.embed_query(question.strip()), dtype=np.float32)
+
+    def lookup(self, streamer_id: int, product_id: int, question: str) -> AnswerCacheQuery:
+        """查找相似问题，embedding 模型推理耗时，需要在线程中调用"""
+        partition = self.make_partition(streamer_id, product_id)
+        embedding = self.embed(question)
+        query = AnswerCacheQuery(partition=partition, question=question, embedding=embedding)
+
+        with self._lock:
+            entries = self._partitions.get(partition)
+            if entries is not None:
+                self._remove_expired(entries)
+
+            if entries is None or len(entries) == 0:
+                self.misses += 1
+                return query
+
+            entry_ids = list(entries.keys())
+            similarities = np.stack([entries[entry_id][0] for entry_id in entry_ids]) @ embedding
+            best_idx = int(np.argmax(similarities))
+            query.similarity = float(similarities[best_idx])
+            if query.similarity < self.similarity_threshold:
+                self.misses += 1
+                return query
+
+            entry_id = entry_ids[best_idx]
+            entries.move_to_end(entry_id)
+            query.hit = entries[entry_id][1]
+            query.hit.hits += 1
+            self.hits += 1
+
+        logger.info(f"answer cache hit: {question} -> {query.hit.question}, similarity = {query.similarity:.4f}")
+        return query
+
+    def put(self, query: AnswerCacheQuery, answer: str, video_url: str):
+        if not query.cacheable or query.embedding is None or answer == "" or video_url == "":
+            return
+
+        with self._lock:
+            entries = self._partitions.setdefault(query.partition, OrderedDict())
+            entries[self._next_id] = (query.embedding, AnswerCacheEntry(question=query.question, answer=answer, video_url=video_url))
+            self._next_id += 1
+            while len(entries) > self.max_entries_per_partition:
+                entries.popitem(last=False)
+
+    def invalidate(self, streamer_id: int | None = None, product_id: int | None = None):
+        """商品信息或主播信息（音色、形象）修改后，相关的回答不再有效"""
+        with self._lock:
+            for partition in list(self._partitions.keys()):
+                partition_streamer_id, partition_product_id = partition.split("-")
+                if streamer_id is not None and partition_streamer_id != str(streamer_id):
+                    continue
+                if product_id is not None and partition_product_id != str(product_id):
+                    continue
+                self._partitions.pop(partition)
+
+    def _remove_expired(self, entries: OrderedDict):
+        now = time.time()
+        expired_ids = [entry_id for entry_id, (_, entry) in entries.items() if now - entry.created_time > self.ttl]
+        for entry_id in expired_ids:
+            entries.pop(entry_id)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = sum([len(entries) for entries in self._partitions.values()])
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total > 0 else 0.0, "entries": entries}
+
+    def list_entries(self, streamer_id: int, product_id: int) -> List[dict]:
+        with self._lock:
+            entries = self._partitions.get(self.make_partition(streamer_id, product_id), OrderedDict())
+            return [
+                {"question": entry.question, "answer": entry.answer, "video_url": entry.video_url, "hits": entry.hits}
+                for _, entry in entries.values()
+            ]
@@ -248,6 +248,46 @@ class FeatureStore:
             documents.append(chunk)
         return documents
 
+    def get_response_documents(self, file: FileName, file_opr: FileOperation) -> List[Document]:
+        """Split one preprocessed file into documents for the response
+        pipeline."""
+        if file._type == "md":
+            md_documents, md_length = self.get_md_documents(file)
+            logger.info("{} content length {}".format(file._type, md_length))
+            file.reason = str(md_length)
+            return md_documents
+
+        # now read pdf/word/excel/ppt text
+        text, error = file_opr.read(file.copypath)
+        if error is not None:
+            file.state = False
+            file.reason = str(error)
+            return []
+        file.reason = str(len(text))
+        logger.info("{} content length {}".format(file._type, len(text)))
+        text = file.prefix + text
+        return self.get_text_documents(text, file)
+
+    def get_reject_documents(self, file: FileName, file_opr: FileOperation) -> List[Document]:
+        """Split one preprocessed file into documents for the reject
+        pipeline."""
+        if file._type == "md":
+            # reject base not clean md
+            text = file.basename + "\n"
+            with open(file.copypath, encoding="utf8") as f:
+                text += f.read()
+            if len(text) <= 1:
+                return []
+
+            chunks = self.split_md(text=text, source=os.path.abspath(file.copypath))
+            return [Document(page_content=chunk, metadata={"source": file.basename, "read": file.copypath}) for chunk in chunks]
+
+        text, error = file_opr.read(file.copypath)
+        if error is not None:
+            return []
+        text = file.basename + text
+        return self.get_text_documents(text, file)
+
     def ingress_response(self, files: list, work_dir: str):
         """Extract the features required for the response pipeline based on the
         document."""
@@ -263,24 +303,7 @@ class FeatureStore:
             logger.debug("{}/{}.. {}".format(i + 1, len(files), file.basename))
             if not file.state:
                 continue
-
-            if file._type == "md":
-                md_documents, md_length = self.get_md_documents(file)
-                documents += md_documents
-                logger.info("{} content length {}".format(file._type, md_length))
-                file.reason = str(md_length)
-
-            else:
-                # now read pdf/word/excel/ppt text
-                text, error = file_opr.read(file.copypath)
-                if error is not None:
-                    file.state = False
-                    file.reason = str(error)
-                    continue
-                file.reason = str(len(text))
-                logger.info("{} content length {}".format(file._type, len(text)))
-                text = file.prefix + text
-                documents += self.get_text_documents(text, file)
+            documents += self.get_response_documents(file, file_opr)
 
         if len(documents) < 1:
             return
@@ -301,32 +324,42 @@ class FeatureStore:
         for i, file in enumerate(files):
             if not file.state:
                 continue
-
-            if file._type == "md":
-                # reject base not clean md
-                text = file.basename + "\n"
-                with open(file.copypath, encoding="utf8") as f:
-                    text += f.read()
-                if len(text) <= 1:
-                    continue
-
-                chunks = self.split_md(text=text, source=os.path.abspath(file.copypath))
-                for chunk in chunks:
-                    new_doc = Document(page_content=chunk, metadata={"source": file.basename, "read": file.copypath})
-                    documents.append(new_doc)
-
-            else:
-                text, error = file_opr.read(file.copypath)
-                if error is not None:
-                    continue
-                text = file.basename + text
-                documents += self.get_text_documents(text, file)
+            documents += self.get_reject_documents(file, file_opr)
 
         if len(documents) < 1:
             return
         vs = Vectorstore.from_documents(documents, self.embeddings)
         vs.save_local(feature_dir)
 
+    def preprocess_file(self, file: FileName, copypath: str):
+        """Preprocess a single file to `copypath` in the calling process.
+
+        Used by incremental updates, where spawning a process pool for one
+        file costs more than reading it.
+        """
+        file.copypath = copypath
+        if not os.path.exists(file.origin):
+            file.state = False
+            file.reason = "skip not exist"
+            return
+
+        if file._type in ["pdf", "word", "excel", "ppt", "html"]:
+            read_and_save(file)
+        elif file._type in ["md", "text"]:
+            if not os.path.exists(file.copypath):
+                shutil.copy(file.origin, file.copypath)
+        else:
+            file.state = False
+            file.reason = "skip unknown format"
+            return
+
+        if os.path.exists(file.copypath):
+            file.state = True
+            file.reason = "preprocessed"
+        else:
+            file.state = False
+            file.reason = "read error"
+
     def preprocess(self, files: list, work_dir: str):
         """Preprocesses files in a given directory. Copies each file to
         'preprocess' with new name formed by joining all subdirectories with
@@ -0,0 +1,192 @@
+"""RAG 向量库后台构建
+
+每个用户一个构建器，商品修改后的向量库更新放到后台任务中执行，接口直接返回：
+1. 有变化的商品在新目录中生成子向量库，正在使用的子向量库不受影响；
+2. 原子替换 product_index.json 和内存中商品到子向量库的映射，之后的查询使用新的子向量库，进行中的查询在旧的 Retriever 上完成；
+3. 已加载的商品 Retriever 提前替换为新版本，不再使用的子向量库延后到下一次构建时删除。
+
+构建期间收到的更新会排队，下一次构建时合并处理。
+"""
+
+import asyncio
+import shutil
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from loguru import logger
+
+from .feature_store import FeatureStore
+from .product_index import ProductVectorIndex
+
+
+@dataclass
+class RagIndexJob:
+    action: str  # upsert / delete / sync / rebuild
+    product_id: int | None = None
+    instruction_path: str | Path | None = None
+    instruction_paths: Dict[int, str | Path] | None = None  # sync / rebuild 使用，商品 ID -> 说明书本地路径
+    remove_missing: bool = True  # sync 使用，是否删除不在商品列表中的商品
+
+
+@dataclass
+class RagIndexBuildStatus:
+    state: str = "idle"  # idle / building / failed
+    current_version: str = ""  # 正在使用的版本
+    building_version: str = ""  # 正在构建的版本
+    pending_jobs: int = 0  # 等待构建的更新个数
+    product_num: int = 0  # 有子向量库的商品数
+    last_build_time: float = 0.0  # 最近一次构建结束的时间戳
+    last_build_sec: float = 0.0  # 最近一次构建耗时，单位秒
+    last_error: str = ""
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class RagIndexBuilder:
+    """后台构建一个用户的商品向量库，构建完成后原子替换正在使用的版本"""
+
+    def __init__(self, feature_store: FeatureStore, work_dir: str, on_swap: Callable[[Dict[str, str], set], None]) -> None:
+        """
+        Args:
+            feature_store (FeatureStore): 切片和向量化工具
+            work_dir (str): 该用户的向量库目录
+            on_swap (Callable[[Dict[str, str], set], None]): 新版本生效后的回调，在后台线程中调用，
+                参数为 商品 ID -> 子向量库目录 的映射和有变化的商品 ID
+        """
+        self.feature_store = feature_store
+        self.work_dir = Path(work_dir).absolute()
+        self.on_swap = on_swap
+
+        index = ProductVectorIndex(feature_store, str(self.work_dir))
+        self.product_dirs = index.product_dirs()
+        self.status = RagIndexBuildStatus(current_version=index.version, product_num=len(self.product_dirs))
+
+        # 上一个版本使用、当前版本不再使用的子向量库和预处理文本，可能还有查询正在读取，下一次构建时再删除
+        self._retired_dirs = set()
+        self._retired_files = set()
+        self._remove_unused_files(index)
+
+        self._queue: asyncio.Queue[RagIndexJob | None] = asyncio.Queue()
+        self._worker_task: asyncio.Task | None = None
+
+    def get_product_dir(self, product_id: int | str) -> str | None:
+        """商品子向量库目录，没有时返回 None"""
+        return self.product_dirs.get(str(product_id))
+
+    def start(self):
+        self._worker_task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._worker_task is None:
+            return
+        await self._queue.put(None)
+        await self._worker_task
+        self._worker_task = None
+
+    def submit(self, job: RagIndexJob) -> dict:
+        """提交更新，立即返回当前构建状态"""
+        self._queue.put_nowait(job)
+        self.status.pending_jobs += 1
+        return self.status.to_dict()
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                # 退出信号
+                break
+
+            # 合并排队中的更新，一次构建一个版本
+            jobs = [job]
+            stop_flag = False
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job is None:
+                    stop_flag = True
+                    break
+                jobs.append(job)
+
+            await self._build(jobs)
+            if stop_flag:
+                break
+
+    async def _build(self, jobs: List[RagIndexJob]):
+        version = f"v{time.time_ns()}"
+        self.status.state = "building"
+        self.status.building_version = version
+        start_time = time.time()
+        try:
+            changed = await asyncio.to_thread(self._build_version, version, jobs)
+        except Exception as e:
+            logger.exception(f"build rag index {version} for {self.work_dir} failed")
+            self.status.state = "failed"
+            self.status.last_error = repr(e)
+        else:
+            self.status.state = "idle"
+            self.status.last_error = ""
+            if changed:
+                logger.info(f"rag index {self.work_dir} switched to {version}")
+        finally:
+            self.status.pending_jobs = max(0, self.status.pending_jobs - len(jobs))
+            self.status.building_version = ""
+            self.status.last_build_time = time.time()
+            self.status.last_build_sec = self.status.last_build_time - start_time
+
+    def _build_version(self, version: str, jobs: List[RagIndexJob]) -> bool:
+        """生成有变化商品的子向量库，有变化则切换到新版本
+
+        Returns:
+            bool: 向量库是否有变化
+        """
+        index = ProductVectorIndex(self.feature_store, str(self.work_dir), build_version=version)
+        old_files = index.referenced_files()
+
+        # 全量重建之前的更新都会被覆盖
+        rebuild_idx = max([idx for idx, job in enumerate(jobs) if job.action == "rebuild"], default=-1)
+        if rebuild_idx >= 0:
+            jobs = jobs[rebuild_idx:]
+            index.clear()
+
+        changed = rebuild_idx >= 0
+        for job in jobs:
+            if job.action == "upsert":
+                changed |= index.upsert(job.product_id, job.instruction_path)
+            elif job.action == "delete":
+                changed |= index.delete(job.product_id)
+            elif job.action in ["sync", "rebuild"]:
+                changed |= index.sync(job.instruction_paths, remove_missing=job.remove_missing or job.action == "rebuild")
+            else:
+                logger.error(f"unknown rag index job: {job.action}")
+
+        if not changed:
+            return False
+
+        # 先落盘再切换内存中的映射，之后的查询都会使用新的子向量库
+        index.save(version)
+        old_dirs = set(self.product_dirs.values())
+        self.product_dirs = index.product_dirs()
+        self.status.current_version = version
+        self.status.product_num = len(self.product_dirs)
+
+        # 已加载的 Retriever 提前替换，查询不用再等待加载
+        self.on_swap(self.product_dirs, index.changed_products)
+
+        self._retired_dirs = old_dirs - set(self.product_dirs.values())
+        self._retired_files = old_files - index.referenced_files()
+        self._remove_unused_files(index)
+        return True
+
+    def _remove_unused_files(self, index: ProductVectorIndex):
+        """删除当前版本和上一个版本都不使用的子向量库和预处理文本"""
+        keep_dirs = set(self.product_dirs.values()) | self._retired_dirs
+        for index_dir in index.products_dir.iterdir():
+            if str(index_dir) not in keep_dirs:
+                shutil.rmtree(index_dir, ignore_errors=True)
+
+        keep_files = index.referenced_files() | self._retired_files
+        for file_path in index.preprocess_dir.iterdir():
+            if str(file_path) not in keep_files:
+                file_path.unlink(missing_ok=True)
@@ -0,0 +1,212 @@
+"""商品说明书向量库增量维护
+
+按商品划分子向量库，每个商品说明书的切片单独存放在 `products/{product_id}-{内容 hash}-{构建版本}` 中（db_response + db_reject），
+检索时只查询该商品的子向量库，检索耗时与商品总数无关。
+商品与子向量库的映射保存在 `product_index.json`，新增、修改商品时只对该商品的说明书进行切片和向量化，说明书内容不变时跳过；
+子向量库生成后不再修改，每次构建都写到新目录，新旧版本可以同时存在，替换时不影响正在进行的查询。
+"""
+
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict
+
+from langchain.vectorstores.faiss import FAISS as Vectorstore
+from loguru import logger
+
+from .feature_store import FeatureStore
+from .file_operation import FileName, FileOperation
+
+INDEX_FILE_NAME = "product_index.json"
+PRODUCTS_DIR_NAME = "products"
+PREPROCESS_DIR_NAME = "preprocess"
+RESPONSE_DB_NAME = "db_response"
+REJECT_DB_NAME = "db_reject"
+TMP_FILE_SUFFIX = ".tmp"
+
+
+def hash_file(file_path: str | Path) -> str:
+    hash_object = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            hash_object.update(chunk)
+    return hash_object.hexdigest()
+
+
+@dataclass
+class ProductIndexEntry:
+    instruction: str  # 说明书文件名
+    content_hash: str  # 说明书内容 hash
+    index_dir: str = ""  # 子向量库目录，说明书没有可用内容时为空
+    copypath: str = ""  # 预处理后的文本路径
+    response_chunks: int = 0
+    reject_chunks: int = 0
+
+
+class ProductVectorIndex:
+    """按商品划分、增量维护的说明书向量库"""
+
+    def __init__(self, feature_store: FeatureStore, work_dir: str, build_version: str = "") -> None:
+        """
+        Args:
+            feature_store (FeatureStore): 切片和向量化工具
+            work_dir (str): 向量库目录
+            build_version (str, optional): 本次构建的版本，用于子向量库目录名，为空时按当前时间生成. Defaults to "".
+        """
+        self.feature_store = feature_store
+        self.build_version = build_version or f"v{time.time_ns()}"
+        self.work_dir = Path(work_dir).absolute()
+        self.index_path = self.work_dir.joinpath(INDEX_FILE_NAME)
+        self.products_dir = self.work_dir.joinpath(PRODUCTS_DIR_NAME)
+        self.preprocess_dir = self.work_dir.joinpath(PREPROCESS_DIR_NAME)
+        self.file_opr = FileOperation()
+
+        self.version = ""
+        self.entries: Dict[str, ProductIndexEntry] = {}
+        if self.index_path.exists():
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index_info = json.load(f)
+            self.version = index_info["version"]
+            self.entries = {product_id: ProductIndexEntry(**entry) for product_id, entry in index_info["products"].items()}
+
+        self.products_dir.mkdir(parents=True, exist_ok=True)
+        self.preprocess_dir.mkdir(parents=True, exist_ok=True)
+
+        # 本次有变化的商品
+        self.changed_products = set()
+
+    def upsert(self, product_id: int, instruction_path: str | Path) -> bool:
+        """新增或更新商品说明书的子向量库
+
+        Args:
+            product_id (int): 商品 ID
+            instruction_path (str | Path): 说明书本地路径
+
+        Returns:
+            bool: 向量库是否有变化
+        """
+        product_id = str(product_id)
+        instruction_path = Path(instruction_path)
+        if not instruction_path.exists():
+            logger.warning(f"instruction of product {product_id} not exist: {instruction_path}")
+            return self.delete(product_id)
+
+        content_hash = hash_file(instruction_path)
+        entry = self.entries.get(product_id)
+        if entry is not None and entry.content_hash == content_hash:
+            return False
+
+        _type = self.file_opr.get_type(instruction_path.name)
+        file = FileName(root=str(instruction_path.parent), filename=instruction_path.name, _type=_type)
+        entry = ProductIndexEntry(instruction=instruction_path.name, content_hash=content_hash)
+        self.entries[product_id] = entry
+        self.changed_products.add(product_id)
+
+        if _type is None:
+            logger.warning(f"instruction of product {product_id} is unknown format: {instruction_path}")
+            return True
+
+        # 预处理文本名带上原文件后缀，读取时根据后缀判断文件类型
+        copy_suffix = instruction_path.suffix if _type in ["md", "text"] else ".text"
+        copypath = self.preprocess_dir.joinpath(f"{content_hash[:16]}{copy_suffix}")
+        if copypath.exists():
+            # 内容相同的预处理文本可能正在被上一个版本的 Retriever 读取，直接复用，不再改写
+            file.copypath = str(copypath)
+            file.state = True
+        else:
+            # 先写到临时文件再重命名，读取方不会读到写了一半的文本
+            tmp_path = copypath.with_name(copypath.name + TMP_FILE_SUFFIX)
+            tmp_path.unlink(missing_ok=True)
+            self.feature_store.preprocess_file(file, str(tmp_path))
+            if file.state:
+                os.replace(tmp_path, copypath)
+                file.copypath = str(copypath)
+        if not file.state:
+            logger.warning(f"preprocess instruction of product {product_id} failed: {file.reason}")
+            return True
+        entry.copypath = file.copypath
+
+        response_documents = self.feature_store.get_response_documents(file, self.file_opr)
+        reject_documents = self.feature_store.get_reject_documents(file, self.file_opr)
+        if len(response_documents) == 0 or len(reject_documents) == 0:
+            logger.warning(f"instruction of product {product_id} has no content: {instruction_path}")
+            return True
+
+        # 目录名带上构建版本，全量重建或说明书改回旧内容时也不会改写正在使用的目录
+        index_dir = self.products_dir.joinpath(f"{product_id}-{content_hash[:16]}-{self.build_version}")
+        Vectorstore.from_documents(response_documents, self.feature_store.embeddings).save_local(
+            str(index_dir.joinpath(RESPONSE_DB_NAME))
+        )
+        Vectorstore.from_documents(reject_documents, self.feature_store.embeddings).save_local(
+            str(index_dir.joinpath(REJECT_DB_NAME))
+        )
+
+        entry.index_dir = str(index_dir)
+        entry.response_chunks = len(response_documents)
+        entry.reject_chunks = len(reject_documents)
+        logger.info(f"rag index upsert product {product_id}: {entry.response_chunks} response chunks, {entry.reject_chunks} reject chunks")
+        return True
+
+    def delete(self, product_id: int) -> bool:
+        """删除商品说明书的子向量库，目录在不再被使用后由调用方清理
+
+        Returns:
+            bool: 向量库是否有变化
+        """
+        product_id = str(product_id)
+        if product_id not in self.entries:
+            return False
+
+        self.entries.pop(product_id)
+        self.changed_products.add(product_id)
+        logger.info(f"rag index delete product {product_id}")
+        return True
+
+    def clear(self):
+        """清空所有商品，用于全量重新生成"""
+        self.changed_products.update(self.entries.keys())
+        self.entries.clear()
+
+    def sync(self, instruction_paths: Dict[int, str | Path], remove_missing: bool = True) -> bool:
+        """与商品列表同步，只处理说明书有变化的商品
+
+        Args:
+            instruction_paths (Dict[int, str | Path]): 商品 ID -> 说明书本地路径
+            remove_missing (bool, optional): 是否删除不在商品列表中的商品. Defaults to True.
+
+        Returns:
+            bool: 向量库是否有变化
+        """
+        changed = False
+        if remove_missing:
+            keep_ids = set([str(product_id) for product_id in instruction_paths])
+            for product_id in [product_id for product_id in self.entries if product_id not in keep_ids]:
+                changed |= self.delete(product_id)
+
+        for product_id, instruction_path in instruction_paths.items():
+            changed |= self.upsert(product_id, instruction_path)
+        return changed
+
+    def save(self, version: str):
+        """原子替换商品到子向量库的映射"""
+        self.version = version
+        tmp_path = self.index_path.with_name(INDEX_FILE_NAME + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": version, "products": {product_id: asdict(entry) for product_id, entry in self.entries.items()}},
+                f,
+                ensure_ascii=False,
+                indent=4,
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def product_dirs(self) -> Dict[str, str]:
+        """商品 ID -> 子向量库目录，没有可用内容的商品不在其中"""
+        return {product_id: entry.index_dir for product_id, entry in self.entries.items() if entry.index_dir != ""}
+
+    def referenced_files(self) -> set:
+        """切片引用的预处理文本，其余的可以清理"""
+        return set([entry.copypath for entry in self.entries.values() if entry.copypath != ""])
@@ -1,13 +1,19 @@
 import shutil
+from functools import partial
 from pathlib import Path
+from typing import Dict
 
 import torch
 from loguru import logger
 
 from ....web_configs import WEB_CONFIGS
-from ...database.product_db import get_db_product_info
-from .feature_store import gen_vector_db
-from .retriever import CacheRetriever
+from ...database.product_db import get_db_product_info, get_db_product_user_ids
+from ...models.product_model import ProductInfo
+from .answer_cache import SemanticAnswerCache
+from .feature_store import FeatureStore, fix_system_error
+from .index_builder import RagIndexBuilder, RagIndexJob
+from .product_index import INDEX_FILE_NAME
+from .retriever import CacheRetriever, Retriever
 
 # 基础配置
 CONTEXT_MAX_LENGTH = 3000  # 上下文最大长度
@@ -16,18 +22,54 @@ GENERATE_TEMPLATE = "这是说明书：“{}”\n 客户的问题：“{}” \n
 # RAG 实例句柄
 RAG_RETRIEVER = None
 
+# 说明书向量库按用户划分，每个用户一个后台构建器，key 为用户 ID
+RAG_FEATURE_STORE: FeatureStore | None = None
+RAG_INDEX_BUILDERS: Dict[str, RagIndexBuilder] = {}
 
-def build_rag_prompt(rag_retriever: CacheRetriever, product_name, prompt):
+# 直播间问答语义缓存，复用 RAG 的 embedding 模型
+ANSWER_CACHE: SemanticAnswerCache | None = None
 
-    real_retriever = rag_retriever.get(fs_id="default")
 
-    if isinstance(real_retriever, tuple):
-        logger.info(f" @@@ GOT real_retriever == tuple : {real_retriever}")
-        return ""
+def make_rag_fs_id(user_id: int | str, product_id: int | str) -> str:
+    return f"{user_id}-{product_id}"
+
+
+def get_product_retriever(user_id: int | str, product_id: int | str) -> Retriever | None:
+    """获取商品子向量库的 retriever，只检索该商品说明书的切片"""
+    builder = RAG_INDEX_BUILDERS.get(str(user_id))
+    if RAG_RETRIEVER is None or builder is None:
+        return None
 
-    chunk, db_context, references = real_retriever.query(
-        f"商品名：{product_name}。{prompt}", context_max_length=CONTEXT_MAX_LENGTH - 2 * len(GENERATE_TEMPLATE)
+    product_dir = builder.get_product_dir(product_id)
+    if product_dir is None:
+        return None
+
+    retriever = RAG_RETRIEVER.get(
+        fs_id=make_rag_fs_id(user_id, product_id), config_path=WEB_CONFIGS.RAG_CONFIG_PATH, work_dir=product_dir
     )
+    if isinstance(retriever, tuple):
+        logger.info(f" @@@ GOT real_retriever == tuple : {retriever}")
+        return None
+    return retriever
+
+
+def build_rag_prompt(user_id: int | str, product_id: int | str, prompt: str) -> str:
+    """检索商品说明书，生成 RAG prompt
+
+    Args:
+        user_id (int | str): 商品所属的用户 ID
+        product_id (int | str): 商品 ID
+        prompt (str): 客户的问题
+
+    Returns:
+        str: RAG prompt，没有该商品的向量库时返回空字符串
+    """
+    real_retriever = get_product_retriever(user_id, product_id)
+    if real_retriever is None:
+        logger.info(f"no rag database for user {user_id} product {product_id}")
+        return ""
+
+    chunk, db_context, references = real_retriever.query(prompt, context_max_length=CONTEXT_MAX_LENGTH - 2 * len(GENERATE_TEMPLATE))
     logger.info(f"db_context = {db_context}")
 
     if db_context is not None and len(db_context) > 1:
@@ -42,81 +84,140 @@ def build_rag_prompt(rag_retriever: CacheRetriever, product_name, prompt):
     return prompt_rag
 
 
-def init_rag_retriever(rag_config: str, db_path: str):
-    torch.cuda.empty_cache()
+def invalidate_answer_cache(streamer_id: int | None = None, product_id: int | None = None):
+    """清除主播或商品相关的问答缓存"""
+    if ANSWER_CACHE is not None:
+        ANSWER_CACHE.invalidate(streamer_id=streamer_id, product_id=product_id)
 
-    retriever = CacheRetriever(config_path=rag_config)
 
-    # 初始化
-    retriever.get(fs_id="default", config_path=rag_config, work_dir=db_path)
+def get_instruction_local_path(product_info: ProductInfo) -> Path:
+    """说明书本地路径"""
+    return Path(
+        WEB_CONFIGS.SERVER_FILE_ROOT,
+        WEB_CONFIGS.PRODUCT_FILE_DIR,
+        WEB_CONFIGS.INSTRUCTIONS_DIR,
+        Path(product_info.instruction).name,
+    )
 
-    return retriever
 
+def swap_rag_retrievers(user_id: str, product_dirs: Dict[str, str], product_ids: set):
+    """新版本向量库生效后，替换已加载的商品 retriever"""
+    for product_id in product_ids:
+        RAG_RETRIEVER.swap(make_rag_fs_id(user_id, product_id), WEB_CONFIGS.RAG_CONFIG_PATH, product_dirs.get(product_id))
 
-async def gen_rag_db(user_id, force_gen=False):
-    """
-    生成向量数据库。
 
-    参数:
-    force_gen - 布尔值，当设置为 True 时，即使数据库已存在也会重新生成数据库。
-    """
+def get_rag_index_builder(user_id: int | str) -> RagIndexBuilder | None:
+    """获取用户的向量库构建器，没有时新建，需要在事件循环中调用"""
+    if RAG_FEATURE_STORE is None:
+        return None
+
+    user_id = str(user_id)
+    if user_id not in RAG_INDEX_BUILDERS:
+        builder = RagIndexBuilder(
+            RAG_FEATURE_STORE, str(Path(WEB_CONFIGS.RAG_VECTOR_DB_DIR, user_id)), on_swap=partial(swap_rag_retrievers, user_id)
+        )
+        builder.start()
+        RAG_INDEX_BUILDERS[user_id] = builder
+    return RAG_INDEX_BUILDERS[user_id]
 
-    # 检查数据库目录是否存在，如果存在且force_gen为False，则不执行生成操作
-    if Path(WEB_CONFIGS.RAG_VECTOR_DB_DIR).exists() and not force_gen:
-        return
 
-    if force_gen and Path(WEB_CONFIGS.RAG_VECTOR_DB_DIR).exists():
-        shutil.rmtree(WEB_CONFIGS.RAG_VECTOR_DB_DIR)
+def get_rag_build_status(user_id: int | str) -> dict:
+    """用户的向量库构建状态"""
+    builder = RAG_INDEX_BUILDERS.get(str(user_id))
+    if builder is None:
+        return {}
+    return builder.status.to_dict()
 
-    # 仅仅遍历 instructions 字段里面的文件
-    if Path(WEB_CONFIGS.PRODUCT_INSTRUCTION_DIR_GEN_DB_TMP).exists():
-        shutil.rmtree(WEB_CONFIGS.PRODUCT_INSTRUCTION_DIR_GEN_DB_TMP)
-    Path(WEB_CONFIGS.PRODUCT_INSTRUCTION_DIR_GEN_DB_TMP).mkdir(exist_ok=True, parents=True)
 
-    # 读取 yaml 文件，获取所有说明书路径，并移动到 tmp 目录
+def get_rag_cache_stats() -> dict:
+    """问题向量、rerank 结果、说明书文本缓存的命中情况"""
+    if RAG_RETRIEVER is None:
+        return {}
+    return RAG_RETRIEVER.cache_stats()
+
+
+async def sync_rag_db(user_id, remove_missing=True):
+    """向量库与用户的商品列表同步，只对说明书有变化的商品重新向量化，在后台执行
+
+    Args:
+        user_id (int): 用户 ID
+        remove_missing (bool, optional): 是否删除已不在商品列表中的商品. Defaults to True.
+    """
+    builder = get_rag_index_builder(user_id)
+    if builder is None:
+        return
+
     product_list, _ = await get_db_product_info(user_id)
+    instruction_paths = {info.product_id: get_instruction_local_path(info) for info in product_list}
+    builder.submit(RagIndexJob(action="sync", instruction_paths=instruction_paths, remove_missing=remove_missing))
 
-    for info in product_list:
 
-        shutil.copyfile(
-            Path(
-                WEB_CONFIGS.SERVER_FILE_ROOT,
-                WEB_CONFIGS.PRODUCT_FILE_DIR,
-                WEB_CONFIGS.INSTRUCTIONS_DIR,
-                Path(info.instruction).name,
-            ),
-            Path(WEB_CONFIGS.PRODUCT_INSTRUCTION_DIR_GEN_DB_TMP).joinpath(Path(info.instruction).name),
-        )
+async def upsert_rag_product(user_id, product_info: ProductInfo):
+    """新增或修改商品后，只更新该商品说明书的子向量库，在后台执行"""
+    builder = get_rag_index_builder(user_id)
+    if builder is None:
+        return
 
-    logger.info("Generating rag database, pls wait ...")
-    # 调用函数生成向量数据库
-    gen_vector_db(
-        WEB_CONFIGS.RAG_CONFIG_PATH,
-        str(Path(WEB_CONFIGS.PRODUCT_INSTRUCTION_DIR_GEN_DB_TMP).absolute()),
-        WEB_CONFIGS.RAG_VECTOR_DB_DIR,
+    builder.submit(
+        RagIndexJob(action="upsert", product_id=product_info.product_id, instruction_path=get_instruction_local_path(product_info))
     )
 
-    # 删除过程文件
-    shutil.rmtree(WEB_CONFIGS.PRODUCT_INSTRUCTION_DIR_GEN_DB_TMP)
 
+async def delete_rag_product(user_id, product_id: int):
+    """删除商品后，删除该商品说明书的子向量库，在后台执行"""
+    builder = get_rag_index_builder(user_id)
+    if builder is None:
+        return
+
+    builder.submit(RagIndexJob(action="delete", product_id=product_id))
+
+
+async def load_rag_model():
 
-async def load_rag_model(user_id):
+    global RAG_RETRIEVER, RAG_FEATURE_STORE, ANSWER_CACHE
 
-    global RAG_RETRIEVER
+    # 解决 faiss 导入问题
+    fix_system_error()
+    torch.cuda.empty_cache()
+
+    # 加载 rag 模型，每个商品一个 retriever，按最久未使用淘汰
+    RAG_RETRIEVER = CacheRetriever(config_path=WEB_CONFIGS.RAG_CONFIG_PATH, max_len=WEB_CONFIGS.RAG_RETRIEVER_CACHE_SIZE)
+    RAG_FEATURE_STORE = FeatureStore(
+        embeddings=RAG_RETRIEVER.embeddings, reranker=RAG_RETRIEVER.reranker, config_path=WEB_CONFIGS.RAG_CONFIG_PATH
+    )
 
-    # 重新生成 RAG 向量数据库
-    await gen_rag_db(user_id)
+    # 旧版本生成的是所有商品共用的向量库，删除后按用户、商品重新生成
+    db_root = Path(WEB_CONFIGS.RAG_VECTOR_DB_DIR)
+    if any([db_root.joinpath(name).exists() for name in ["db_response", "CURRENT", INDEX_FILE_NAME]]):
+        logger.info(f"{db_root} is generated by old version, regenerate it")
+        shutil.rmtree(db_root)
 
-    # 加载 rag 模型
-    RAG_RETRIEVER = init_rag_retriever(rag_config=WEB_CONFIGS.RAG_CONFIG_PATH, db_path=WEB_CONFIGS.RAG_VECTOR_DB_DIR)
+    # 已有的向量库直接提供服务，再在后台与商品列表同步，说明书没有变化的商品不会重新向量化
+    for user_id in get_db_product_user_ids():
+        await sync_rag_db(user_id)
     logger.info("load rag model done !...")
 
+    if WEB_CONFIGS.RAG_ANSWER_CACHE_ENABLED:
+        ANSWER_CACHE = SemanticAnswerCache(
+            RAG_RETRIEVER.query_embeddings,
+            similarity_threshold=WEB_CONFIGS.RAG_ANSWER_CACHE_THRESHOLD,
+            max_entries_per_partition=WEB_CONFIGS.RAG_ANSWER_CACHE_MAX_ENTRIES,
+            ttl=WEB_CONFIGS.RAG_ANSWER_CACHE_TTL,
+        )
+
 
-async def rebuild_rag_db(user_id, db_name="default"):
+async def stop_rag_worker():
+    """等待正在进行的构建完成后退出"""
+    for builder in RAG_INDEX_BUILDERS.values():
+        await builder.stop()
 
-    # 重新生成 RAG 向量数据库
-    await gen_rag_db(user_id, force_gen=True)
 
-    # 重新加载 retriever
-    RAG_RETRIEVER.pop(db_name)
-    RAG_RETRIEVER.get(fs_id=db_name, config_path=WEB_CONFIGS.RAG_CONFIG_PATH, work_dir=WEB_CONFIGS.RAG_VECTOR_DB_DIR)
+async def rebuild_rag_db(user_id):
+    """全量重新生成用户的 RAG 向量数据库，在后台执行"""
+    builder = get_rag_index_builder(user_id)
+    if builder is None:
+        return
+
+    product_list, _ = await get_db_product_info(user_id)
+    instruction_paths = {info.product_id: get_instruction_local_path(info) for info in product_list}
+    builder.submit(RagIndexJob(action="rebuild", instruction_paths=instruction_paths))
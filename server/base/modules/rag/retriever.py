@@ -1,7 +1,11 @@
 """extract feature and search with user query."""
 
+import hashlib
 import os
+import threading
 import time
+from collections import OrderedDict
+from typing import List
 
 import numpy as np
 import yaml
@@ -10,6 +14,8 @@ from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.retrievers import ContextualCompressionRetriever
 from langchain.vectorstores.faiss import FAISS as Vectorstore
 from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from loguru import logger
 from modelscope import snapshot_download
 from sklearn.metrics import precision_recall_curve
@@ -18,13 +24,134 @@ from ....web_configs import WEB_CONFIGS
 from .file_operation import FileOperation
 
 
+class DocumentTextCache:
+    """Size bounded LRU cache of preprocessed document texts.
+
+    Keyed by path and mtime, so a file rewritten on disk is read again.
+    """
+
+    def __init__(self, max_chars: int) -> None:
+        self.max_chars = max_chars
+        self.cache = OrderedDict()
+        self.total_chars = 0
+        self.file_opr = FileOperation()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, filepath: str):
+        """Same as `FileOperation.read`, return (text, error)."""
+        try:
+            key = (filepath, os.stat(filepath).st_mtime_ns)
+        except OSError:
+            return "", None
+
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key], None
+            self.misses += 1
+
+        text, error = self.file_opr.read(filepath)
+        if error is not None or len(text) > self.max_chars:
+            return text, error
+
+        with self._lock:
+            if key not in self.cache:
+                self.cache[key] = text
+                self.total_chars += len(text)
+            while self.total_chars > self.max_chars:
+                _, old_text = self.cache.popitem(last=False)
+                self.total_chars -= len(old_text)
+        return text, None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "files": len(self.cache),
+            "chars": self.total_chars,
+        }
+
+
+# shared by all retrievers, chunks of different products may read the same file
+DOCUMENT_TEXT_CACHE = DocumentTextCache(max_chars=WEB_CONFIGS.RAG_DOC_TEXT_CACHE_MB * 1024 * 1024)
+
+
+class TTLCache:
+    """Thread safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self.cache.get(key)
+            if item is None or time.time() - item[1] > self.ttl:
+                if item is not None:
+                    self.cache.pop(key)
+                self.misses += 1
+                return None
+
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self.cache[key] = (value, time.time())
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total > 0 else 0.0, "size": len(self.cache)}
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Cache query embeddings, live chat repeats the same questions a lot.
+
+    Document embeddings are not cached, they are only computed when the
+    feature store is built.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: TTLCache) -> None:
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        embedding = self.cache.get(text)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(text)
+            self.cache.put(text, embedding)
+        return embedding
+
+
 class Retriever:
     """Tokenize and extract features from the project's documents, for use in
     the reject pipeline and response pipeline."""
 
-    def __init__(self, embeddings, reranker, work_dir: str, reject_throttle: float) -> None:
+    def __init__(self, embeddings, reranker, work_dir: str, reject_throttle: float, rerank_cache: TTLCache | None = None) -> None:
         """Init with model device type and config."""
         self.reject_throttle = reject_throttle
+        self.reranker = reranker
+        self.rerank_cache = rerank_cache
         self.rejecter = Vectorstore.load_local(
             os.path.join(work_dir, "db_reject"), embeddings=embeddings, allow_dangerous_deserialization=True
         )
@@ -35,6 +162,23 @@ class Retriever:
             distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
         ).as_retriever(search_type="similarity", search_kwargs={"score_threshold": 0.15, "k": 30})
         self.compression_retriever = ContextualCompressionRetriever(base_compressor=reranker, base_retriever=self.retriever)
+        self.preload_documents()
+
+    def preload_documents(self):
+        """Read source texts into `DOCUMENT_TEXT_CACHE` and record the offset
+        of every chunk in its source text, so `query` assembles the context
+        with a slice instead of reading files and searching the chunk."""
+        file_texts = dict()
+        for doc in self.retriever.vectorstore.docstore._dict.values():
+            if "read" not in doc.metadata:
+                continue
+            read_path = doc.metadata["read"]
+            if read_path not in file_texts:
+                file_texts[read_path] = DOCUMENT_TEXT_CACHE.read(read_path)
+            file_text, error = file_texts[read_path]
+            if error is not None:
+                continue
+            doc.metadata["offset"] = file_text.find(doc.page_content)
 
     def is_reject(self, question, k=30, disable_throttle=False):
         """If no search results below the threshold can be found from the
@@ -61,6 +205,27 @@ class Retriever:
             reject = False if len(ret) > 0 else True
             return reject, [top1]
 
+    def rerank(self, question: str, docs: List[Document]) -> List[Document]:
+        """Rerank candidates with the cross-encoder, the scores of the same
+        question and candidate set are cached."""
+        if self.rerank_cache is None or len(docs) == 0:
+            return self.reranker.compress_documents(docs, question)
+
+        key = hashlib.sha256("\x00".join([question] + [doc.page_content for doc in docs]).encode("utf-8")).hexdigest()
+        ranked = self.rerank_cache.get(key)
+        if ranked is None:
+            reranked_docs = self.reranker.compress_documents(docs, question)
+            doc_index = {doc.page_content: idx for idx, doc in enumerate(docs)}
+            self.rerank_cache.put(key, [(doc_index[doc.page_content], doc.metadata.get("relevance_score")) for doc in reranked_docs])
+            return reranked_docs
+
+        reranked_docs = []
+        for idx, score in ranked:
+            doc = docs[idx]
+            doc.metadata["relevance_score"] = score
+            reranked_docs.append(doc)
+        return reranked_docs
+
     def update_throttle(self, config_path: str = "config.yaml", good_questions=[], bad_questions=[]):
         """Update reject throttle based on positive and negative examples."""
 
@@ -116,7 +281,8 @@ class Retriever:
         # if reject:
         # return None, None, [docs[0][0].metadata['source']]
 
-        docs = self.compression_retriever.get_relevant_documents(question)
+        # same as `self.compression_retriever`, with rerank scores cached
+        docs = self.rerank(question, self.retriever.get_relevant_documents(question))
 
         print(f"DEBUG 1: {docs}")
 
@@ -128,7 +294,6 @@ class Retriever:
 
         # add file text to context, until exceed `context_max_length`
 
-        file_opr = FileOperation()
         for idx, doc in enumerate(docs):
             chunk = doc.page_content
             chunks.append(chunk)
@@ -138,7 +303,7 @@ class Retriever:
                     "If you are using the version before 20240319, please rerun `python3 -m huixiangdou.service.feature_store`"
                 )
                 raise Exception("huixiangdou version mismatch")
-            file_text, error = file_opr.read(doc.metadata["read"])
+            file_text, error = DOCUMENT_TEXT_CACHE.read(doc.metadata["read"])
             if error is not None:
                 # read file failed, skip
                 print(f"DEBUG 2: error")
@@ -158,7 +323,10 @@ class Retriever:
                 add_len = context_max_length - len(context)
                 if add_len <= 0:
                     break
-                chunk_index = file_text.find(chunk)
+                chunk_index = doc.metadata.get("offset")
+                if chunk_index is None or (chunk_index >= 0 and not file_text.startswith(chunk, chunk_index)):
+                    # offset not preloaded or source text changed
+                    chunk_index = file_text.find(chunk)
                 if chunk_index == -1:
                     # chunk not in file_text
                     context += chunk
@@ -184,6 +352,7 @@ class CacheRetriever:
     def __init__(self, config_path: str, max_len: int = 4):
         self.cache = dict()
         self.max_len = max_len
+        self._lock = threading.Lock()
         with open(config_path, "r", encoding="utf-8") as f:
             config = yaml.safe_load(f)["feature_store"]
             embedding_model_path = config["embedding_model_path"]
@@ -203,42 +372,91 @@ class CacheRetriever:
         reranker_args = {"model": reranker_model_path, "top_n": 7, "device": "cuda", "use_fp16": True}
         self.reranker = BCERerank(**reranker_args)
 
+        # retrievers of all products share the query embedding and rerank score caches
+        self.query_embeddings = CachedQueryEmbeddings(
+            self.embeddings, TTLCache(max_size=WEB_CONFIGS.RAG_QUERY_CACHE_SIZE, ttl=WEB_CONFIGS.RAG_QUERY_CACHE_TTL)
+        )
+        self.rerank_cache = TTLCache(max_size=WEB_CONFIGS.RAG_QUERY_CACHE_SIZE, ttl=WEB_CONFIGS.RAG_QUERY_CACHE_TTL)
+
     def get(self, fs_id: str = "default", config_path="config.yaml", work_dir="workdir"):
-        if fs_id in self.cache:
-            self.cache[fs_id]["time"] = time.time()
-            return self.cache[fs_id]["retriever"]
+        """Get the retriever of `fs_id`, reload it when `work_dir` changed.
+
+        A new version of the index is always built into a new `work_dir`, so
+        a cached retriever loaded from another directory is outdated.
+        """
+        with self._lock:
+            if fs_id in self.cache and self.cache[fs_id]["work_dir"] == work_dir:
+                self.cache[fs_id]["time"] = time.time()
+                return self.cache[fs_id]["retriever"]
 
         if not os.path.exists(work_dir) or not os.path.exists(config_path):
             return None, "workdir or config.yaml not exist"
 
+        retriever = self.load(config_path=config_path, work_dir=work_dir)
+
+        with self._lock:
+            if fs_id not in self.cache and len(self.cache) >= self.max_len:
+                # drop the oldest one
+                del_key = None
+                min_time = time.time()
+                for key, value in self.cache.items():
+                    cur_time = value["time"]
+                    if cur_time < min_time:
+                        min_time = cur_time
+                        del_key = key
+
+                if del_key is not None:
+                    del_value = self.cache[del_key]
+                    self.cache.pop(del_key)
+                    del del_value["retriever"]
+
+            self.cache[fs_id] = {"retriever": retriever, "work_dir": work_dir, "time": time.time()}
+        return retriever
+
+    def load(self, config_path: str, work_dir: str) -> Retriever:
+        """Load a retriever from `work_dir` without putting it into cache."""
         with open(config_path, "r", encoding="utf-8") as f:
             reject_throttle = yaml.safe_load(f)["feature_store"]["reject_throttle"]
 
-        if len(self.cache) >= self.max_len:
-            # drop the oldest one
-            del_key = None
-            min_time = time.time()
-            for key, value in self.cache.items():
-                cur_time = value["time"]
-                if cur_time < min_time:
-                    min_time = cur_time
-                    del_key = key
-
-            if del_key is not None:
-                del_value = self.cache[del_key]
-                self.cache.pop(del_key)
-                del del_value["retriever"]
-
-        retriever = Retriever(
-            embeddings=self.embeddings, reranker=self.reranker, work_dir=work_dir, reject_throttle=reject_throttle
+        return Retriever(
+            embeddings=self.query_embeddings,
+            reranker=self.reranker,
+            work_dir=work_dir,
+            reject_throttle=reject_throttle,
+            rerank_cache=self.rerank_cache,
         )
-        self.cache[fs_id] = {"retriever": retriever, "time": time.time()}
-        return retriever
 
-    def pop(self, fs_id: str):
-        if fs_id not in self.cache:
+    def cache_stats(self) -> dict:
+        return {
+            "query_embedding": self.query_embeddings.cache.stats(),
+            "rerank": self.rerank_cache.stats(),
+            "document_text": DOCUMENT_TEXT_CACHE.stats(),
+        }
+
+    def swap(self, fs_id: str, config_path: str, work_dir: str | None):
+        """Replace a cached retriever with the one in `work_dir` in one step.
+
+        Queries already running keep a reference to the old retriever and
+        finish on it, new queries get the new one. Retrievers not in cache
+        are loaded lazily by `get`. `work_dir` None drops the retriever.
+        """
+        with self._lock:
+            if fs_id not in self.cache or self.cache[fs_id]["work_dir"] == work_dir:
+                return
+
+        if work_dir is None:
+            self.pop(fs_id)
             return
-        del_value = self.cache[fs_id]
-        self.cache.pop(fs_id)
+
+        retriever = self.load(config_path=config_path, work_dir=work_dir)
+        with self._lock:
+            self.cache[fs_id] = {"retriever": retriever, "work_dir": work_dir, "time": time.time()}
+
+    def pop(self, fs_id: str):
+        with self._lock:
+            if fs_id not in self.cache:
+                return
+            del_value = self.cache[fs_id]
+            self.cache.pop(fs_id)
         # manually free memory
         del del_value
@@ -10,64 +10,104 @@
 """
 
 
+import asyncio
+
 from loguru import logger
-import requests
-import multiprocessing
 
 from ..web_configs import API_CONFIG
+from .http_client import DIGITAL_HUMAN_CLIENT, TTS_CLIENT
+from .job_bus import JOB_BUS, make_job_id
 from .server_info import SERVER_PLUGINS_INFO
 
 
-def process_tts(tts_text_queue):
+async def process_tts(tts_text_queue: asyncio.Queue, digital_human_queue: asyncio.Queue | None = None):
 
     while True:
+        text_chunk = await tts_text_queue.get()
+        if text_chunk is None:
+            # 退出信号
+            break
+
+        logger.info(f"Get tts quene: {type(text_chunk)} , {text_chunk}")
+        job_id = make_job_id("tts", text_chunk["request_id"], text_chunk["chunk_id"])
         try:
-            text_chunk = tts_text_queue.get(block=True, timeout=1)
+            res = await TTS_CLIENT.post(API_CONFIG.TTS_URL, json=text_chunk)
+            res_json = res.json()
         except Exception as e:
-            # logger.info(f"### {e}")
+            logger.error(f"tts failed for {job_id}: {e!r}")
+            JOB_BUS.publish(job_id, {"success": False, "message": str(e)})
+            if text_chunk.get("gen_digital_human", False):
+                # 该句子不会生成数字人，同样需要通知等待方
+                dh_job_id = make_job_id("dh", text_chunk["request_id"], text_chunk["chunk_id"])
+                JOB_BUS.publish(dh_job_id, {"success": False, "message": str(e)})
             continue
-        logger.info(f"Get tts quene: {type(text_chunk)} , {text_chunk}")
-        res = requests.post(API_CONFIG.TTS_URL, json=text_chunk)
 
-        # # tts 推理成功，放入数字人队列进行推理
-        # res_json = res.json()
-        # tts_request_dict = {
-        #     "user_id": "123",
-        #     "request_id": text_chunk["request_id"],
-        #     "chunk_id": text_chunk["chunk_id"],
-        #     "tts_path": res_json["wav_path"],
-        # }
+        logger.info(f"tts res = {res}")
+        JOB_BUS.publish(job_id, {"success": True, **res_json})
+
+        if not text_chunk.get("gen_digital_human", False) or digital_human_queue is None:
+            continue
 
-        # DIGITAL_HUMAN_QUENE.put(tts_request_dict)
+        # 流式模式：tts 推理成功，直接将该句放入数字人队列进行推理，无需等待全部句子
+        tts_request_dict = {
+            "user_id": text_chunk["user_id"],
+            "request_id": text_chunk["request_id"],
+            "chunk_id": text_chunk["chunk_id"],
+            "tts_path": res_json["wav_path"],
+            "streamer_id": text_chunk["streamer_id"],
+        }
 
-        logger.info(f"tts res = {res}")
+        await digital_human_queue.put(tts_request_dict)
 
 
-def process_digital_human(digital_human_queue):
+async def process_digital_human(digital_human_queue: asyncio.Queue):
 
     while True:
+        text_chunk = await digital_human_queue.get()
+        if text_chunk is None:
+            # 退出信号
+            break
+
+        logger.info(f"Get digital human quene: {type(text_chunk)} , {text_chunk}")
+        job_id = make_job_id("dh", text_chunk["request_id"], text_chunk["chunk_id"])
         try:
-            text_chunk = digital_human_queue.get(block=True, timeout=1)
+            res = await DIGITAL_HUMAN_CLIENT.post(API_CONFIG.DIGITAL_HUMAN_URL, json=text_chunk)
+            res_json = res.json()
         except Exception as e:
-            # logger.info(f"### {e}")
+            logger.error(f"digital human failed for {job_id}: {e!r}")
+            JOB_BUS.publish(job_id, {"success": False, "message": str(e)})
             continue
-        logger.info(f"Get digital human quene: {type(text_chunk)} , {text_chunk}")
-        res = requests.post(API_CONFIG.DIGITAL_HUMAN_URL, json=text_chunk)
+
         logger.info(f"digital human res = {res}")
+        JOB_BUS.publish(job_id, {"success": True, **res_json})
+
+
+# 队列在事件循环中由 worker 协程消费，worker 数和对应服务的并发上限一致，请求在 http client 中复用连接
+DIGITAL_HUMAN_QUENE = asyncio.Queue(maxsize=100) if SERVER_PLUGINS_INFO.digital_human_server_enabled else None
+TTS_TEXT_QUENE = asyncio.Queue(maxsize=100) if SERVER_PLUGINS_INFO.tts_server_enabled else None
+
+_QUEUE_WORKERS = []
+
+
+def start_queue_workers():
+    """在服务启动时调用，需要在事件循环中"""
+
+    if DIGITAL_HUMAN_QUENE is not None:
+        for idx in range(API_CONFIG.DIGITAL_HUMAN_MAX_CONCURRENCY):
+            _QUEUE_WORKERS.append(
+                asyncio.create_task(process_digital_human(DIGITAL_HUMAN_QUENE), name=f"digital_human_processer_{idx}")
+            )
+
+    if TTS_TEXT_QUENE is not None:
+        for idx in range(API_CONFIG.TTS_MAX_CONCURRENCY):
+            _QUEUE_WORKERS.append(
+                asyncio.create_task(process_tts(TTS_TEXT_QUENE, DIGITAL_HUMAN_QUENE), name=f"tts_processer_{idx}")
+            )
 
 
-if SERVER_PLUGINS_INFO.tts_server_enabled:
-    TTS_TEXT_QUENE = multiprocessing.Queue(maxsize=100)
-    tts_thread = multiprocessing.Process(target=process_tts, args=(TTS_TEXT_QUENE,), name="tts_processer")
-    tts_thread.start()
-else:
-    TTS_TEXT_QUENE = None
-
-if SERVER_PLUGINS_INFO.digital_human_server_enabled:
-    DIGITAL_HUMAN_QUENE = multiprocessing.Queue(maxsize=100)
-    digital_human_thread = multiprocessing.Process(
-        target=process_digital_human, args=(DIGITAL_HUMAN_QUENE,), name="digital_human_processer"
-    )
-    digital_human_thread.start()
-else:
-    DIGITAL_HUMAN_QUENE = None
+async def stop_queue_workers():
+    """在服务退出时调用，取消所有 worker"""
+    for worker in _QUEUE_WORKERS:
+        worker.cancel()
+    await asyncio.gather(*_QUEUE_WORKERS, return_exceptions=True)
+    _QUEUE_WORKERS.clear()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@File    :   render_cache.py
+@Time    :   2024/09/24
+@Project :   https://github.com/PeterH0323/Streamer-Sales
+@Author  :   HinGwenWong
+@Version :   1.0
+@Desc    :   数字人视频渲染缓存，相同内容直接复用已生成的 wav / mp4，不再重复进行 TTS 和口型推理
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import unicodedata
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict
+
+from loguru import logger
+
+from ..web_configs import WEB_CONFIGS
+
+
+def normalize_text(text: str) -> str:
+    """文案归一化，全半角、多余空白不同的文案视为相同内容"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_wav_cache_key(voice: Dict[str, str], text: str) -> str:
+    """TTS 结果的缓存 key：音色 + 文案"""
+    key_info = {"voice": voice, "text": normalize_text(text)}
+    return "tts-" + hashlib.sha256(json.dumps(key_info, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def make_video_cache_key(streamer_id: int | str, bundle_version: str, voice: Dict[str, str], text: str) -> str:
+    """数字人视频的缓存 key：主播 ID + 素材包版本 + 音色 + 文案"""
+    key_info = {"streamer_id": str(streamer_id), "bundle_version": bundle_version, "voice": voice, "text": normalize_text(text)}
+    return "dh-" + hashlib.sha256(json.dumps(key_info, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src_path: Path, dst_path: Path):
+    """优先使用硬链接，不占用额外空间，缓存被淘汰时已链接出去的文件不受影响；跨文件系统时退化为拷贝"""
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dst_path.with_name(dst_path.name + ".tmp")
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+
+
+class RenderCache:
+    """以内容为 key 的文件缓存，超出磁盘空间预算时按最久未使用淘汰
+
+    只淘汰缓存目录中的文件，返回给请求的视频可能被数据库引用（开场视频、直播间视频、问答缓存），不由缓存删除
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        """
+        Args:
+            cache_dir (str): 缓存目录
+            max_bytes (int): 缓存最多占用的磁盘空间，单位字节，<= 0 不启用缓存
+        """
+        self.cache_dir = Path(cache_dir).absolute()
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()  # 同时只进行一次淘汰
+        self._pinned = defaultdict(int)  # 正在使用的 key，不会被淘汰
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        self._key_lock_users = defaultdict(int)
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _cache_path(self, key: str, suffix: str) -> Path:
+        return self.cache_dir.joinpath(f"{key}{suffix}")
+
+    @asynccontextmanager
+    async def lock(self, key: str):
+        """同一个 key 同时只生成一次，其他请求等待后直接命中缓存"""
+        key_lock = self._key_locks.setdefault(key, asyncio.Lock())
+        self._key_lock_users[key] += 1
+        try:
+            async with key_lock:
+                yield
+        finally:
+            self._key_lock_users[key] -= 1
+            if self._key_lock_users[key] == 0:
+                self._key_locks.pop(key, None)
+                self._key_lock_users.pop(key, None)
+
+    def get(self, key: str, suffix: str) -> Path | None:
+        """获取缓存文件路径，命中时更新访问时间"""
+        cache_path = self._cache_path(key, suffix)
+        with self._lock:
+            if not cache_path.exists():
+                self.misses += 1
+                return None
+
+            os.utime(cache_path)
+            self.hits += 1
+        return cache_path
+
+    def put(self, key: str, suffix: str, file_path: str | Path) -> Path:
+        """文件加入缓存，原文件保留。会遍历缓存目录进行淘汰，需要在线程中调用"""
+        cache_path = self._cache_path(key, suffix)
+        with self._lock:
+            link_or_copy(Path(file_path), cache_path)
+        self._evict()
+        return cache_path
+
+    def link_output(self, key: str, suffix: str, output_dir: str | Path) -> Path:
+        """缓存文件链接到视频输出目录，返回给请求使用
+
+        同一个 key 只链接出一个文件 `{key}{suffix}`，多次命中共用，输出目录不会随命中次数增长；
+        该文件可能被数据库引用，缓存淘汰时不删除
+        """
+        output_path = Path(output_dir).absolute().joinpath(f"{key}{suffix}")
+        with self._lock:
+            if not output_path.exists():
+                link_or_copy(self._cache_path(key, suffix), output_path)
+        return output_path
+
+    @asynccontextmanager
+    async def pin(self, key: str):
+        """使用期间不淘汰，e.g. 缓存的 wav 正在被数字人服务读取"""
+        with self._lock:
+            self._pinned[key] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pinned[key] -= 1
+                if self._pinned[key] == 0:
+                    self._pinned.pop(key)
+
+    def _evict(self):
+        # 遍历目录不持有 self._lock，不阻塞同时进行的 get
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            cache_files = [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and not entry.name.endswith(".tmp")]
+            file_stats = {entry.path: entry.stat() for entry in cache_files}
+            total_bytes = sum([stat.st_size for stat in file_stats.values()])
+            if total_bytes <= self.max_bytes:
+                return
+
+            for entry in sorted(cache_files, key=lambda entry: file_stats[entry.path].st_mtime):
+                if total_bytes <= self.max_bytes:
+                    break
+                with self._lock:
+                    if Path(entry.name).stem in self._pinned:
+                        continue
+                    Path(entry.path).unlink(missing_ok=True)
+                total_bytes -= file_stats[entry.path].st_size
+                logger.info(f"render cache evicted: {entry.name}")
+        finally:
+            self._evict_lock.release()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total > 0 else 0.0}
+
+
+RENDER_CACHE = RenderCache(WEB_CONFIGS.DIGITAL_HUMAN_RENDER_CACHE_DIR, int(WEB_CONFIGS.DIGITAL_HUMAN_RENDER_CACHE_GB * 1024**3))
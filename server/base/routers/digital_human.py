@@ -10,15 +10,21 @@
 """
 
 
-from pathlib import Path
+import asyncio
 import uuid
-import requests
+from pathlib import Path
+from typing import Dict
+
 from fastapi import APIRouter
 from loguru import logger
 from pydantic import BaseModel
 
 from ...web_configs import API_CONFIG, WEB_CONFIGS
-from ..utils import ResultCode, make_return_data
+from ..http_client import DIGITAL_HUMAN_CLIENT, DIGITAL_HUMAN_CONTROL_CLIENT, TTS_CLIENT
+from ..models.streamer_info_model import StreamerInfo
+from ..render_cache import RENDER_CACHE, make_video_cache_key, make_wav_cache_key
+from ..server_info import SERVER_PLUGINS_INFO
+from ..utils import ResultCode, make_digital_human_video_server_url, make_return_data, make_tts_voice_info
 
 router = APIRouter(
     prefix="/digital-human",
@@ -32,41 +38,147 @@ class GenDigitalHumanVideoItem(BaseModel):
     salesDoc: str
 
 
-async def gen_tts_and_digital_human_video_app(streamer_id: int, sales_doc: str):
-    logger.info(sales_doc)
+async def get_avatar_bundle_version(streamer_id: int) -> str:
+    """数字人素材包版本，获取失败返回空字符串，不使用缓存"""
+    try:
+        res = await DIGITAL_HUMAN_CONTROL_CLIENT.get(f"{API_CONFIG.DIGITAL_HUMAN_AVATAR_INFO_URL}/{streamer_id}")
+        return res.json()["bundle_version"]
+    except Exception as e:
+        logger.warning(f"get avatar bundle version failed: {e}")
+        return ""
 
-    request_id = str(uuid.uuid1())
-    sentence_id = 1  # 直接推理，所以设置成 1
-    user_id = "123"
 
-    # 生成 TTS wav
+async def start_live_stream(room_id: int, streamer_id: int):
+    """开始直播间直播流，失败不影响直播间其他功能"""
+    if not SERVER_PLUGINS_INFO.digital_human_server_enabled:
+        return
+    try:
+        await DIGITAL_HUMAN_CONTROL_CLIENT.post(
+            API_CONFIG.DIGITAL_HUMAN_LIVE_START_URL, json={"room_id": str(room_id), "streamer_id": str(streamer_id)}
+        )
+    except Exception as e:
+        logger.warning(f"start live stream for room {room_id} failed: {e}")
+
+
+async def push_live_video(room_id: int, streamer_id: int, video_path: str | Path):
+    """已生成的视频推送到直播间直播流
+
+    Args:
+        video_path (str | Path): 视频本地路径
+    """
+    if not SERVER_PLUGINS_INFO.digital_human_server_enabled:
+        return
+    try:
+        await DIGITAL_HUMAN_CONTROL_CLIENT.post(
+            API_CONFIG.DIGITAL_HUMAN_LIVE_PUSH_URL,
+            json={"room_id": str(room_id), "streamer_id": str(streamer_id), "video_path": str(Path(video_path).absolute())},
+        )
+    except Exception as e:
+        logger.warning(f"push video to live stream for room {room_id} failed: {e}")
+
+
+async def stop_live_stream(room_id: int):
+    if not SERVER_PLUGINS_INFO.digital_human_server_enabled:
+        return
+    try:
+        await DIGITAL_HUMAN_CONTROL_CLIENT.post(API_CONFIG.DIGITAL_HUMAN_LIVE_STOP_URL, json={"room_id": str(room_id)})
+    except Exception as e:
+        logger.warning(f"stop live stream for room {room_id} failed: {e}")
+
+
+async def gen_tts_wav(request_id: str, user_id: str, sales_doc: str, voice_info: Dict[str, str]) -> Path:
+    """生成 TTS wav，返回本次请求使用的 wav 路径，使用完后需要删除"""
     tts_json = {
         "user_id": user_id,
         "request_id": request_id,
         "sentence": sales_doc,
-        "chunk_id": sentence_id,
+        "chunk_id": 1,  # 直接推理，所以设置成 1
         # "wav_save_name": chat_item.request_id + f"{str(sentence_id).zfill(8)}.wav",
+        **voice_info,
     }
-    tts_save_path = Path(WEB_CONFIGS.TTS_WAV_GEN_PATH, request_id + f"-{str(1).zfill(8)}.wav")
-    logger.info(f"waiting for wav generating done: {tts_save_path}")
-    _ = requests.post(API_CONFIG.TTS_URL, json=tts_json)
+    logger.info(f"waiting for wav generating done: {request_id}")
+    tts_res = await TTS_CLIENT.post(API_CONFIG.TTS_URL, json=tts_json)
+    # 接口返回即代表生成完成，直接使用返回的路径
+    return Path(tts_res.json()["wav_path"])
 
-    # 生成数字人视频
+
+async def gen_digital_human_video(request_id: str, user_id: str, streamer_id: int, tts_path: Path, live_room_id: str = "") -> Path:
     digital_human_gen_info = {
         "user_id": user_id,
         "request_id": request_id,
         "chunk_id": 0,
-        "tts_path": str(tts_save_path),
+        "tts_path": str(tts_path),
         "streamer_id": str(streamer_id),
+        "live_room_id": live_room_id,
     }
-    video_path = Path(WEB_CONFIGS.DIGITAL_HUMAN_VIDEO_OUTPUT_PATH).joinpath(request_id + ".mp4")
-    logger.info(f"Generating digital human: {video_path}")
-    _ = requests.post(API_CONFIG.DIGITAL_HUMAN_URL, json=digital_human_gen_info)
+    logger.info(f"Generating digital human: {request_id}")
+    dg_res = await DIGITAL_HUMAN_CLIENT.post(API_CONFIG.DIGITAL_HUMAN_URL, json=digital_human_gen_info)
+    return Path(dg_res.json()["digital_human_mp4_path"])
+
+
+async def gen_tts_and_digital_human_video_app(
+    streamer_id: int, sales_doc: str, streamer_info: StreamerInfo | None = None, live_room_id: int | None = None
+):
+    """生成数字人视频
 
-    # 删除过程文件
-    tts_save_path.unlink()
+    Args:
+        streamer_id (int): 主播 ID
+        sales_doc (str): 文案
+        streamer_info (StreamerInfo | None, optional): 主播信息，用于选择音色. Defaults to None.
+        live_room_id (int | None, optional): 直播间 ID，指定时视频同时推送到直播间的直播流，渲染过程中即可开始播放. Defaults to None.
 
-    server_video_path = f"{API_CONFIG.REQUEST_FILES_URL}/{WEB_CONFIGS.STREAMER_FILE_DIR}/vid_output/{request_id}.mp4"
+    Returns:
+        str: 视频服务器地址
+    """
+    logger.info(sales_doc)
+    live_room_id = "" if live_room_id is None else str(live_room_id)
+
+    request_id = str(uuid.uuid1())
+    user_id = "123"
+    voice_info = make_tts_voice_info(streamer_info)
+
+    # 素材包版本获取失败时不使用缓存
+    bundle_version = await get_avatar_bundle_version(streamer_id) if RENDER_CACHE.enabled else ""
+    if bundle_version == "":
+        tts_save_path = await gen_tts_wav(request_id, user_id, sales_doc, voice_info)
+        video_path = await gen_digital_human_video(request_id, user_id, streamer_id, tts_save_path, live_room_id)
+
+        # 删除过程文件
+        tts_save_path.unlink()
+        return make_digital_human_video_server_url(video_path.name)
+
+    video_key = make_video_cache_key(streamer_id, bundle_version, voice_info, sales_doc)
+    wav_key = make_wav_cache_key(voice_info, sales_doc)
+
+    # 相同内容同时只生成一次
+    async with RENDER_CACHE.lock(video_key):
+        async with RENDER_CACHE.pin(video_key):
+            cache_video_path = RENDER_CACHE.get(video_key, ".mp4")
+            if cache_video_path is not None:
+                # 相同内容的请求共用一个输出文件，缓存被淘汰时不影响已经返回的地址
+                video_path = await asyncio.to_thread(
+                    RENDER_CACHE.link_output, video_key, ".mp4", WEB_CONFIGS.DIGITAL_HUMAN_VIDEO_OUTPUT_PATH
+                )
+
+        if cache_video_path is not None:
+            logger.info(f"digital human video cache hit: {video_key}")
+            if live_room_id != "":
+                await push_live_video(live_room_id, streamer_id, video_path)
+            return make_digital_human_video_server_url(video_path.name)
+
+        async with RENDER_CACHE.lock(wav_key), RENDER_CACHE.pin(wav_key):
+            # 素材重新预处理后只需重新生成视频，TTS 结果依然可以复用
+            cache_wav_path = RENDER_CACHE.get(wav_key, ".wav")
+            if cache_wav_path is None:
+                tts_save_path = await gen_tts_wav(request_id, user_id, sales_doc, voice_info)
+                cache_wav_path = await asyncio.to_thread(RENDER_CACHE.put, wav_key, ".wav", tts_save_path)
+                tts_save_path.unlink()
+
+            gen_video_path = await gen_digital_human_video(request_id, user_id, streamer_id, cache_wav_path, live_room_id)
+
+        await asyncio.to_thread(RENDER_CACHE.put, video_key, ".mp4", gen_video_path)
+
+    server_video_path = make_digital_human_video_server_url(gen_video_path.name)
     logger.info(server_video_path)
 
     return server_video_path
@@ -83,3 +195,9 @@ async def get_digital_human_according_doc_api(gen_item: GenDigitalHumanVideoItem
     server_video_path = await gen_tts_and_digital_human_video_app(gen_item.streamerId, gen_item.salesDoc)
 
     return make_return_data(True, ResultCode.SUCCESS, "成功", server_video_path)
+
+
+@router.get("/render-cache")
+async def get_render_cache_stats_api():
+    """数字人视频渲染缓存命中情况"""
+    return make_return_data(True, ResultCode.SUCCESS, "成功", RENDER_CACHE.stats())
@@ -10,7 +10,8 @@
 """
 
 
-from typing import Dict, List
+import asyncio
+from typing import AsyncIterator, Dict, List
 
 from fastapi import APIRouter, Depends
 from loguru import logger
@@ -18,6 +19,7 @@ from loguru import logger
 from ..database.llm_db import get_llm_product_prompt_base_info
 from ..database.product_db import get_db_product_info
 from ..database.streamer_info_db import get_db_streamer_info
+from ..llm_client import ASYNC_LLM_CLIENT
 from ..models.product_model import ProductInfo
 from ..models.streamer_info_model import StreamerInfo
 from ..modules.agent.agent_worker import get_agent_result
@@ -125,7 +127,8 @@ async def get_agent_res(prompt, departure_place, delivery_company):
         "这是网上获取到的信息：“{}”\n 客户的问题：“{}” \n 请认真阅读信息并运用你的性格进行解答。"  # Agent prompt 模板
     )
     input_prompt = prompt[-1]["content"]
-    agent_response = get_agent_result(LLM_MODEL_HANDLER, input_prompt, departure_place, delivery_company)
+    # Agent 使用同步的 lmdeploy client，放到线程中执行避免阻塞事件循环
+    agent_response = await asyncio.to_thread(get_agent_result, LLM_MODEL_HANDLER, input_prompt, departure_place, delivery_company)
     if agent_response != "":
         agent_response = GENERATE_AGENT_TEMPLATE.format(agent_response, input_prompt)
         logger.info(f"Agent response: {agent_response}")
@@ -144,15 +147,26 @@ async def get_llm_res(prompt):
     """
 
     logger.info(prompt)
-    model_name = LLM_MODEL_HANDLER.available_models[0]
-
-    res_data = ""
-    for item in LLM_MODEL_HANDLER.chat_completions_v1(model=model_name, messages=prompt):
-        res_data = item["choices"][0]["message"]["content"]
+    res_data = await ASYNC_LLM_CLIENT.chat_completions(prompt)
 
     return res_data
 
 
+async def get_llm_res_stream(prompt) -> AsyncIterator[str]:
+    """获取 LLM 流式推理返回
+
+    Args:
+        prompt (List[Dict[str, str]]): prompt
+
+    Yields:
+        str: 增量文本
+    """
+
+    logger.info(prompt)
+    async for delta in ASYNC_LLM_CLIENT.chat_completions_stream(prompt):
+        yield delta
+
+
 @router.get("/gen_sales_doc", summary="生成主播文案接口")
 async def get_product_info_api(streamer_id: int, product_id: int, user_id: int = Depends(get_current_user_info)):
     """生成口播文案
@@ -181,7 +195,4 @@ async def get_product_info_api(product_id: int, user_id: int = Depends(get_curre
     instruction_str = ""
     prompt = [{"system": "现在你是一个文档小助手，你可以从文档里面总结出我需要的信息", "input": ""}]
 
-    res_data = ""
-    model_name = LLM_MODEL_HANDLER.available_models[0]
-    for item in LLM_MODEL_HANDLER.chat_completions_v1(model=model_name, messages=prompt):
-        res_data += item
+    res_data = await get_llm_res(prompt)
@@ -20,7 +20,15 @@ from ..database.product_db import (
     get_db_product_info,
 )
 from ..models.product_model import ProductInfo, ProductPageItem, ProductQueryItem
-from ..modules.rag.rag_worker import rebuild_rag_db
+from ..modules.rag.rag_worker import (
+    delete_rag_product,
+    get_rag_build_status,
+    get_rag_cache_stats,
+    invalidate_answer_cache,
+    rebuild_rag_db,
+    sync_rag_db,
+    upsert_rag_product,
+)
 from ..utils import ResultCode, make_return_data
 from .users import get_current_user_info
 
@@ -62,11 +70,11 @@ async def upload_product_api(upload_product_item: ProductInfo, user_id: int = De
     upload_product_item.user_id = user_id
     upload_product_item.product_id = None
 
-    rebuild_rag_db_flag = create_or_update_db_product_by_id(0, upload_product_item)
+    rebuild_rag_db_flag = create_or_update_db_product_by_id(0, upload_product_item, user_id)
 
     if WEB_CONFIGS.ENABLE_RAG and rebuild_rag_db_flag:
-        # 重新生成 RAG 向量数据库
-        await rebuild_rag_db(user_id)
+        # 新商品 ID 在入库后才生成，同步该用户的商品列表，只有新商品会进行向量化
+        await sync_rag_db(user_id, remove_missing=False)
 
     return make_return_data(True, ResultCode.SUCCESS, "成功", "")
 
@@ -74,11 +82,15 @@ async def upload_product_api(upload_product_item: ProductInfo, user_id: int = De
 @router.put("/edit/{product_id}", summary="编辑商品接口")
 async def upload_product_api(product_id: int, upload_product_item: ProductInfo, user_id: int = Depends(get_current_user_info)):
 
-    rebuild_rag_db_flag = create_or_update_db_product_by_id(product_id, upload_product_item, user_id)
+    create_or_update_db_product_by_id(product_id, upload_product_item, user_id)
 
-    if WEB_CONFIGS.ENABLE_RAG and rebuild_rag_db_flag:
-        # 重新生成 RAG 向量数据库
-        await rebuild_rag_db(user_id)
+    # 商品信息变化后，之前的回答可能已经过时
+    invalidate_answer_cache(product_id=product_id)
+
+    if WEB_CONFIGS.ENABLE_RAG:
+        # 只更新该商品说明书的切片，说明书内容没有变化时不会重新向量化
+        upload_product_item.product_id = product_id
+        await upsert_rag_product(user_id, upload_product_item)
 
     return make_return_data(True, ResultCode.SUCCESS, "成功", "")
 
@@ -91,13 +103,34 @@ async def upload_product_api(productId: int, user_id: int = Depends(get_current_
     if not process_success_flag:
         return make_return_data(False, ResultCode.FAIL, "失败", "")
 
+    invalidate_answer_cache(product_id=productId)
+
     if WEB_CONFIGS.ENABLE_RAG:
-        # 重新生成 RAG 向量数据库
-        await rebuild_rag_db(user_id)
+        # 删除该商品说明书的切片
+        await delete_rag_product(user_id, productId)
 
     return make_return_data(True, ResultCode.SUCCESS, "成功", "")
 
 
+@router.get("/rag-status", summary="获取商品说明书向量库构建状态接口")
+async def get_rag_build_status_api(user_id: int = Depends(get_current_user_info)):
+    """商品修改后向量库在后台更新，构建完成前直播间使用的是旧版本"""
+    return make_return_data(True, ResultCode.SUCCESS, "成功", get_rag_build_status(user_id))
+
+
+@router.post("/rag-rebuild", summary="全量重新生成商品说明书向量库接口")
+async def rebuild_rag_db_api(user_id: int = Depends(get_current_user_info)):
+    """更换 embedding 模型或切片配置后使用，所有商品重新切片和向量化，在后台执行，构建完成前直播间使用的是旧版本"""
+    if WEB_CONFIGS.ENABLE_RAG:
+        await rebuild_rag_db(user_id)
+    return make_return_data(True, ResultCode.SUCCESS, "成功", get_rag_build_status(user_id))
+
+
+@router.get("/rag-cache", summary="获取 RAG 检索缓存命中情况接口", dependencies=[Depends(get_current_user_info)])
+async def get_rag_cache_stats_api():
+    return make_return_data(True, ResultCode.SUCCESS, "成功", get_rag_cache_stats())
+
+
 @router.post("/instruction", summary="获取对应商品的说明书内容接口", dependencies=[Depends(get_current_user_info)])
 async def get_product_instruction_info_api(instruction_path: ProductQueryItem):
     """获取对应商品的说明书
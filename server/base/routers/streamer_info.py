@@ -13,13 +13,14 @@ from typing import Tuple
 import uuid
 from pathlib import Path
 
-import requests
 from fastapi import APIRouter, Depends
 from loguru import logger
 
 from ...web_configs import API_CONFIG, WEB_CONFIGS
 from ..database.streamer_info_db import create_or_update_db_streamer_by_id, delete_streamer_id, get_db_streamer_info
+from ..http_client import DIGITAL_HUMAN_CLIENT
 from ..models.streamer_info_model import StreamerInfo
+from ..modules.rag.rag_worker import invalidate_answer_cache
 from ..utils import ResultCode, make_poster_by_video_first_frame, make_return_data
 from .users import get_current_user_info
 
@@ -65,7 +66,11 @@ async def gen_digital_human(user_id, streamer_id: int, new_streamer_info: Stream
         "video_path": str(video_local_dir.joinpath(Path(new_streamer_info.base_mp4_path).name)),
     }
     logger.info(f"Getting digital human preprocessing: {new_streamer_info.streamer_id}")
-    _ = requests.post(API_CONFIG.DIGITAL_HUMAN_PREPROCESS_URL, json=digital_human_gen_info)
+    _ = await DIGITAL_HUMAN_CLIENT.post(
+        API_CONFIG.DIGITAL_HUMAN_PREPROCESS_URL,
+        json=digital_human_gen_info,
+        timeout=API_CONFIG.DIGITAL_HUMAN_PREPROCESS_TIMEOUT,
+    )
 
     # 根据视频第一帧生成头图
     poster_save_name = Path(new_streamer_info.base_mp4_path).stem + ".png"
@@ -142,6 +147,9 @@ async def edit_streamer_info_api(streamer_id: int, streamer_info: StreamerInfo,
     # 更新数据库
     create_or_update_db_streamer_by_id(streamer_id, streamer_info, user_id)
 
+    # 主播性格、音色、形象变化后，之前缓存的回答和视频不再适用
+    invalidate_answer_cache(streamer_id=streamer_id)
+
     return make_return_data(True, ResultCode.SUCCESS, "成功", streamer_id)
 
 
@@ -153,4 +161,6 @@ async def upload_product_api(streamerId: int, user_id: int = Depends(get_current
     if not process_success_flag:
         return make_return_data(False, ResultCode.FAIL, "失败", "")
 
+    invalidate_answer_cache(streamer_id=streamerId)
+
     return make_return_data(True, ResultCode.SUCCESS, "成功", "")
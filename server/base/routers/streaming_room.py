@@ -9,13 +9,15 @@
 @Desc    :   主播间信息交互接口
 """
 
+import asyncio
+import json
 import uuid
 from copy import deepcopy
 from pathlib import Path
 
-import requests
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from loguru import logger
+from sse_starlette import EventSourceResponse
 
 from ...web_configs import API_CONFIG, WEB_CONFIGS
 from ..database.product_db import get_db_product_info
@@ -29,14 +31,17 @@ from ..database.streamer_room_db import (
     update_message_info,
     update_room_video_path,
 )
+from ..http_client import ASR_CLIENT
 from ..models.product_model import ProductInfo
 from ..models.streamer_room_model import OnAirRoomStatusItem, RoomChatItem, SalesDocAndVideoInfo, StreamRoomInfo
-from ..modules.rag.rag_worker import RAG_RETRIEVER, build_rag_prompt
+from ..modules.rag import rag_worker
+from ..modules.rag.answer_cache import AnswerCacheQuery
+from ..modules.rag.rag_worker import build_rag_prompt
 from ..routers.users import get_current_user_info
 from ..server_info import SERVER_PLUGINS_INFO
 from ..utils import ResultCode, make_return_data
-from .digital_human import gen_tts_and_digital_human_video_app
-from .llm import combine_history, gen_poduct_base_prompt, get_agent_res, get_llm_res
+from .digital_human import gen_tts_and_digital_human_video_app, push_live_video, start_live_stream, stop_live_stream
+from .llm import combine_history, gen_poduct_base_prompt, get_agent_res, get_llm_res, get_llm_res_stream
 
 router = APIRouter(
     prefix="/streaming-room",
@@ -211,10 +216,22 @@ async def delete_room_api(roomId: int, user_id: int = Depends(get_current_user_i
 # ============================================================
 
 
+async def push_room_start_video(room_id: int, user_id: int):
+    """当前商品的开场视频推送到直播间直播流"""
+    streaming_room_info = (await get_db_streaming_room_info(user_id, room_id))[0]
+    start_video = streaming_room_info.status.streaming_video_path.replace(API_CONFIG.REQUEST_FILES_URL, "")
+    if start_video == "":
+        await start_live_stream(room_id, streaming_room_info.streamer_id)
+        return
+
+    await push_live_video(room_id, streaming_room_info.streamer_id, Path(WEB_CONFIGS.SERVER_FILE_ROOT + start_video))
+
+
 @router.post("/online/{roomId}", summary="直播间开播接口")
 async def offline_api(roomId: int, user_id: int = Depends(get_current_user_info)):
 
     update_db_room_status(roomId, user_id, "online")
+    await push_room_start_video(roomId, user_id)
     return make_return_data(True, ResultCode.SUCCESS, "成功", "")
 
 
@@ -222,6 +239,7 @@ async def offline_api(roomId: int, user_id: int = Depends(get_current_user_info)
 async def offline_api(roomId: int, user_id: int = Depends(get_current_user_info)):
 
     update_db_room_status(roomId, user_id, "offline")
+    await stop_live_stream(roomId)
     return make_return_data(True, ResultCode.SUCCESS, "成功", "")
 
 
@@ -234,6 +252,7 @@ async def on_air_live_room_next_product_api(roomId: int, user_id: int = Depends(
     """
 
     update_db_room_status(roomId, user_id, "next-product")
+    await push_room_start_video(roomId, user_id)
     return make_return_data(True, ResultCode.SUCCESS, "成功", "")
 
 
@@ -244,6 +263,7 @@ async def get_on_air_live_room_api(roomId: int, user_id: int = Depends(get_curre
     1. 主播视频地址
     2. 商品信息，显示在右下角的商品缩略图
     3. 对话记录 conversation_list
+    4. HLS 直播流地址
 
     Args:
         roomId (int): 直播间 ID
@@ -251,11 +271,21 @@ async def get_on_air_live_room_api(roomId: int, user_id: int = Depends(get_curre
 
     res_data = await get_live_room_info(user_id, roomId)
 
+    # 前端轮询的接口，不在这里开始直播流。数字人服务重启后，下一次推送视频（开播、下一个商品、缓存命中的回答）时会重新开始
     return make_return_data(True, ResultCode.SUCCESS, "成功", res_data)
 
 
-@router.put("/chat", summary="直播间对话接口")
-async def get_on_air_live_room_api(room_chat: RoomChatItem, user_id: int = Depends(get_current_user_info)):
+async def make_room_chat_prompt(room_chat: RoomChatItem, user_id: int):
+    """记录用户消息，并根据对话记录、Agent / RAG 结果生成 prompt
+
+    Args:
+        room_chat (RoomChatItem): 直播间对话信息
+        user_id (int): 用户 ID
+
+    Returns:
+        Tuple[StreamRoomInfo, int, List[Dict[str, str]] | None, AnswerCacheQuery | None]:
+            直播间信息，销售 ID，prompt，问答缓存查询结果。命中问答缓存时 prompt 为 None
+    """
     # 根据直播间 ID 获取信息
     streaming_room_info = await get_db_streaming_room_info(user_id, room_chat.roomId)
     streaming_room_info = streaming_room_info[0]
@@ -269,6 +299,16 @@ async def get_on_air_live_room_api(room_chat: RoomChatItem, user_id: int = Depen
     # 更新对话记录
     update_message_info(sales_info_id, user_id, role="user", message=room_chat.message)
 
+    # ====================== 问答缓存 ======================
+    # 相似问题之前已经回答过，直接复用回答和数字人视频
+    answer_cache_query = None
+    if rag_worker.ANSWER_CACHE is not None:
+        answer_cache_query = await asyncio.to_thread(
+            rag_worker.ANSWER_CACHE.lookup, streaming_room_info.streamer_id, product_detail.product_id, room_chat.message
+        )
+        if answer_cache_query.hit is not None:
+            return streaming_room_info, sales_info_id, None, answer_cache_query
+
     # 获取最新的对话记录
     conversation_list = get_message_list(sales_info_id)
 
@@ -287,21 +327,62 @@ async def get_on_air_live_room_api(room_chat: RoomChatItem, user_id: int = Depen
     if agent_response != "":
         logger.info("Agent 执行成功，不执行 RAG")
         prompt[-1]["content"] = agent_response
+        if answer_cache_query is not None:
+            # Agent 结果依赖实时信息，回答不缓存
+            answer_cache_query.cacheable = False
 
     # ====================== RAG ======================
     # 调取 rag
     elif SERVER_PLUGINS_INFO.rag_enabled:
         logger.info("Agent 未执行 or 未开启，调用 RAG")
         # agent 失败，调取 rag, chat_item.plugins.rag 为 True，则使用 RAG 查询数据库
-        rag_res = build_rag_prompt(RAG_RETRIEVER, product_detail.product_name, prompt[-1]["content"])
+        # 首次检索该商品时需要加载子向量库，检索和 rerank 也比较耗时，放到线程中执行避免阻塞事件循环
+        rag_res = await asyncio.to_thread(build_rag_prompt, user_id, product_detail.product_id, prompt[-1]["content"])
         if rag_res != "":
             prompt[-1]["content"] = rag_res
 
-    # 调取 LLM
-    streamer_res = await get_llm_res(prompt)
+    return streaming_room_info, sales_info_id, prompt, answer_cache_query
+
 
+async def reply_from_answer_cache(streaming_room_info: StreamRoomInfo, sales_info_id: int, answer_cache_query: AnswerCacheQuery) -> str:
+    """使用缓存的回答和数字人视频，更新直播间视频和对话记录
+
+    Returns:
+        str: 数字人视频服务器地址
+    """
+    cache_entry = answer_cache_query.hit
+
+    # 更新直播间数字人视频信息
+    update_room_video_path(streaming_room_info.status_id, cache_entry.video_url)
+
+    # 更新对话记录
+    update_message_info(sales_info_id, streaming_room_info.streamer_info.streamer_id, role="streamer", message=cache_entry.answer)
+
+    # 推送到直播流
+    local_video_path = Path(WEB_CONFIGS.SERVER_FILE_ROOT + cache_entry.video_url.replace(API_CONFIG.REQUEST_FILES_URL, ""))
+    await push_live_video(streaming_room_info.room_id, streaming_room_info.streamer_id, local_video_path)
+
+    return cache_entry.video_url
+
+
+async def finish_room_chat(
+    streaming_room_info: StreamRoomInfo, sales_info_id: int, streamer_res: str, answer_cache_query: AnswerCacheQuery | None = None
+) -> str:
+    """生成数字人视频，并更新直播间视频和对话记录
+
+    Args:
+        answer_cache_query (AnswerCacheQuery | None, optional): 问答缓存查询结果，视频生成后将回答写入缓存. Defaults to None.
+
+    Returns:
+        str: 数字人视频服务器地址
+    """
     # 生成数字人视频
-    server_video_path = await gen_tts_and_digital_human_video_app(streaming_room_info.streamer_info.streamer_id, streamer_res)
+    server_video_path = await gen_tts_and_digital_human_video_app(
+        streaming_room_info.streamer_info.streamer_id,
+        streamer_res,
+        streaming_room_info.streamer_info,
+        live_room_id=streaming_room_info.room_id,
+    )
 
     # 更新直播间数字人视频信息
     update_room_video_path(streaming_room_info.status_id, server_video_path)
@@ -309,9 +390,99 @@ async def get_on_air_live_room_api(room_chat: RoomChatItem, user_id: int = Depen
     # 更新对话记录
     update_message_info(sales_info_id, streaming_room_info.streamer_info.streamer_id, role="streamer", message=streamer_res)
 
+    # 写入问答缓存
+    if answer_cache_query is not None and rag_worker.ANSWER_CACHE is not None:
+        rag_worker.ANSWER_CACHE.put(answer_cache_query, streamer_res, server_video_path)
+
+    return server_video_path
+
+
+async def room_chat_stream_process(
+    request: Request, streaming_room_info: StreamRoomInfo, sales_info_id: int, prompt, answer_cache_query: AnswerCacheQuery | None
+):
+    """直播间对话流式返回：逐 token 推送 LLM 结果，之后等待数字人视频生成完成。
+
+    客户端断开时停止 LLM 推理，不再生成数字人视频。命中问答缓存时直接返回缓存的回答和视频。
+    """
+
+    def make_event(event_id, data, step, end_flag=False, **kwargs):
+        return json.dumps(
+            {"event": "message", "retry": 100, "id": event_id, "data": data, "step": step, "end_flag": end_flag, **kwargs},
+            ensure_ascii=False,
+        )
+
+    if answer_cache_query is not None and answer_cache_query.hit is not None:
+        video_url = await reply_from_answer_cache(streaming_room_info, sales_info_id, answer_cache_query)
+        yield make_event(1, answer_cache_query.hit.answer, "llm")
+        yield make_event(1, answer_cache_query.hit.answer, "all", end_flag=True, video_url=video_url)
+        return
+
+    idx = 0
+    streamer_res = ""
+    async for delta in get_llm_res_stream(prompt):
+        if await request.is_disconnected():
+            # 退出迭代会关闭到 LLM 服务的连接，LLM 服务随之停止生成
+            logger.info(f"Client disconnected, stop llm streaming for room {streaming_room_info.room_id}")
+            return
+
+        idx += 1
+        streamer_res += delta
+        yield make_event(idx, streamer_res, "llm")
+
+    # 生成数字人视频，未完成时发心跳
+    finish_task = asyncio.create_task(finish_room_chat(streaming_room_info, sales_info_id, streamer_res, answer_cache_query))
+    try:
+        while True:
+            done, _ = await asyncio.wait([finish_task], timeout=1)
+            if len(done) > 0:
+                break
+            if await request.is_disconnected():
+                logger.info(f"Client disconnected, stop digital human generating for room {streaming_room_info.room_id}")
+                return
+            yield make_event(idx, streamer_res, "dg")
+    finally:
+        if not finish_task.done():
+            finish_task.cancel()
+
+    yield make_event(idx, streamer_res, "all", end_flag=True, video_url=finish_task.result())
+
+
+@router.put("/chat", summary="直播间对话接口")
+async def get_on_air_live_room_api(
+    request: Request, room_chat: RoomChatItem, stream: bool = False, user_id: int = Depends(get_current_user_info)
+):
+    """直播间对话
+
+    Args:
+        room_chat (RoomChatItem): 直播间对话信息
+        stream (bool, optional): True 则以 SSE 流式返回 LLM 结果和数字人视频地址，False 则生成完成后返回. Defaults to False.
+    """
+    streaming_room_info, sales_info_id, prompt, answer_cache_query = await make_room_chat_prompt(room_chat, user_id)
+
+    if stream:
+        return EventSourceResponse(
+            room_chat_stream_process(request, streaming_room_info, sales_info_id, prompt, answer_cache_query)
+        )
+
+    if answer_cache_query is not None and answer_cache_query.hit is not None:
+        await reply_from_answer_cache(streaming_room_info, sales_info_id, answer_cache_query)
+        return make_return_data(True, ResultCode.SUCCESS, "成功", "")
+
+    # 调取 LLM
+    streamer_res = await get_llm_res(prompt)
+
+    await finish_room_chat(streaming_room_info, sales_info_id, streamer_res, answer_cache_query)
+
     return make_return_data(True, ResultCode.SUCCESS, "成功", "")
 
 
+@router.get("/answer-cache", summary="直播间问答缓存命中情况接口")
+async def get_answer_cache_stats_api(user_id: int = Depends(get_current_user_info)):
+    if rag_worker.ANSWER_CACHE is None:
+        return make_return_data(True, ResultCode.SUCCESS, "成功", {})
+    return make_return_data(True, ResultCode.SUCCESS, "成功", rag_worker.ANSWER_CACHE.stats())
+
+
 @router.post("/asr", summary="直播间调取 ASR 语音转文字 接口")
 async def get_on_air_live_room_api(room_chat: RoomChatItem, user_id: int = Depends(get_current_user_info)):
 
@@ -326,7 +497,7 @@ async def get_on_air_live_room_api(room_chat: RoomChatItem, user_id: int = Depen
     }
     logger.info(req_data)
 
-    res = requests.post(API_CONFIG.ASR_URL, json=req_data).json()
+    res = (await ASR_CLIENT.post(API_CONFIG.ASR_URL, json=req_data)).json()
     asr_str = res["result"]
     logger.info(f"ASR res = {asr_str}")
 
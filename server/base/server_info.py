@@ -10,11 +10,14 @@
 """
 
 
+import asyncio
 import random
-import requests
+
+import httpx
 from loguru import logger
 
 from ..web_configs import API_CONFIG, WEB_CONFIGS
+from .http_client import CHECK_CLIENT
 
 
 class ServerPluginsInfo:
@@ -22,12 +25,26 @@ class ServerPluginsInfo:
     def __init__(self) -> None:
         self.update_info()
 
+    @staticmethod
+    def _check_url_list():
+        return [
+            API_CONFIG.TTS_URL + "/check",
+            API_CONFIG.DIGITAL_HUMAN_CHECK_URL,
+            API_CONFIG.ASR_URL + "/check",
+            API_CONFIG.LLM_URL,
+        ]
+
     def update_info(self):
+        """同步检查，仅在服务启动时使用"""
+        self._set_info([self._check_server(url) for url in self._check_url_list()])
 
-        self.tts_server_enabled = self._check_server(API_CONFIG.TTS_URL + "/check")
-        self.digital_human_server_enabled = self._check_server(API_CONFIG.DIGITAL_HUMAN_CHECK_URL)
-        self.asr_server_enabled = self._check_server(API_CONFIG.ASR_URL + "/check")
-        self.llm_enabled = self._check_server(API_CONFIG.LLM_URL)
+    async def async_update_info(self):
+        """异步并发检查各个组件，不阻塞事件循环"""
+        self._set_info(await asyncio.gather(*[self._async_check_server(url) for url in self._check_url_list()]))
+
+    def _set_info(self, check_res):
+
+        self.tts_server_enabled, self.digital_human_server_enabled, self.asr_server_enabled, self.llm_enabled = check_res
 
         if WEB_CONFIGS.AGENT_DELIVERY_TIME_API_KEY is None or WEB_CONFIGS.AGENT_WEATHER_API_KEY is None:
             self.agent_enabled = False
@@ -50,8 +67,8 @@ class ServerPluginsInfo:
     def _check_server(url):
 
         try:
-            res = requests.get(url)
-        except requests.exceptions.ConnectionError:
+            res = httpx.get(url, timeout=API_CONFIG.HTTP_CONNECT_TIMEOUT)
+        except httpx.HTTPError:
             return False
 
         if res.status_code == 200:
@@ -59,6 +76,16 @@ class ServerPluginsInfo:
         else:
             return False
 
+    @staticmethod
+    async def _async_check_server(url):
+
+        try:
+            await CHECK_CLIENT.get(url)
+        except httpx.HTTPError:
+            return False
+
+        return True
+
     @staticmethod
     def _make_color_list(color_num):
 
@@ -87,8 +114,8 @@ class ServerPluginsInfo:
 
         return random.sample(color_list, color_num)
 
-    def get_status(self):
-        self.update_info()
+    async def get_status(self):
+        await self.async_update_info()
 
         info_list = [
             {
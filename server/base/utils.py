@@ -32,12 +32,15 @@ from server.base.models.user_model import UserInfo
 from ..tts.tools import SYMBOL_SPLITS, make_text_chunk
 from ..web_configs import API_CONFIG, WEB_CONFIGS
 from .database.init_db import DB_ENGINE
+from .database.streamer_info_db import get_db_streamer_info
 from .models.product_model import ProductInfo
 from .models.streamer_info_model import StreamerInfo
 from .models.streamer_room_model import OnAirRoomStatusItem, SalesDocAndVideoInfo, StreamRoomInfo
 
+from .job_bus import JOB_BUS, make_job_id
+from .llm_client import ASYNC_LLM_CLIENT
 from .modules.agent.agent_worker import get_agent_result
-from .modules.rag.rag_worker import RAG_RETRIEVER, build_rag_prompt
+from .modules.rag.rag_worker import build_rag_prompt
 from .queue_thread import DIGITAL_HUMAN_QUENE, TTS_TEXT_QUENE
 from .server_info import SERVER_PLUGINS_INFO
 
@@ -51,6 +54,7 @@ class ChatGenConfig(BaseModel):
 
 class ProductInfoItem(BaseModel):
     name: str
+    product_id: int | None = None  # 商品 ID，RAG 只检索该商品的说明书
     heighlights: str
     introduce: str  # 生成商品文案 prompt
 
@@ -69,6 +73,7 @@ class PluginsInfo(BaseModel):
 class ChatItem(BaseModel):
     user_id: str  # User 识别号，用于区分不用的用户调用
     request_id: str  # 请求 ID，用于生成 TTS & 数字人
+    streamer_id: int = 1  # 主播 ID，用于生成对应的数字人
     prompt: List[Dict[str, str]]  # 本次的 prompt
     product_info: ProductInfoItem  # 商品信息
     plugins: PluginsInfo = PluginsInfo()  # 插件信息
@@ -79,7 +84,44 @@ class ChatItem(BaseModel):
 LLM_MODEL_HANDLER = APIClient(API_CONFIG.LLM_URL)
 
 
-async def streamer_sales_process(chat_item: ChatItem):
+def make_digital_human_video_server_url(video_name: str) -> str:
+    """生成数字人视频的服务器地址
+
+    Args:
+        video_name (str): 视频文件名，e.g. {request_id}.mp4
+
+    Returns:
+        str: 视频服务器地址
+    """
+    return f"{API_CONFIG.REQUEST_FILES_URL}/{WEB_CONFIGS.STREAMER_FILE_DIR}/vid_output/{video_name}"
+
+
+def make_tts_voice_info(streamer_info: StreamerInfo | None = None) -> Dict[str, str]:
+    """主播的音色信息，参考音频是服务器地址，需要转换为本地路径"""
+    if streamer_info is None:
+        return {}
+
+    voice_info = {
+        "tts_weight_tag": streamer_info.tts_weight_tag,
+        "tts_reference_sentence": streamer_info.tts_reference_sentence,
+    }
+    tts_reference_audio = streamer_info.tts_reference_audio.replace(API_CONFIG.REQUEST_FILES_URL, "")
+    if tts_reference_audio != "":
+        voice_info["tts_reference_audio"] = str(Path(WEB_CONFIGS.SERVER_FILE_ROOT + tts_reference_audio).absolute())
+    return voice_info
+
+
+async def streamer_sales_process(chat_item: ChatItem, user_id: int):
+    """对话流式返回
+
+    Args:
+        chat_item (ChatItem): 对话信息
+        user_id (int): 登录用户 ID，从 token 中获取，RAG 只检索该用户的商品说明书
+    """
+
+    # 每句 TTS 使用主播的音色，与生成数字人视频接口一致
+    streamer_info = await get_db_streamer_info(user_id, chat_item.streamer_id)
+    voice_info = make_tts_voice_info(streamer_info[0] if len(streamer_info) > 0 else None)
 
     # ====================== Agent ======================
     # 调取 Agent
@@ -89,8 +131,13 @@ async def streamer_sales_process(chat_item: ChatItem):
             "这是网上获取到的信息：“{}”\n 客户的问题：“{}” \n 请认真阅读信息并运用你的性格进行解答。"  # Agent prompt 模板
         )
         input_prompt = chat_item.prompt[-1]["content"]
-        agent_response = get_agent_result(
-            LLM_MODEL_HANDLER, input_prompt, chat_item.product_info.departure_place, chat_item.product_info.delivery_company_name
+        # Agent 使用同步的 lmdeploy client，放到线程中执行避免阻塞事件循环
+        agent_response = await asyncio.to_thread(
+            get_agent_result,
+            LLM_MODEL_HANDLER,
+            input_prompt,
+            chat_item.product_info.departure_place,
+            chat_item.product_info.delivery_company_name,
         )
         if agent_response != "":
             agent_response = GENERATE_AGENT_TEMPLATE.format(agent_response, input_prompt)
@@ -99,10 +146,13 @@ async def streamer_sales_process(chat_item: ChatItem):
 
     # ====================== RAG ======================
     # 调取 rag
-    if chat_item.plugins.rag and agent_response == "":
+    if chat_item.plugins.rag and agent_response == "" and chat_item.product_info.product_id is None:
+        # 向量库按商品划分，没有商品 ID 时无法检索
+        logger.warning("RAG requires product_info.product_id, skip RAG")
+    elif chat_item.plugins.rag and agent_response == "":
         # 如果 Agent 没有执行，则使用 RAG 查询数据库
         rag_prompt = chat_item.prompt[-1]["content"]
-        prompt_pro = build_rag_prompt(RAG_RETRIEVER, chat_item.product_info.name, rag_prompt)
+        prompt_pro = await asyncio.to_thread(build_rag_prompt, user_id, chat_item.product_info.product_id, rag_prompt)
 
         if prompt_pro != "":
             chat_item.prompt[-1]["content"] = prompt_pro
@@ -110,47 +160,209 @@ async def streamer_sales_process(chat_item: ChatItem):
     # llm 推理流返回
     logger.info(chat_item.prompt)
 
-    current_predict = ""
-    idx = 0
-    last_text_index = 0
-    sentence_id = 0
-    model_name = LLM_MODEL_HANDLER.available_models[0]
-    for item in LLM_MODEL_HANDLER.chat_completions_v1(model=model_name, messages=chat_item.prompt, stream=True):
-        logger.debug(f"LLM predict: {item}")
-        if "content" not in item["choices"][0]["delta"]:
-            continue
-        current_res = item["choices"][0]["delta"]["content"]
-
-        if "~" in current_res:
-            current_res = current_res.replace("~", "。").replace("。。", "。")
-
-        current_predict += current_res
-        idx += 1
-
-        if chat_item.plugins.tts and SERVER_PLUGINS_INFO.tts_server_enabled:
-            # 切句子
-            sentence = ""
-            for symbol in SYMBOL_SPLITS:
-                if symbol in current_res:
-                    last_text_index, sentence = make_text_chunk(current_predict, last_text_index)
-                    if len(sentence) <= 3:
-                        # 文字太短的情况，不做生成
-                        sentence = ""
+    # 流式数字人：每句 TTS 完成后马上生成该句的视频，不用等全部文本生成完
+    streaming_digital_human = (
+        WEB_CONFIGS.DIGITAL_HUMAN_STREAMING
+        and chat_item.plugins.tts
+        and SERVER_PLUGINS_INFO.tts_server_enabled
+        and chat_item.plugins.digital_human
+        and SERVER_PLUGINS_INFO.digital_human_server_enabled
+    )
+    merge_digital_human = (
+        not streaming_digital_human
+        and chat_item.plugins.digital_human
+        and SERVER_PLUGINS_INFO.digital_human_server_enabled
+    )
+    tts_jobs = dict()  # 句子 ID -> TTS 完成事件
+    dg_jobs = dict()  # 句子 ID -> 数字人完成事件
+
+    try:
+        current_predict = ""
+        idx = 0
+        last_text_index = 0
+        sentence_id = 0
+        async for current_res in ASYNC_LLM_CLIENT.chat_completions_stream(chat_item.prompt):
+            logger.debug(f"LLM predict: {current_res}")
+
+            if "~" in current_res:
+                current_res = current_res.replace("~", "。").replace("。。", "。")
+
+            current_predict += current_res
+            idx += 1
+
+            if chat_item.plugins.tts and SERVER_PLUGINS_INFO.tts_server_enabled:
+                # 切句子
+                sentence = ""
+                for symbol in SYMBOL_SPLITS:
+                    if symbol in current_res:
+                        last_text_index, sentence = make_text_chunk(current_predict, last_text_index)
+                        if len(sentence) <= 3:
+                            # 文字太短的情况，不做生成
+                            sentence = ""
+                        break
+
+                if sentence != "":
+                    sentence_id += 1
+                    logger.info(f"get sentence: {sentence}")
+                    tts_request_dict = {
+                        "user_id": chat_item.user_id,
+                        "request_id": chat_item.request_id,
+                        "sentence": sentence,
+                        "chunk_id": sentence_id,
+                        # "wav_save_name": chat_item.request_id + f"{str(sentence_id).zfill(8)}.wav",
+                        "gen_digital_human": streaming_digital_human,
+                        "streamer_id": str(chat_item.streamer_id),
+                        **voice_info,
+                    }
+
+                    # 先注册完成事件再下发任务，避免任务完成时还没有等待方
+                    if streaming_digital_human:
+                        dg_jobs[sentence_id] = JOB_BUS.register(make_job_id("dh", chat_item.request_id, sentence_id))
+                    elif merge_digital_human:
+                        tts_jobs[sentence_id] = JOB_BUS.register(make_job_id("tts", chat_item.request_id, sentence_id))
+
+                    await TTS_TEXT_QUENE.put(tts_request_dict)
+                    await asyncio.sleep(0.01)
+
+            yield json.dumps(
+                {
+                    "event": "message",
+                    "retry": 100,
+                    "id": idx,
+                    "data": current_predict,
+                    "step": "llm",
+                    "end_flag": False,
+                },
+                ensure_ascii=False,
+            )
+            await asyncio.sleep(0.01)  # 加个延时避免无法发出 event stream
+
+            if streaming_digital_human:
+                # 边生成文本边推送已经生成好的句子视频
+                for video_event in make_digital_human_chunk_events(dg_jobs, idx):
+                    yield video_event
+
+        if streaming_digital_human:
+            # 等待剩余句子的视频生成完成，完成即推送，超时则发心跳
+            while len(dg_jobs) > 0:
+                done, _ = await asyncio.wait([dg_jobs[min(dg_jobs)]], timeout=1)
+                if len(done) == 0:
+                    yield json.dumps(
+                        {
+                            "event": "message",
+                            "retry": 100,
+                            "id": idx,
+                            "data": current_predict,
+                            "step": "dg",
+                            "end_flag": False,
+                        },
+                        ensure_ascii=False,
+                    )
+                    continue
+
+                for video_event in make_digital_human_chunk_events(dg_jobs, idx):
+                    yield video_event
+
+            # 删除过程文件
+            for chunk_id in range(1, sentence_id + 1):
+                Path(WEB_CONFIGS.TTS_WAV_GEN_PATH, chat_item.request_id + f"-{str(chunk_id).zfill(8)}.wav").unlink(missing_ok=True)
+
+        elif merge_digital_human and len(tts_jobs) > 0:
+
+            # 等待 TTS 生成完成
+            pending_jobs = set(tts_jobs.values())
+            while len(pending_jobs) > 0:
+                _, pending_jobs = await asyncio.wait(pending_jobs, timeout=1)
+                logger.info(f"still need to wait for {len(pending_jobs)}/{sentence_id} wav generating...")
+                if len(pending_jobs) == 0:
                     break
 
-            if sentence != "":
-                sentence_id += 1
-                logger.info(f"get sentence: {sentence}")
-                tts_request_dict = {
-                    "user_id": chat_item.user_id,
-                    "request_id": chat_item.request_id,
-                    "sentence": sentence,
-                    "chunk_id": sentence_id,
-                    # "wav_save_name": chat_item.request_id + f"{str(sentence_id).zfill(8)}.wav",
-                }
+                yield json.dumps(
+                    {
+                        "event": "message",
+                        "retry": 100,
+                        "id": idx,
+                        "data": current_predict,
+                        "step": "tts",
+                        "end_flag": False,
+                    },
+                    ensure_ascii=False,
+                )
+
+            wav_list = []
+            for chunk_id in sorted(tts_jobs):
+                tts_result = tts_jobs[chunk_id].result()
+                if not tts_result["success"]:
+                    logger.error(f"TTS chunk {chunk_id} failed: {tts_result['message']}")
+                    continue
+                wav_list.append(Path(tts_result["wav_path"]))
+
+            if len(wav_list) == 0:
+                # 所有句子的 TTS 都失败时没有可以合并的音频，不再生成数字人视频
+                logger.error(f"all TTS chunks of {chat_item.request_id} failed, skip generating digital human")
+                yield json.dumps(
+                    {
+                        "event": "message",
+                        "retry": 100,
+                        "id": idx,
+                        "data": current_predict,
+                        "step": "all",
+                        "end_flag": True,
+                        "error": "TTS 生成失败",
+                    },
+                    ensure_ascii=False,
+                )
+                return
+
+            # 合并 tts
+            tts_save_path = Path(WEB_CONFIGS.TTS_WAV_GEN_PATH, chat_item.request_id + ".wav")
+            all_tts_data = []
+
+            for wav_file in tqdm(wav_list):
+                logger.info(f"Reading wav file {wav_file}...")
+                with wave.open(str(wav_file), "rb") as wf:
+                    all_tts_data.append([wf.getparams(), wf.readframes(wf.getnframes())])
+
+            logger.info(f"Merging wav file to {tts_save_path}...")
+            tts_params = max([tts_data[0] for tts_data in all_tts_data])
+            with wave.open(str(tts_save_path), "wb") as wf:
+                wf.setparams(tts_params)  # 使用第一个音频参数
+
+                for wf_data in all_tts_data:
+                    wf.writeframes(wf_data[1])
+            logger.info(f"Merged wav file to {tts_save_path} !")
+
+            # 生成数字人视频
+            tts_request_dict = {
+                "user_id": chat_item.user_id,
+                "request_id": chat_item.request_id,
+                "chunk_id": 0,
+                "tts_path": str(tts_save_path),
+                "streamer_id": str(chat_item.streamer_id),
+            }
+
+            logger.info(f"Generating digital human...")
+            dg_job = dg_jobs[0] = JOB_BUS.register(make_job_id("dh", chat_item.request_id, 0))
+            await DIGITAL_HUMAN_QUENE.put(tts_request_dict)
+            while True:
+                done, _ = await asyncio.wait([dg_job], timeout=1)
+                if len(done) > 0:
+                    break
+                yield json.dumps(
+                    {
+                        "event": "message",
+                        "retry": 100,
+                        "id": idx,
+                        "data": current_predict,
+                        "step": "dg",
+                        "end_flag": False,
+                    },
+                    ensure_ascii=False,
+                )
 
-                TTS_TEXT_QUENE.put(tts_request_dict)
-                await asyncio.sleep(0.01)
+            # 删除过程文件
+            for wav_file in wav_list:
+                wav_file.unlink()
 
         yield json.dumps(
             {
@@ -158,107 +370,53 @@ async def streamer_sales_process(chat_item: ChatItem):
                 "retry": 100,
                 "id": idx,
                 "data": current_predict,
-                "step": "llm",
-                "end_flag": False,
+                "step": "all",
+                "end_flag": True,
             },
             ensure_ascii=False,
         )
-        await asyncio.sleep(0.01)  # 加个延时避免无法发出 event stream
+    finally:
+        # 客户端断开时生成器被关闭，释放未完成任务的等待
+        for chunk_id in tts_jobs:
+            JOB_BUS.cancel(make_job_id("tts", chat_item.request_id, chunk_id))
+        for chunk_id in dg_jobs:
+            JOB_BUS.cancel(make_job_id("dh", chat_item.request_id, chunk_id))
 
-    if chat_item.plugins.digital_human and SERVER_PLUGINS_INFO.digital_human_server_enabled:
 
-        wav_list = [
-            Path(WEB_CONFIGS.TTS_WAV_GEN_PATH, chat_item.request_id + f"-{str(i).zfill(8)}.wav")
-            for i in range(1, sentence_id + 1)
-        ]
-        while True:
-            # 等待 TTS 生成完成
-            not_exist_count = 0
-            for tts_wav in wav_list:
-                if not tts_wav.exists():
-                    not_exist_count += 1
+def make_digital_human_chunk_events(dg_jobs: Dict[int, asyncio.Future], event_id: int):
+    """按句子顺序取出已经完成的数字人任务并生成 event，遇到未完成的句子即停止，保证前端按句子顺序播放
 
-            logger.info(f"still need to wait for {not_exist_count}/{sentence_id} wav generating...")
-            if not_exist_count == 0:
-                break
+    Args:
+        dg_jobs (Dict[int, asyncio.Future]): 句子 ID -> 数字人完成事件，已完成的会被移除
+        event_id (int): event stream ID
 
-            yield json.dumps(
-                {
-                    "event": "message",
-                    "retry": 100,
-                    "id": idx,
-                    "data": current_predict,
-                    "step": "tts",
-                    "end_flag": False,
-                },
-                ensure_ascii=False,
-            )
-            await asyncio.sleep(1)  # 加个延时避免无法发出 event stream
-
-        # 合并 tts
-        tts_save_path = Path(WEB_CONFIGS.TTS_WAV_GEN_PATH, chat_item.request_id + ".wav")
-        all_tts_data = []
-
-        for wav_file in tqdm(wav_list):
-            logger.info(f"Reading wav file {wav_file}...")
-            with wave.open(str(wav_file), "rb") as wf:
-                all_tts_data.append([wf.getparams(), wf.readframes(wf.getnframes())])
-
-        logger.info(f"Merging wav file to {tts_save_path}...")
-        tts_params = max([tts_data[0] for tts_data in all_tts_data])
-        with wave.open(str(tts_save_path), "wb") as wf:
-            wf.setparams(tts_params)  # 使用第一个音频参数
-
-            for wf_data in all_tts_data:
-                wf.writeframes(wf_data[1])
-        logger.info(f"Merged wav file to {tts_save_path} !")
-
-        # 生成数字人视频
-        tts_request_dict = {
-            "user_id": chat_item.user_id,
-            "request_id": chat_item.request_id,
-            "chunk_id": 0,
-            "tts_path": str(tts_save_path),
-        }
+    Yields:
+        str: 分句视频 event
+    """
+    while len(dg_jobs) > 0:
+        chunk_id = min(dg_jobs)
+        if not dg_jobs[chunk_id].done():
+            break
+
+        dg_result = dg_jobs.pop(chunk_id).result()
+        if not dg_result["success"]:
+            logger.error(f"Digital human chunk {chunk_id} failed: {dg_result['message']}")
+            continue
 
-        logger.info(f"Generating digital human...")
-        DIGITAL_HUMAN_QUENE.put(tts_request_dict)
-        while True:
-            if (
-                Path(WEB_CONFIGS.DIGITAL_HUMAN_VIDEO_OUTPUT_PATH)
-                .joinpath(Path(tts_save_path).stem + ".mp4")
-                .with_suffix(".txt")
-                .exists()
-            ):
-                break
-            yield json.dumps(
-                {
-                    "event": "message",
-                    "retry": 100,
-                    "id": idx,
-                    "data": current_predict,
-                    "step": "dg",
-                    "end_flag": False,
-                },
-                ensure_ascii=False,
-            )
-            await asyncio.sleep(1)  # 加个延时避免无法发出 event stream
-
-        # 删除过程文件
-        for wav_file in wav_list:
-            wav_file.unlink()
-
-    yield json.dumps(
-        {
-            "event": "message",
-            "retry": 100,
-            "id": idx,
-            "data": current_predict,
-            "step": "all",
-            "end_flag": True,
-        },
-        ensure_ascii=False,
-    )
+        video_path = Path(dg_result["digital_human_mp4_path"])
+        logger.info(f"Digital human chunk {chunk_id} done: {video_path}")
+        yield json.dumps(
+            {
+                "event": "message",
+                "retry": 100,
+                "id": event_id,
+                "data": make_digital_human_video_server_url(video_path.name),
+                "step": "dg_chunk",
+                "chunk_id": chunk_id,
+                "end_flag": False,
+            },
+            ensure_ascii=False,
+        )
 
 
 def make_poster_by_video_first_frame(video_path: str, image_output_name: str):
@@ -1,14 +1,43 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import PlainTextResponse
 from loguru import logger
 from pydantic import BaseModel
 
 
-from .modules.digital_human_worker import gen_digital_human_video_app, preprocess_digital_human_app
+from .modules.digital_human_worker import (
+    DIGITAL_HUMAN_SCHEDULER,
+    LIVE_STREAM_MANAGER,
+    PREPROCESS_PROGRESS,
+    gen_digital_human_video_app,
+    get_avatar_version_app,
+    preprocess_digital_human_app,
+    push_live_video_app,
+    start_live_stream_app,
+    stop_live_stream_app,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """服务生命周期函数"""
+    # 启动渲染调度
+    if DIGITAL_HUMAN_SCHEDULER is not None:
+        DIGITAL_HUMAN_SCHEDULER.start()
+    if LIVE_STREAM_MANAGER is not None:
+        LIVE_STREAM_MANAGER.start()
 
+    yield
 
-app = FastAPI()
+    if DIGITAL_HUMAN_SCHEDULER is not None:
+        DIGITAL_HUMAN_SCHEDULER.stop()
+    if LIVE_STREAM_MANAGER is not None:
+        LIVE_STREAM_MANAGER.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 class DigitalHumanItem(BaseModel):
@@ -17,6 +46,14 @@ class DigitalHumanItem(BaseModel):
     streamer_id: str  # 数字人 ID
     tts_path: str = ""  # 文本
     chunk_id: int = 0  # 句子 ID
+    wait: bool = True  # True 等待渲染完成后返回，False 提交后立即返回任务 ID，通过任务状态接口查询进度
+    live_room_id: str = ""  # 直播间 ID，不为空时渲染过程中同时推送到该直播间的直播流
+
+
+class LiveStreamItem(BaseModel):
+    room_id: str  # 直播间 ID
+    streamer_id: str = ""  # 数字人 ID，直播流未开始时用于生成空闲循环
+    video_path: str = ""  # 推送的视频
 
 
 class DigitalHumanPreprocessItem(BaseModel):
@@ -32,9 +69,60 @@ async def get_digital_human(dg_item: DigitalHumanItem):
     save_tag = (
         dg_item.request_id + ".mp4" if dg_item.chunk_id == 0 else dg_item.request_id + f"-{str(dg_item.chunk_id).zfill(8)}.mp4"
     )
-    mp4_path = await gen_digital_human_video_app(dg_item.streamer_id, dg_item.tts_path, save_tag)
+    mp4_path, job = await gen_digital_human_video_app(
+        dg_item.streamer_id, dg_item.tts_path, save_tag, wait=dg_item.wait, live_room_id=dg_item.live_room_id
+    )
     logger.info(f"digital human mp4 path = {mp4_path}")
-    return {"user_id": dg_item.user_id, "request_id": dg_item.request_id, "digital_human_mp4_path": mp4_path}
+    return {
+        "user_id": dg_item.user_id,
+        "request_id": dg_item.request_id,
+        "digital_human_mp4_path": mp4_path,
+        "job_id": "" if job is None else job.job_id,
+    }
+
+
+@app.get("/digital_human/jobs")
+async def get_digital_human_jobs():
+    """所有渲染任务的状态"""
+    if DIGITAL_HUMAN_SCHEDULER is None:
+        return {"jobs": []}
+    return {"jobs": [job.to_dict() for job in DIGITAL_HUMAN_SCHEDULER.list_jobs()]}
+
+
+@app.get("/digital_human/jobs/{job_id}")
+async def get_digital_human_job(job_id: str):
+    """渲染任务的状态和进度"""
+    job = None if DIGITAL_HUMAN_SCHEDULER is None else DIGITAL_HUMAN_SCHEDULER.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+    return job.to_dict()
+
+
+@app.post("/digital_human/live/start")
+async def start_live_stream(live_item: LiveStreamItem):
+    """开始直播间直播流"""
+    playlist_path = await start_live_stream_app(live_item.room_id, live_item.streamer_id)
+    return {"room_id": live_item.room_id, "playlist_path": playlist_path}
+
+
+@app.post("/digital_human/live/push")
+async def push_live_video(live_item: LiveStreamItem):
+    """已生成的视频推送到直播间直播流，e.g. 商品开场视频"""
+    playlist_path = await push_live_video_app(live_item.room_id, live_item.streamer_id, live_item.video_path)
+    return {"room_id": live_item.room_id, "playlist_path": playlist_path}
+
+
+@app.post("/digital_human/live/stop")
+async def stop_live_stream(live_item: LiveStreamItem):
+    """结束直播间直播流"""
+    stop_live_stream_app(live_item.room_id)
+    return {"room_id": live_item.room_id}
+
+
+@app.get("/digital_human/avatar/{streamer_id}")
+async def get_avatar_info(streamer_id: str):
+    """数字人素材包版本，未预处理为空字符串"""
+    return {"streamer_id": streamer_id, "bundle_version": get_avatar_version_app(streamer_id)}
 
 
 @app.post("/digital_human/preprocess")
@@ -47,6 +135,15 @@ async def preprocess_digital_human(preprocess_item: DigitalHumanPreprocessItem):
     return {"user_id": preprocess_item.user_id, "request_id": preprocess_item.request_id}
 
 
+@app.get("/digital_human/preprocess/{streamer_id}")
+async def get_preprocess_progress(streamer_id: str):
+    """数字人预处理进度"""
+    progress = PREPROCESS_PROGRESS.get(streamer_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"no preprocess for streamer {streamer_id}")
+    return progress.to_dict()
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
     """调 API 入参错误的回调接口
@@ -0,0 +1,51 @@
+import numpy as np
+
+from .musetalk.whisper.whisper.audio import SAMPLE_RATE, load_audio
+
+
+def detect_silent_frames(
+    audio_path, num_frames: int, fps: int, silence_db: float = -45.0, min_silence_sec: float = 0.3, pad_sec: float = 0.12
+) -> np.ndarray:
+    """按视频帧检测静音，静音帧无需进行口型推理，直接使用数字人原始帧
+
+    Args:
+        audio_path (str): 音频路径
+        num_frames (int): 视频帧数
+        fps (int): 视频帧率
+        silence_db (float, optional): 帧内音量（RMS，dBFS）低于该值视为静音. Defaults to -45.0.
+        min_silence_sec (float, optional): 连续静音超过该时长才跳过，避免句中短停顿口型抖动. Defaults to 0.3.
+        pad_sec (float, optional): 有声片段前后各保留的时长，保证开口、闭口过渡自然. Defaults to 0.12.
+
+    Returns:
+        np.ndarray: [num_frames] bool，True 为静音帧
+    """
+    audio = load_audio(str(audio_path))
+    samples_per_frame = SAMPLE_RATE / fps
+
+    # 每帧对应的音频区间，超出音频长度的部分补 0
+    frame_edges = np.round(np.arange(num_frames + 1) * samples_per_frame).astype(np.int64)
+    audio = np.pad(audio, (0, max(int(frame_edges[-1]) - len(audio), 0)))
+    energy = np.add.reduceat(audio.astype(np.float64) ** 2, frame_edges[:-1])
+    frame_lens = np.maximum(np.diff(frame_edges), 1)
+    rms_db = 10 * np.log10(energy / frame_lens + 1e-12)
+
+    voiced = rms_db >= silence_db
+
+    # 有声片段向前后扩展
+    pad_frames = int(round(pad_sec * fps))
+    if pad_frames > 0 and voiced.any():
+        kernel = np.ones(2 * pad_frames + 1, dtype=np.int64)
+        voiced = np.convolve(voiced.astype(np.int64), kernel, mode="same") > 0
+
+    silent = ~voiced
+
+    # 过短的静音片段依然推理
+    min_silence_frames = int(round(min_silence_sec * fps))
+    change_idx = np.flatnonzero(np.diff(silent.astype(np.int8))) + 1
+    run_starts = np.concatenate([[0], change_idx])
+    run_ends = np.concatenate([change_idx, [num_frames]])
+    for run_start, run_end in zip(run_starts, run_ends):
+        if silent[run_start] and run_end - run_start < min_silence_frames:
+            silent[run_start:run_end] = False
+
+    return silent
@@ -0,0 +1,236 @@
+"""
+数字人预处理素材包
+
+每个数字人的预处理结果保存为一个目录：
+    frames.npy        [N, H, W, 3] uint8 原始帧，mmap 读取
+    masks.npy         所有帧 mask 展平拼接的 uint8 数组，mmap 读取，每帧 mask 尺寸不同，按 offset + shape 取出
+    meta.npz          人脸框、mask crop 框、mask 偏移、循环播放的帧索引
+    latents.pt        [M, 8, 32, 32] unet 输入的 latent
+    bundle_info.json  素材包信息，最后写入，存在即代表素材包完整
+
+正放 + 倒放的循环播放只保存索引，不重复保存帧数据。
+"""
+
+import json
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, List
+
+import numpy as np
+import torch
+from loguru import logger
+
+# 素材包格式变化时修改，旧版本素材包需要重新生成
+AVATAR_BUNDLE_VERSION = 1
+
+
+def make_palindrome_index(length: int) -> np.ndarray:
+    """正放 + 倒放的循环播放索引，和之前的 frame_list + frame_list[::-1] 一致"""
+    index = np.arange(length, dtype=np.int64)
+    return np.concatenate([index, index[::-1]])
+
+
+class AvatarBundle:
+    def __init__(
+        self,
+        avatar_id: str,
+        frames: np.ndarray,
+        masks: np.ndarray,
+        mask_offsets: np.ndarray,
+        mask_shapes: np.ndarray,
+        coords: np.ndarray,
+        mask_coords: np.ndarray,
+        latents: torch.Tensor,
+        frame_cycle_index: np.ndarray,
+        latent_cycle_index: np.ndarray,
+    ) -> None:
+        self.avatar_id = avatar_id
+        self.frames = frames
+        self.masks = masks
+        self.mask_offsets = mask_offsets
+        self.mask_shapes = mask_shapes
+        self.coords = coords
+        self.mask_coords = mask_coords
+        self.latents = latents
+        self.frame_cycle_index = frame_cycle_index
+        self.latent_cycle_index = latent_cycle_index
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.frames)
+
+    @property
+    def nbytes(self) -> int:
+        """常驻需要的内存 / 显存大小"""
+        return int(self.frames.nbytes + self.masks.nbytes + self.latents.nelement() * self.latents.element_size())
+
+    def get_mask(self, idx: int) -> np.ndarray:
+        offset = int(self.mask_offsets[idx])
+        mask_h, mask_w = [int(v) for v in self.mask_shapes[idx]]
+        return self.masks[offset : offset + mask_h * mask_w].reshape(mask_h, mask_w)
+
+    def frame_list(self) -> List[np.ndarray]:
+        """所有帧，为 mmap 数组的视图，不拷贝数据"""
+        return [self.frames[idx] for idx in range(self.num_frames)]
+
+    def coord_list(self) -> List[tuple]:
+        return [tuple(int(v) for v in coord) for coord in self.coords]
+
+    def mask_list(self) -> List[np.ndarray]:
+        return [self.get_mask(idx) for idx in range(self.num_frames)]
+
+    def mask_coord_list(self) -> List[list]:
+        return [[int(v) for v in coord] for coord in self.mask_coords]
+
+    def latent_cycle(self) -> List[torch.Tensor]:
+        """循环播放的 latent 列表，元素为 latents 的视图"""
+        return [self.latents[idx : idx + 1] for idx in self.latent_cycle_index]
+
+
+def avatar_bundle_exists(bundle_dir) -> bool:
+    bundle_info_path = Path(bundle_dir).joinpath("bundle_info.json")
+    if not bundle_info_path.exists():
+        return False
+
+    with open(bundle_info_path, "r") as f:
+        bundle_info = json.load(f)
+    return bundle_info.get("version") == AVATAR_BUNDLE_VERSION
+
+
+def get_avatar_bundle_version(bundle_dir) -> str:
+    """素材包版本，重新预处理后会变化，素材包不存在返回空字符串"""
+    bundle_info_path = Path(bundle_dir).joinpath("bundle_info.json")
+    if not avatar_bundle_exists(bundle_dir):
+        return ""
+    return f"v{AVATAR_BUNDLE_VERSION}-{bundle_info_path.stat().st_mtime_ns}"
+
+
+def save_avatar_bundle(
+    bundle_dir,
+    avatar_id: str,
+    frames: List[np.ndarray],
+    masks: List[np.ndarray],
+    coords: List[tuple],
+    mask_coords: List[list],
+    latents: List[torch.Tensor],
+    frame_cycle_index: np.ndarray,
+    latent_cycle_index: np.ndarray,
+):
+    """保存素材包
+
+    Args:
+        bundle_dir (str): 保存目录
+        frames (List[np.ndarray]): 原始帧，BGR，尺寸需一致
+        masks (List[np.ndarray]): 每帧的 mask，单通道
+        coords (List[tuple]): 每帧的人脸框
+        mask_coords (List[list]): 每帧 mask 的 crop 框
+        latents (List[torch.Tensor]): 有人脸的帧的 latent，每个为 [1, 8, 32, 32]
+        frame_cycle_index (np.ndarray): 循环播放时每一步使用的帧索引
+        latent_cycle_index (np.ndarray): 循环播放时每一步使用的 latent 索引
+    """
+    bundle_dir = Path(bundle_dir)
+    if bundle_dir.exists():
+        shutil.rmtree(bundle_dir)
+    bundle_dir.mkdir(parents=True, exist_ok=True)
+
+    # 逐帧写入，避免 stack 全部帧占用双倍内存
+    frame_array = np.lib.format.open_memmap(
+        str(bundle_dir.joinpath("frames.npy")), mode="w+", dtype=np.uint8, shape=(len(frames), *frames[0].shape)
+    )
+    for idx, frame in enumerate(frames):
+        frame_array[idx] = frame
+    frame_array.flush()
+    del frame_array
+
+    masks = [mask[:, :, 0] if mask.ndim == 3 else mask for mask in masks]
+    mask_shapes = np.array([mask.shape for mask in masks], dtype=np.int64)
+    mask_sizes = mask_shapes[:, 0] * mask_shapes[:, 1]
+    mask_offsets = np.concatenate([[0], np.cumsum(mask_sizes)[:-1]]).astype(np.int64)
+    mask_array = np.lib.format.open_memmap(
+        str(bundle_dir.joinpath("masks.npy")), mode="w+", dtype=np.uint8, shape=(int(mask_sizes.sum()),)
+    )
+    for mask, offset, size in zip(masks, mask_offsets, mask_sizes):
+        mask_array[offset : offset + size] = mask.reshape(-1)
+    mask_array.flush()
+    del mask_array
+
+    np.savez(
+        str(bundle_dir.joinpath("meta.npz")),
+        coords=np.array(coords, dtype=np.int64).reshape(-1, 4),
+        mask_coords=np.array(mask_coords, dtype=np.int64).reshape(-1, 4),
+        mask_offsets=mask_offsets,
+        mask_shapes=mask_shapes,
+        frame_cycle_index=np.asarray(frame_cycle_index, dtype=np.int64),
+        latent_cycle_index=np.asarray(latent_cycle_index, dtype=np.int64),
+    )
+
+    torch.save(torch.cat([latent.cpu() for latent in latents], dim=0), str(bundle_dir.joinpath("latents.pt")))
+
+    # 最后写入，作为素材包完整的标志
+    with open(bundle_dir.joinpath("bundle_info.json"), "w") as f:
+        json.dump(
+            {
+                "version": AVATAR_BUNDLE_VERSION,
+                "avatar_id": avatar_id,
+                "num_frames": len(frames),
+                "frame_shape": list(frames[0].shape),
+                "num_latents": len(latents),
+            },
+            f,
+        )
+
+
+def load_avatar_bundle(bundle_dir, avatar_id: str, device="cuda") -> AvatarBundle:
+    """读取素材包，帧和 mask 使用 mmap，按需从磁盘加载"""
+    bundle_dir = Path(bundle_dir)
+    meta = np.load(str(bundle_dir.joinpath("meta.npz")))
+
+    return AvatarBundle(
+        avatar_id=avatar_id,
+        frames=np.load(str(bundle_dir.joinpath("frames.npy")), mmap_mode="r"),
+        masks=np.load(str(bundle_dir.joinpath("masks.npy")), mmap_mode="r"),
+        mask_offsets=meta["mask_offsets"],
+        mask_shapes=meta["mask_shapes"],
+        coords=meta["coords"],
+        mask_coords=meta["mask_coords"],
+        latents=torch.load(str(bundle_dir.joinpath("latents.pt")), map_location=device),
+        frame_cycle_index=meta["frame_cycle_index"],
+        latent_cycle_index=meta["latent_cycle_index"],
+    )
+
+
+class ResidentAvatarCache:
+    """常驻的数字人素材，超出内存预算时淘汰最久未使用的"""
+
+    def __init__(self, max_bytes: int) -> None:
+        """
+        Args:
+            max_bytes (int): 所有常驻数字人最多占用的内存，单位字节
+        """
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, avatar_id: str):
+        with self._lock:
+            if avatar_id not in self._items:
+                return None
+            self._items.move_to_end(avatar_id)
+            return self._items[avatar_id][0]
+
+    def put(self, avatar_id: str, item, nbytes: int):
+        with self._lock:
+            self._items[avatar_id] = (item, nbytes)
+            self._items.move_to_end(avatar_id)
+
+            # 至少保留最新放入的一个
+            while len(self._items) > 1 and sum([size for _, size in self._items.values()]) > self.max_bytes:
+                evict_id, _ = self._items.popitem(last=False)
+                logger.info(f"avatar evicted from memory: {evict_id}")
+
+    def pop(self, avatar_id: str):
+        with self._lock:
+            item = self._items.pop(avatar_id, None)
+        return None if item is None else item[0]
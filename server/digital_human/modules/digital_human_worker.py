@@ -1,33 +1,113 @@
+import asyncio
 from pathlib import Path
-from .realtime_inference import DIGITAL_HUMAN_HANDLER, gen_digital_human_preprocess, gen_digital_human_video
+from .realtime_inference import DIGITAL_HUMAN_HANDLER, PreprocessProgress, gen_digital_human_preprocess
+from .live_stream import LiveStreamManager
+from .render_scheduler import DigitalHumanRenderScheduler
 from ...web_configs import WEB_CONFIGS
 
+if DIGITAL_HUMAN_HANDLER is not None:
+    LIVE_STREAM_MANAGER = LiveStreamManager(
+        WEB_CONFIGS.DIGITAL_HUMAN_LIVE_DIR,
+        fps=DIGITAL_HUMAN_HANDLER.fps,
+        segment_sec=WEB_CONFIGS.DIGITAL_HUMAN_LIVE_SEGMENT_SEC,
+        window_size=WEB_CONFIGS.DIGITAL_HUMAN_LIVE_WINDOW,
+    )
+    DIGITAL_HUMAN_SCHEDULER = DigitalHumanRenderScheduler(
+        DIGITAL_HUMAN_HANDLER, batch_size=DIGITAL_HUMAN_HANDLER.batch_size, live_stream=LIVE_STREAM_MANAGER
+    )
+else:
+    LIVE_STREAM_MANAGER = None
+    DIGITAL_HUMAN_SCHEDULER = None
 
-async def gen_digital_human_video_app(stream_id, audio_path, save_tag):
-    if DIGITAL_HUMAN_HANDLER is None:
-        return None
+# 各数字人最近一次预处理的进度
+PREPROCESS_PROGRESS: dict[str, PreprocessProgress] = {}
 
-    save_path = gen_digital_human_video(
-        DIGITAL_HUMAN_HANDLER,
-        stream_id,
-        audio_path,
-        work_dir=str(Path(WEB_CONFIGS.DIGITAL_HUMAN_VIDEO_OUTPUT_PATH).absolute()),
-        video_path=save_tag,
+
+async def gen_digital_human_video_app(stream_id, audio_path, save_tag, wait=True, live_room_id=""):
+    """提交数字人视频渲染任务
+
+    Args:
+        stream_id (str): 数字人 ID
+        audio_path (str): 音频路径
+        save_tag (str): 视频文件名，文件名去掉后缀作为任务 ID
+        wait (bool, optional): 是否等待渲染完成. Defaults to True.
+        live_room_id (str, optional): 直播间 ID，不为空时渲染过程中同时推送到该直播间的直播流. Defaults to "".
+
+    Returns:
+        Tuple[str, RenderJob]: (视频保存路径, 渲染任务)，不等待时视频路径为空
+    """
+    if DIGITAL_HUMAN_SCHEDULER is None:
+        return None, None
+
+    work_dir = Path(WEB_CONFIGS.DIGITAL_HUMAN_VIDEO_OUTPUT_PATH).absolute()
+    if not work_dir.exists():
+        work_dir.mkdir(exist_ok=True, parents=True)
+
+    job = await DIGITAL_HUMAN_SCHEDULER.submit(
+        job_id=Path(save_tag).stem,
+        avatar_id=str(stream_id),
+        audio_path=audio_path,
+        output_path=str(work_dir.joinpath(save_tag)),
         fps=DIGITAL_HUMAN_HANDLER.fps,
+        live_room_id=live_room_id,
     )
+    if not wait:
+        return "", job
 
-    return save_path
+    save_path = await job.future
+    return save_path, job
+
+
+async def start_live_stream_app(room_id, stream_id) -> str:
+    """开始直播间直播流，已经开始则直接返回
+
+    Returns:
+        str: 播放列表本地路径
+    """
+    if LIVE_STREAM_MANAGER is None:
+        return ""
+
+    room = LIVE_STREAM_MANAGER.get_room(str(room_id))
+    if room is None:
+        resident_avatar = await asyncio.to_thread(DIGITAL_HUMAN_HANDLER.get_resident_avatar, str(stream_id))
+        room = LIVE_STREAM_MANAGER.start_room(str(room_id), resident_avatar.frame_blender)
+    return str(room.playlist_path)
+
+
+async def push_live_video_app(room_id, stream_id, video_path) -> str:
+    """已生成的视频推送到直播间直播流"""
+    playlist_path = await start_live_stream_app(room_id, stream_id)
+    if playlist_path != "":
+        await asyncio.to_thread(LIVE_STREAM_MANAGER.push_video, str(room_id), video_path)
+    return playlist_path
+
+
+def stop_live_stream_app(room_id):
+    if LIVE_STREAM_MANAGER is not None:
+        LIVE_STREAM_MANAGER.stop_room(str(room_id))
+
+
+def get_avatar_version_app(stream_id) -> str:
+    if DIGITAL_HUMAN_HANDLER is None:
+        return ""
+    return DIGITAL_HUMAN_HANDLER.get_bundle_version(str(stream_id))
 
 
 async def preprocess_digital_human_app(stream_id, video_path):
     if DIGITAL_HUMAN_HANDLER is None:
         return None
 
-    res = gen_digital_human_preprocess(
+    progress = PreprocessProgress(avatar_id=str(stream_id))
+    PREPROCESS_PROGRESS[str(stream_id)] = progress
+
+    # 预处理耗时较长，在线程中执行，避免阻塞事件循环
+    res = await asyncio.to_thread(
+        gen_digital_human_preprocess,
         DIGITAL_HUMAN_HANDLER,
         stream_id,
         work_dir=str(Path(WEB_CONFIGS.DIGITAL_HUMAN_VIDEO_OUTPUT_PATH).absolute()),
         video_path=video_path,
+        progress=progress,
     )
 
     return res
@@ -0,0 +1,406 @@
+"""
+直播间 HLS 直播流
+
+每个直播间一个滚动播放列表 live.m3u8，按真实时间逐个发布分片：
+    - 有回答视频时发布回答视频的分片，分片在渲染过程中由 ffmpeg 逐个生成，渲染完成前即可开始播放
+    - 没有可播放的分片时发布数字人原始帧循环（静音）的分片，保证直播流连续
+    - 不同来源的分片之间插入 EXT-X-DISCONTINUITY，并通过 EXT-X-MAP 指定各自的 fMP4 init 分片
+
+目录结构：
+    {live_dir}/{room_id}/live.m3u8        滚动播放列表
+    {live_dir}/{room_id}/idle/            空闲循环的分片
+    {live_dir}/{room_id}/{source_id}/     每个回答视频的分片
+"""
+
+import math
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Deque, Dict, List
+
+from loguru import logger
+
+from .musetalk.utils.blending import FrameBlender
+from .video_encoder import FFmpegVideoWriter, remux_to_hls
+
+
+@dataclass
+class HLSSource:
+    """一个回答视频的分片来源，对应 ffmpeg 输出的 event 播放列表"""
+
+    source_id: str
+    playlist_path: Path
+    consumed: int = 0  # 已发布的分片数
+    segments: List[tuple] = field(default_factory=list)  # (uri, duration)
+    init_uri: str = ""
+    ended: bool = False
+    failed: bool = False  # 渲染失败，已生成的分片播放完后不再等待
+
+
+@dataclass
+class HLSSegment:
+    uri: str  # 相对直播间目录的路径
+    duration: float
+    init_uri: str
+    source_id: str
+    discontinuity: bool = False
+    source: HLSSource | None = None  # 回答视频的分片来源，空闲分片为 None
+
+
+def parse_hls_playlist(playlist_path: Path):
+    """解析 ffmpeg 输出的播放列表
+
+    Returns:
+        Tuple[List[Tuple[str, float]], str, bool]: (分片列表 [(文件名, 时长)], init 分片文件名, 是否已结束)
+    """
+    if not playlist_path.exists():
+        return [], "", False
+
+    segments = []
+    init_uri = ""
+    ended = False
+    duration = None
+    for line in playlist_path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MAP:"):
+            init_uri = line.split('URI="', 1)[1].split('"', 1)[0]
+        elif line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:") :].split(",", 1)[0])
+        elif line == "#EXT-X-ENDLIST":
+            ended = True
+        elif line != "" and not line.startswith("#") and duration is not None:
+            segments.append((line, duration))
+            duration = None
+    return segments, init_uri, ended
+
+
+class LiveRoomStream:
+    """单个直播间的滚动播放列表"""
+
+    def __init__(self, room_id: str, room_dir: Path, segment_sec: float, window_size: int) -> None:
+        self.room_id = room_id
+        self.room_dir = room_dir
+        self.segment_sec = segment_sec
+        self.window_size = window_size
+
+        self.playlist_path = room_dir.joinpath("live.m3u8")
+        self.idle_source: HLSSource | None = None
+        self._idle_index = 0
+        self._sources: Deque[HLSSource] = deque()
+        self._finished_sources: List[HLSSource] = []
+
+        self._window: Deque[HLSSegment] = deque()
+        self._expired: Deque[HLSSegment] = deque()
+        self._media_sequence = 0
+        self._discontinuity_sequence = 0
+        self._last_source_id = ""
+
+        self._published_sec = 0.0
+        self._start_time = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.stopped = False
+        self.writing_source_ids = set()  # 还在写入分片的来源，由 LiveStreamManager 的锁保护
+
+    def push(self, source: HLSSource):
+        with self._lock:
+            if self.stopped:
+                source.failed = True
+                return
+            self._sources.append(source)
+
+    def stop(self):
+        """停止直播间，未播放的来源都标记为失败，不再发布分片"""
+        with self._lock:
+            self.stopped = True
+            for source in self._sources:
+                source.failed = True
+            self._sources.clear()
+
+    def _next_source_segment(self) -> HLSSegment | None:
+        """下一个可以发布的回答分片，渲染中但分片还没生成时返回 None"""
+        while len(self._sources) > 0:
+            source = self._sources[0]
+            if not source.ended:
+                source.segments, source.init_uri, source.ended = parse_hls_playlist(source.playlist_path)
+
+            if source.consumed < len(source.segments):
+                uri, duration = source.segments[source.consumed]
+                source.consumed += 1
+                return HLSSegment(
+                    uri=f"{source.source_id}/{uri}",
+                    duration=duration,
+                    init_uri=f"{source.source_id}/{source.init_uri}",
+                    source_id=source.source_id,
+                    source=source,
+                )
+
+            if source.ended or source.failed:
+                # 分片都已发布，等分片都过期后删除该来源的目录
+                self._finished_sources.append(self._sources.popleft())
+                continue
+            return None
+        return None
+
+    def _next_idle_segment(self) -> HLSSegment | None:
+        if self.idle_source is None or len(self.idle_source.segments) == 0:
+            return None
+
+        uri, duration = self.idle_source.segments[self._idle_index]
+        segment = HLSSegment(
+            uri=f"idle/{uri}",
+            duration=duration,
+            init_uri=f"idle/{self.idle_source.init_uri}",
+            source_id="idle",
+            # 循环到开头时时间戳回退，需要重新开始
+            discontinuity=self._idle_index == 0,
+        )
+        self._idle_index = (self._idle_index + 1) % len(self.idle_source.segments)
+        return segment
+
+    def tick(self):
+        """按真实时间发布分片，保持领先播放时间一个分片"""
+        with self._lock:
+            if self.stopped:
+                return
+            elapsed = time.monotonic() - self._start_time
+            changed = False
+            while self._published_sec < elapsed + self.segment_sec:
+                segment = self._next_source_segment()
+                if segment is None:
+                    segment = self._next_idle_segment()
+                elif self._last_source_id == "idle":
+                    # 回答结束后空闲循环从头开始播放
+                    self._idle_index = 0
+                if segment is None:
+                    # 还没有任何可播放的分片，时间轴从第一个分片开始计算
+                    self._start_time = time.monotonic() - self._published_sec
+                    break
+
+                segment.discontinuity = segment.discontinuity or (self._last_source_id not in ["", segment.source_id])
+                self._last_source_id = segment.source_id
+                self._published_sec += segment.duration
+                self._append(segment)
+                changed = True
+
+            if changed:
+                self._write_playlist()
+
+    def _append(self, segment: HLSSegment):
+        self._window.append(segment)
+        while len(self._window) > self.window_size:
+            expired = self._window.popleft()
+            self._media_sequence += 1
+            if expired.discontinuity:
+                self._discontinuity_sequence += 1
+            if expired.source_id != "idle":
+                self._expired.append(expired)
+
+        # 移出播放列表的分片保留一段时间，避免正在下载的客户端读取失败
+        while len(self._expired) > self.window_size:
+            expired = self._expired.popleft()
+            self.room_dir.joinpath(expired.uri).unlink(missing_ok=True)
+
+        self._remove_finished_sources()
+
+    def _remove_finished_sources(self):
+        """删除已结束、且分片都已过期的来源目录（init 分片、播放列表、没有发布的分片）"""
+        if len(self._finished_sources) == 0:
+            return
+
+        active_source_ids = set([segment.source_id for segment in self._window] + [segment.source_id for segment in self._expired])
+        for source in [source for source in self._finished_sources if source.source_id not in active_source_ids]:
+            shutil.rmtree(self.room_dir.joinpath(source.source_id), ignore_errors=True)
+            self._finished_sources.remove(source)
+
+    def _write_playlist(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:7",
+            f"#EXT-X-TARGETDURATION:{math.ceil(max([segment.duration for segment in self._window]))}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self._media_sequence}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{self._discontinuity_sequence}",
+        ]
+
+        last_init_uri = ""
+        for segment in self._window:
+            if segment.discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            if segment.init_uri != last_init_uri:
+                lines.append(f'#EXT-X-MAP:URI="{segment.init_uri}"')
+                last_init_uri = segment.init_uri
+            lines += [f"#EXTINF:{segment.duration:.3f},", segment.uri]
+
+        # 先写临时文件再替换，避免客户端读到写了一半的播放列表
+        tmp_path = self.playlist_path.with_suffix(".tmp")
+        tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        tmp_path.replace(self.playlist_path)
+
+
+class LiveStreamManager:
+    """所有直播间的直播流，后台线程定时发布分片"""
+
+    def __init__(self, live_dir: str, fps: int, segment_sec: float = 1.0, window_size: int = 6, tick_sec: float = 0.2) -> None:
+        """
+        Args:
+            live_dir (str): 直播流根目录，需要能通过文件服务访问
+            fps (int): 视频帧率
+            segment_sec (float, optional): 分片时长，单位秒. Defaults to 1.0.
+            window_size (int, optional): 播放列表保留的分片数. Defaults to 6.
+            tick_sec (float, optional): 检查新分片的间隔，单位秒. Defaults to 0.2.
+        """
+        self.live_dir = Path(live_dir).absolute()
+        self.fps = fps
+        self.segment_sec = segment_sec
+        self.window_size = window_size
+        self.tick_sec = tick_sec
+
+        self._rooms: Dict[str, LiveRoomStream] = {}
+        self._stopping_rooms: Dict[str, LiveRoomStream] = {}  # 已停止、但还有来源在写入分片的直播间
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._tick_loop, name="digital_human_live_stream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _tick_loop(self):
+        while not self._stop_event.wait(self.tick_sec):
+            with self._lock:
+                rooms = list(self._rooms.values())
+            for room in rooms:
+                try:
+                    room.tick()
+                except Exception:
+                    logger.exception(f"live stream tick failed: {room.room_id}")
+
+    def get_room(self, room_id: str) -> LiveRoomStream | None:
+        with self._lock:
+            return self._rooms.get(str(room_id))
+
+    def start_room(self, room_id: str, frame_blender: FrameBlender) -> LiveRoomStream:
+        """开始直播间直播流，已经开始则直接返回；空闲循环分片在线程中生成，生成前只播放回答视频"""
+        room_id = str(room_id)
+        with self._lock:
+            if room_id in self._rooms:
+                return self._rooms[room_id]
+
+            room_dir = self.live_dir.joinpath(room_id)
+            stopping_room = self._stopping_rooms.get(room_id)
+            if stopping_room is None:
+                shutil.rmtree(room_dir, ignore_errors=True)
+            else:
+                # 上一次直播还有来源在写入，保留这些来源的目录，写入结束后再删除
+                self._clear_room_dir(room_dir, stopping_room.writing_source_ids)
+            room_dir.mkdir(parents=True, exist_ok=True)
+            room = LiveRoomStream(room_id, room_dir, self.segment_sec, self.window_size)
+            self._rooms[room_id] = room
+
+        threading.Thread(target=self._make_idle_source, args=(room, frame_blender), name=f"live_idle_{room_id}", daemon=True).start()
+        return room
+
+    def stop_room(self, room_id: str):
+        """停止直播间直播流，还在写入分片的来源等写入结束后再删除目录"""
+        room_id = str(room_id)
+        with self._lock:
+            room = self._rooms.pop(room_id, None)
+            if room is None:
+                return
+            room.stop()
+            if len(room.writing_source_ids) == 0:
+                shutil.rmtree(room.room_dir, ignore_errors=True)
+            else:
+                self._stopping_rooms[room_id] = room
+                self._clear_room_dir(room.room_dir, room.writing_source_ids)
+
+    @staticmethod
+    def _clear_room_dir(room_dir: Path, keep_names):
+        """删除直播间目录下除 keep_names 外的所有文件和目录"""
+        if not room_dir.exists():
+            return
+        for path in room_dir.iterdir():
+            if path.name in keep_names:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+
+    def _make_idle_source(self, room: LiveRoomStream, frame_blender: FrameBlender):
+        """原始帧循环一遍编码为空闲分片"""
+        try:
+            frame_h, frame_w = frame_blender.frame_list[0].shape[:2]
+            idle_dir = room.room_dir.joinpath("idle")
+            num_frames = len(frame_blender.cycle_index)
+            output_buffer = frame_blender.make_output_buffer(self.fps)
+
+            with FFmpegVideoWriter(None, frame_w, frame_h, self.fps, hls_dir=idle_dir, hls_segment_sec=self.segment_sec) as video_writer:
+                for start_idx in range(0, num_frames, self.fps):
+                    count = min(self.fps, num_frames - start_idx)
+                    for frame in frame_blender.copy_frames(start_idx, count, output_buffer):
+                        video_writer.write(frame)
+
+            segments, init_uri, ended = parse_hls_playlist(Path(video_writer.hls_playlist_path))
+            room.idle_source = HLSSource("idle", Path(video_writer.hls_playlist_path), segments=segments, init_uri=init_uri, ended=ended)
+            logger.info(f"live stream idle segments ready: room {room.room_id}, {len(segments)} segments")
+        except Exception:
+            logger.exception(f"make live stream idle segments failed: {room.room_id}")
+
+    def open_source(self, room_id: str) -> tuple[LiveRoomStream, str, Path] | None:
+        """新的回答视频分片目录，写入结束后需要调用 close_source；直播间没有开始时返回 None
+
+        Returns:
+            Tuple[LiveRoomStream, str, Path] | None: (直播间, 来源 ID, 分片目录)
+        """
+        with self._lock:
+            room = self._rooms.get(str(room_id))
+            if room is None:
+                return None
+            source_id = uuid.uuid4().hex
+            room.writing_source_ids.add(source_id)
+        return room, source_id, room.room_dir.joinpath(source_id)
+
+    def close_source(self, room: LiveRoomStream, source_id: str):
+        """来源的分片写入结束（完成或失败），直播间已停止时删除分片目录，最后一个来源结束后删除直播间目录"""
+        with self._lock:
+            room.writing_source_ids.discard(source_id)
+            if not room.stopped:
+                return
+
+            shutil.rmtree(room.room_dir.joinpath(source_id), ignore_errors=True)
+            if len(room.writing_source_ids) == 0 and self._stopping_rooms.get(room.room_id) is room:
+                self._stopping_rooms.pop(room.room_id)
+                if room.room_id not in self._rooms:
+                    shutil.rmtree(room.room_dir, ignore_errors=True)
+
+    def push_source(self, room: LiveRoomStream, source_id: str, playlist_path) -> HLSSource:
+        """回答视频的分片加入直播间，分片还在生成中也可以加入；直播间已停止时来源直接标记为失败"""
+        source = HLSSource(source_id, Path(playlist_path))
+        room.push(source)
+        return source
+
+    def push_video(self, room_id: str, video_path: str):
+        """已生成的视频切分后加入直播间，e.g. 商品开场视频、缓存命中的视频"""
+        opened = self.open_source(room_id)
+        if opened is None:
+            raise KeyError(f"live room {room_id} not started")
+        room, source_id, source_dir = opened
+        try:
+            playlist_path = remux_to_hls(video_path, source_dir, self.segment_sec)
+            self.push_source(room, source_id, playlist_path)
+        finally:
+            self.close_source(room, source_id)
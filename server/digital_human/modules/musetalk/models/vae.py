@@ -122,6 +122,30 @@ class VAE():
         latent_model_input = torch.cat([masked_latents, ref_latents], dim=1)
         return latent_model_input
 
+    def preprocess_img_batch(self, imgs, half_mask=False):
+        """
+        Preprocess a batch of resized BGR images for the VAE on the device.
+
+        :param imgs: A list of BGR images, already resized to the VAE input size.
+        :param half_mask: Whether to apply a half mask to the images.
+        :return: A preprocessed image tensor [B, 3, 256, 256].
+        """
+        x = torch.from_numpy(np.stack(imgs)[..., ::-1].copy()).to(self.vae.device)  # BGR to RGB
+        x = x.permute(0, 3, 1, 2).float() / 255.
+        if half_mask:
+            x = x * (self._mask_tensor.to(x.device) > 0.5)
+        return self.transform(x)
+
+    def get_latents_for_unet_batch(self, imgs):
+        """
+        Prepare latent variables for a U-Net model from a batch of images.
+        :param imgs: A list of BGR images, already resized to the VAE input size.
+        :return: A tensor of latents [B, 8, 32, 32] for U-Net input.
+        """
+        masked_latents = self.encode_latents(self.preprocess_img_batch(imgs, half_mask=True)) # [B, 4, 32, 32]
+        ref_latents = self.encode_latents(self.preprocess_img_batch(imgs, half_mask=False)) # [B, 4, 32, 32]
+        return torch.cat([masked_latents, ref_latents], dim=1)
+
 if __name__ == "__main__":
     vae_mode_path = "./models/sd-vae-ft-mse/"
     vae = VAE(model_path = vae_mode_path,use_float16=False)
@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from PIL import Image
 import numpy as np
 import cv2
@@ -67,19 +69,17 @@ def get_image(image, face, face_box, fp_model, upper_boundary_ratio=0.5, expand=
     return body[:, :, ::-1]
 
 
-def get_image_prepare_material(image, face_box, fp_model, upper_boundary_ratio=0.5, expand=1.2):
+def _crop_face_large(image, face_box, expand=1.2):
     body = Image.fromarray(image[:, :, ::-1])
+    crop_box, s = get_crop_box(face_box, expand)
+    return body.crop(crop_box), crop_box
+
 
+def _make_material_mask(face_box, crop_box, ori_shape, seg_image, upper_boundary_ratio=0.5):
     x, y, x1, y1 = face_box
-    # print(x1-x,y1-y)
-    crop_box, s = get_crop_box(face_box, expand)
     x_s, y_s, x_e, y_e = crop_box
 
-    face_large = body.crop(crop_box)
-    ori_shape = face_large.size
-
-    mask_image = face_seg(face_large, fp_model)
-    mask_small = mask_image.crop((x - x_s, y - y_s, x1 - x_s, y1 - y_s))
+    mask_small = seg_image.crop((x - x_s, y - y_s, x1 - x_s, y1 - y_s))
     mask_image = Image.new("L", ori_shape, 0)
     mask_image.paste(mask_small, (x - x_s, y - y_s, x1 - x_s, y1 - y_s))
 
@@ -91,9 +91,57 @@ def get_image_prepare_material(image, face_box, fp_model, upper_boundary_ratio=0
 
     blur_kernel_size = int(0.1 * ori_shape[0] // 2 * 2) + 1
     mask_array = cv2.GaussianBlur(np.array(modified_mask_image), (blur_kernel_size, blur_kernel_size), 0)
+    return mask_array
+
+
+def get_image_prepare_material(image, face_box, fp_model, upper_boundary_ratio=0.5, expand=1.2):
+    face_large, crop_box = _crop_face_large(image, face_box, expand)
+    ori_shape = face_large.size
+
+    mask_image = face_seg(face_large, fp_model)
+    mask_array = _make_material_mask(face_box, crop_box, ori_shape, mask_image, upper_boundary_ratio)
     return mask_array, crop_box
 
 
+def get_image_prepare_material_batch(
+    frames, face_boxes, fp_model, batch_size=16, pool: ThreadPoolExecutor | None = None, progress_callback=None, upper_boundary_ratio=0.5, expand=1.2
+):
+    """批量生成每帧的 mask，人脸解析整个 batch 一起推理，裁剪、模糊等 CPU 处理使用线程池并行
+
+    Args:
+        frames (List[np.ndarray]): 视频帧，BGR
+        face_boxes (List[tuple]): 每帧的人脸框
+        fp_model (FaceParsing): 人脸解析模型
+        batch_size (int, optional): 人脸解析每次推理的帧数. Defaults to 16.
+        pool (ThreadPoolExecutor | None, optional): CPU 处理使用的线程池. Defaults to None.
+        progress_callback (Callable[[int, int], None] | None, optional): 进度回调，参数为 (已完成帧数, 总帧数). Defaults to None.
+
+    Returns:
+        Tuple[List[np.ndarray], List[list]]: 每帧的 mask 以及 mask 的 crop 框
+    """
+    map_func = map if pool is None else pool.map
+
+    mask_list = []
+    crop_box_list = []
+    for start_idx in range(0, len(frames), batch_size):
+        batch_boxes = face_boxes[start_idx : start_idx + batch_size]
+        crops = list(map_func(lambda args: _crop_face_large(*args, expand), zip(frames[start_idx : start_idx + batch_size], batch_boxes)))
+
+        seg_images = fp_model.parse_batch([face_large for face_large, _ in crops])
+
+        def _post_process(args):
+            face_box, (face_large, crop_box), seg_image = args
+            return _make_material_mask(face_box, crop_box, face_large.size, seg_image.resize(face_large.size), upper_boundary_ratio)
+
+        mask_list += list(map_func(_post_process, zip(batch_boxes, crops, seg_images)))
+        crop_box_list += [crop_box for _, crop_box in crops]
+
+        if progress_callback is not None:
+            progress_callback(len(mask_list), len(frames))
+
+    return mask_list, crop_box_list
+
+
 def get_image_blending(image, face, face_box, mask_array, crop_box):
     body = Image.fromarray(image[:, :, ::-1])
     face = Image.fromarray(face[:, :, ::-1])
@@ -108,3 +156,163 @@ def get_image_blending(image, face, face_box, mask_array, crop_box):
     body.paste(face_large, crop_box[:2], mask_image)
     body = np.array(body)
     return body[:, :, ::-1]
+
+
+class FrameBlender:
+    """批量合成数字人帧
+
+    get_image_blending 每帧都要转换为 PIL 再 crop / paste，这里预先计算每帧贴回区域和浮点 mask，
+    合成时只对人脸区域做一次 numpy 加权，一个 batch 的帧在线程池中并行合成（cv2 / numpy 计算时会释放 GIL），
+    结果写入预分配的输出缓存。
+    """
+
+    def __init__(
+        self, frame_list, coord_list, mask_list, mask_coords_list, max_batch_size=32, num_workers=4, cycle_index=None, pool=None
+    ):
+        """
+        Args:
+            frame_list (List[np.ndarray]): 原始帧，BGR
+            coord_list (List[tuple]): 人脸框 (x, y, x1, y1)
+            mask_list (List[np.ndarray]): get_image_prepare_material 生成的 mask，尺寸为 crop_box 大小
+            mask_coords_list (List[list]): get_image_prepare_material 生成的 crop_box
+            max_batch_size (int, optional): 一次合成的最大帧数，用于预分配输出缓存. Defaults to 32.
+            num_workers (int, optional): 合成线程数，传入 pool 时无效. Defaults to 4.
+            cycle_index (np.ndarray, optional): 循环播放时每一步使用的帧索引，为 None 则按顺序循环. Defaults to None.
+            pool (ThreadPoolExecutor, optional): 多个数字人共用的合成线程池，为 None 则新建. Defaults to None.
+        """
+        self.frame_list = frame_list
+        self.coord_list = coord_list
+        self.mask_list = mask_list
+        self.mask_coords_list = mask_coords_list
+        self.cycle_index = np.arange(len(frame_list)) if cycle_index is None else np.asarray(cycle_index)
+
+        self.blend_info = [
+            self._make_blend_info(frame, face_box, mask, crop_box)
+            for frame, face_box, mask, crop_box in zip(frame_list, coord_list, mask_list, mask_coords_list)
+        ]
+
+        frame_h, frame_w = frame_list[0].shape[:2]
+        self.output_buffer = np.empty((max_batch_size, frame_h, frame_w, 3), dtype=np.uint8)
+
+        self._own_pool = pool is None
+        self.pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="frame_blender") if pool is None else pool
+
+    @property
+    def nbytes(self) -> int:
+        """预计算的 mask 和输出缓存占用的内存"""
+        mask_bytes = sum([info["mask"].nbytes for info in self.blend_info if info is not None and not info["fallback"]])
+        return int(mask_bytes + self.output_buffer.nbytes)
+
+    @staticmethod
+    def _make_blend_info(frame, face_box, mask, crop_box):
+        """预先计算贴回区域和人脸区域的浮点 mask
+
+        Returns:
+            dict | None: 人脸框无效返回 None，直接使用原始帧
+        """
+        x, y, x1, y1 = [int(v) for v in face_box]
+        if x1 <= x or y1 <= y:
+            return None
+
+        frame_h, frame_w = frame.shape[:2]
+        x_s, y_s = int(crop_box[0]), int(crop_box[1])
+
+        # 人脸框超出画面的部分不需要合成
+        fx0, fy0, fx1, fy1 = max(x, 0), max(y, 0), min(x1, frame_w), min(y1, frame_h)
+        if fx1 <= fx0 or fy1 <= fy0:
+            return None
+
+        if mask.ndim == 3:
+            mask = mask[:, :, 0]
+
+        # crop 以外的区域 paste 前后像素一致，只有人脸框内需要按 mask 加权
+        mask_y0, mask_x0 = fy0 - y_s, fx0 - x_s
+        face_mask = mask[max(mask_y0, 0) : fy1 - y_s, max(mask_x0, 0) : fx1 - x_s]
+        if mask_y0 < 0 or mask_x0 < 0 or face_mask.shape != (fy1 - fy0, fx1 - fx0):
+            # 人脸框超出 crop_box，使用原来的合成方式
+            return {"fallback": True}
+
+        return {
+            "fallback": False,
+            "resize": (x1 - x, y1 - y),
+            "frame_region": (slice(fy0, fy1), slice(fx0, fx1)),
+            "face_region": (slice(fy0 - y, fy1 - y), slice(fx0 - x, fx1 - x)),
+            "mask": (face_mask.astype(np.float32) / 255)[:, :, None],
+        }
+
+    def blend(self, frame_idx, res_frame, out):
+        """合成单帧
+
+        Args:
+            frame_idx (int): 循环播放的帧 ID，超出循环长度会取余
+            res_frame (np.ndarray): unet 生成的人脸，BGR
+            out (np.ndarray): 输出缓存，[H, W, 3]
+        """
+        frame_idx = int(self.cycle_index[frame_idx % len(self.cycle_index)])
+        np.copyto(out, self.frame_list[frame_idx])
+
+        blend_info = self.blend_info[frame_idx]
+        if blend_info is None:
+            return out
+
+        if blend_info["fallback"]:
+            face_box = self.coord_list[frame_idx]
+            face = cv2.resize(np.ascontiguousarray(res_frame, dtype=np.uint8), (face_box[2] - face_box[0], face_box[3] - face_box[1]))
+            out[:] = get_image_blending(out, face, face_box, self.mask_list[frame_idx], self.mask_coords_list[frame_idx])
+            return out
+
+        face = cv2.resize(np.ascontiguousarray(res_frame, dtype=np.uint8), blend_info["resize"])
+        face = face[blend_info["face_region"]].astype(np.float32)
+
+        region = out[blend_info["frame_region"]]
+        blended = region.astype(np.float32)
+        blended += blend_info["mask"] * (face - blended)
+        np.rint(blended, out=blended)
+        region[:] = blended
+        return out
+
+    def make_output_buffer(self, batch_size):
+        """预分配输出缓存，多个任务同时合成同一个数字人时，每个任务使用各自的缓存"""
+        return np.empty((batch_size, *self.output_buffer.shape[1:]), dtype=np.uint8)
+
+    def blend_batch(self, start_idx, res_frames, output_buffer=None):
+        """并行合成一个 batch
+
+        Args:
+            start_idx (int): batch 第一帧的帧 ID
+            res_frames (np.ndarray): unet 生成的人脸，[B, h, w, 3]
+            output_buffer (np.ndarray, optional): 输出缓存，为 None 使用自带的缓存. Defaults to None.
+
+        Returns:
+            np.ndarray: [B, H, W, 3]，为输出缓存的视图，下次调用前需要使用完毕
+        """
+        batch_size = len(res_frames)
+        if output_buffer is None:
+            if batch_size > len(self.output_buffer):
+                self.output_buffer = self.make_output_buffer(batch_size)
+            output_buffer = self.output_buffer
+        elif batch_size > len(output_buffer):
+            raise ValueError(f"output buffer size {len(output_buffer)} < batch size {batch_size}")
+
+        outputs = output_buffer[:batch_size]
+        list(self.pool.map(lambda i: self.blend(start_idx + i, res_frames[i], outputs[i]), range(batch_size)))
+        return outputs
+
+    def copy_frames(self, start_idx, count, output_buffer=None):
+        """无需口型推理的帧（如静音）直接使用原始帧
+
+        Returns:
+            np.ndarray: [count, H, W, 3]，为输出缓存的视图，下次调用前需要使用完毕
+        """
+        output_buffer = self.output_buffer if output_buffer is None else output_buffer
+        if count > len(output_buffer):
+            raise ValueError(f"output buffer size {len(output_buffer)} < frame count {count}")
+
+        outputs = output_buffer[:count]
+        for i in range(count):
+            np.copyto(outputs[i], self.frame_list[int(self.cycle_index[(start_idx + i) % len(self.cycle_index)])])
+        return outputs
+
+    def close(self):
+        if self._own_pool:
+            self.pool.shutdown(wait=True)
@@ -51,6 +51,26 @@ class FaceParsing:
         parsing = Image.fromarray(parsing.astype(np.uint8))
         return parsing
 
+    def parse_batch(self, images, size=(512, 512)):
+        """多张图片一起推理，结果和逐张调用一致
+
+        Args:
+            images (List[Image.Image]): 图片
+            size (tuple, optional): 推理尺寸. Defaults to (512, 512).
+
+        Returns:
+            List[Image.Image]: 每张图片的人脸区域 mask，尺寸为推理尺寸
+        """
+        with torch.no_grad():
+            img = torch.stack([self.preprocess(image.resize(size, Image.BILINEAR)) for image in images])
+            if torch.cuda.is_available():
+                img = img.cuda()
+            out = self.net(img)[0]
+            parsing = out.argmax(1).cpu().numpy()
+            parsing[np.where(parsing > 13)] = 0
+            parsing[np.where(parsing >= 1)] = 255
+        return [Image.fromarray(item.astype(np.uint8)) for item in parsing]
+
 
 if __name__ == "__main__":
     fp = FaceParsing()
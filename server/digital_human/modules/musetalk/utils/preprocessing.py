@@ -1,9 +1,12 @@
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
 import torch
 from face_detection import FaceAlignment, LandmarksType
+from mmengine.dataset import Compose, pseudo_collate
+from mmengine.registry import init_default_scope
 from mmpose.apis import inference_topdown
 from mmpose.structures import merge_data_samples
 from tqdm import tqdm
@@ -24,57 +27,119 @@ def resize_landmark(landmark, w, h, new_w, new_h):
     return landmark_resized
 
 
-def read_imgs(img_list):
-    frames = []
+def read_imgs(img_list, pool: ThreadPoolExecutor | None = None):
+    """读取图片，传入线程池时并行解码"""
     print("reading images...")
-    for img_path in tqdm(img_list):
-        frame = cv2.imread(img_path)
-        frames.append(frame)
-    return frames
-
-
-def get_bbox_range(img_list, model, upperbondrange=0):
-    frames = read_imgs(img_list)
-    batch_size_fa = 1
-    batches = [frames[i : i + batch_size_fa] for i in range(0, len(frames), batch_size_fa)]
-    coords_list = []
-    landmarks = []
+    if pool is None:
+        return [cv2.imread(img_path) for img_path in tqdm(img_list)]
+    return list(tqdm(pool.map(cv2.imread, img_list), total=len(img_list)))
+
+
+def inference_pose_batch(model, frames, pool: ThreadPoolExecutor | None = None):
+    """多张图片一起进行 DWPose 推理，每张图片使用整图作为人体框，和 inference_topdown(model, frame) 结果一致
+
+    Returns:
+        List[np.ndarray]: 每张图片的关键点 [K, 2]
+    """
+    init_default_scope(model.cfg.get("default_scope", "mmpose"))
+    pipeline = Compose(model.cfg.test_dataloader.dataset.pipeline)
+
+    def _preprocess(frame):
+        h, w = frame.shape[:2]
+        data_info = dict(img=frame, bbox=np.array([[0, 0, w, h]], dtype=np.float32), bbox_score=np.ones(1, dtype=np.float32))
+        data_info.update(model.dataset_meta)
+        return pipeline(data_info)
+
+    # 仿射变换等预处理在 CPU 上，使用线程池并行
+    data_list = list(map(_preprocess, frames)) if pool is None else list(pool.map(_preprocess, frames))
+    with torch.no_grad():
+        results = model.test_step(pseudo_collate(data_list))
+    return [result.pred_instances.keypoints[0] for result in results]
+
+
+def get_face_coord(face_land_mark, face_bbox, upperbondrange=0):
+    """根据人脸关键点调整人脸检测框
+
+    Returns:
+        tuple: (人脸框, range_minus, range_plus)
+    """
+    half_face_coord = face_land_mark[29]  # np.mean([face_land_mark[28], face_land_mark[29]], axis=0)
+    range_minus = (face_land_mark[30] - face_land_mark[29])[1]
+    range_plus = (face_land_mark[29] - face_land_mark[28])[1]
+    if upperbondrange != 0:
+        half_face_coord[1] = upperbondrange + half_face_coord[1]  # 手动调整  + 向下（偏29）  - 向上（偏28）
+    half_face_dist = np.max(face_land_mark[:, 1]) - half_face_coord[1]
+    upper_bond = half_face_coord[1] - half_face_dist
+
+    f_landmark = (
+        np.min(face_land_mark[:, 0]),
+        int(upper_bond),
+        np.max(face_land_mark[:, 0]),
+        np.max(face_land_mark[:, 1]),
+    )
+    x1, y1, x2, y2 = f_landmark
+
+    if y2 - y1 <= 0 or x2 - x1 <= 0 or x1 < 0:  # if the landmark bbox is not suitable, reuse the bbox
+        print("error bbox:", face_bbox)
+        return face_bbox, range_minus, range_plus
+    return f_landmark, range_minus, range_plus
+
+
+def get_landmark_and_bbox_batch(
+    frames, model, upperbondrange=0, batch_size=16, pool: ThreadPoolExecutor | None = None, progress_callback=None
+):
+    """批量进行关键点 + 人脸检测，获取每帧的人脸框
+
+    Args:
+        frames (List[np.ndarray]): 视频帧，BGR，尺寸需一致
+        model: DWPose 模型
+        upperbondrange (int, optional): bbox_shift. Defaults to 0.
+        batch_size (int, optional): 每次一起推理的帧数. Defaults to 16.
+        pool (ThreadPoolExecutor | None, optional): CPU 预处理使用的线程池. Defaults to None.
+        progress_callback (Callable[[int, int], None] | None, optional): 进度回调，参数为 (已完成帧数, 总帧数). Defaults to None.
+
+    Returns:
+        List[tuple]: 每帧的人脸框，没有人脸为 coord_placeholder
+    """
     if upperbondrange != 0:
         print("get key_landmark and face bounding boxes with the bbox_shift:", upperbondrange)
     else:
         print("get key_landmark and face bounding boxes with the default value")
+
+    coords_list = []
     average_range_minus = []
     average_range_plus = []
-    for fb in tqdm(batches):
-        results = inference_topdown(model, np.asarray(fb)[0])
-        results = merge_data_samples(results)
-        keypoints = results.pred_instances.keypoints
-        face_land_mark = keypoints[0][23:91]
-        face_land_mark = face_land_mark.astype(np.int32)
+    for start_idx in tqdm(range(0, len(frames), batch_size)):
+        fb = frames[start_idx : start_idx + batch_size]
+        keypoints_list = inference_pose_batch(model, fb, pool)
 
         # get bounding boxes by face detetion
         bbox = fa.get_detections_for_batch(np.asarray(fb))
 
         # adjust the bounding box refer to landmark
         # Add the bounding box to a tuple and append it to the coordinates list
-        for j, f in enumerate(bbox):
+        for keypoints, f in zip(keypoints_list, bbox):
             if f is None:  # no face in the image
                 coords_list += [coord_placeholder]
                 continue
 
-            half_face_coord = face_land_mark[29]  # np.mean([face_land_mark[28], face_land_mark[29]], axis=0)
-            range_minus = (face_land_mark[30] - face_land_mark[29])[1]
-            range_plus = (face_land_mark[29] - face_land_mark[28])[1]
+            face_land_mark = keypoints[23:91].astype(np.int32)
+            face_coord, range_minus, range_plus = get_face_coord(face_land_mark, f, upperbondrange)
             average_range_minus.append(range_minus)
             average_range_plus.append(range_plus)
-            if upperbondrange != 0:
-                half_face_coord[1] = upperbondrange + half_face_coord[1]  # 手动调整  + 向下（偏29）  - 向上（偏28）
+            coords_list += [face_coord]
 
-    text_range = f"Total frame:「{len(frames)}」 Manually adjust range : [ -{int(sum(average_range_minus) / len(average_range_minus))}~{int(sum(average_range_plus) / len(average_range_plus))} ] , the current value: {upperbondrange}"
-    return text_range
+        if progress_callback is not None:
+            progress_callback(len(coords_list), len(frames))
+
+    if len(average_range_minus) > 0:
+        print(
+            f"Total frame:「{len(frames)}」 Manually adjust range : [ -{int(sum(average_range_minus) / len(average_range_minus))}~{int(sum(average_range_plus) / len(average_range_plus))} ] , the current value: {upperbondrange}"
+        )
+    return coords_list
 
 
-def get_landmark_and_bbox(img_list, model, upperbondrange=0):
+def get_bbox_range(img_list, model, upperbondrange=0):
     frames = read_imgs(img_list)
     batch_size_fa = 1
     batches = [frames[i : i + batch_size_fa] for i in range(0, len(frames), batch_size_fa)]
@@ -110,33 +175,14 @@ def get_landmark_and_bbox(img_list, model, upperbondrange=0):
             average_range_plus.append(range_plus)
             if upperbondrange != 0:
                 half_face_coord[1] = upperbondrange + half_face_coord[1]  # 手动调整  + 向下（偏29）  - 向上（偏28）
-            half_face_dist = np.max(face_land_mark[:, 1]) - half_face_coord[1]
-            upper_bond = half_face_coord[1] - half_face_dist
-
-            f_landmark = (
-                np.min(face_land_mark[:, 0]),
-                int(upper_bond),
-                np.max(face_land_mark[:, 0]),
-                np.max(face_land_mark[:, 1]),
-            )
-            x1, y1, x2, y2 = f_landmark
-
-            if y2 - y1 <= 0 or x2 - x1 <= 0 or x1 < 0:  # if the landmark bbox is not suitable, reuse the bbox
-                coords_list += [f]
-                w, h = f[2] - f[0], f[3] - f[1]
-                print("error bbox:", f)
-            else:
-                coords_list += [f_landmark]
-
-    print(
-        "********************************************bbox_shift parameter adjustment**********************************************************"
-    )
-    print(
-        f"Total frame:「{len(frames)}」 Manually adjust range : [ -{int(sum(average_range_minus) / len(average_range_minus))}~{int(sum(average_range_plus) / len(average_range_plus))} ] , the current value: {upperbondrange}"
-    )
-    print(
-        "*************************************************************************************************************************************"
-    )
+
+    text_range = f"Total frame:「{len(frames)}」 Manually adjust range : [ -{int(sum(average_range_minus) / len(average_range_minus))}~{int(sum(average_range_plus) / len(average_range_plus))} ] , the current value: {upperbondrange}"
+    return text_range
+
+
+def get_landmark_and_bbox(img_list, model, upperbondrange=0, batch_size=16, pool: ThreadPoolExecutor | None = None):
+    frames = read_imgs(img_list, pool)
+    coords_list = get_landmark_and_bbox_batch(frames, model, upperbondrange, batch_size=batch_size, pool=pool)
     return coords_list, frames
 
 
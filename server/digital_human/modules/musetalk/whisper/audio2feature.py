@@ -1,14 +1,18 @@
 from .whisper import load_model
+from .whisper.audio import N_FRAMES, load_audio, log_mel_spectrogram
 import numpy as np
+import torch
 import sys
 # sys.path.append("..")
 
 class Audio2Feature():
     def __init__(self, 
                  whisper_model_type="tiny",
-                 model_path="./models/whisper/tiny.pt"):
+                 model_path="./models/whisper/tiny.pt",
+                 max_batch_windows=8):
         self.whisper_model_type = whisper_model_type
         self.model = load_model(model_path) #
+        self.max_batch_windows = max_batch_windows  # 一次送入 encoder 的 30s 窗口数，防止长音频 OOM
 
     def get_sliced_feature(self,
                            feature_array, 
@@ -76,35 +80,57 @@ class Audio2Feature():
     
 
     def feature2chunks(self,feature_array,fps,audio_feat_length = [2,2]):
-        whisper_chunks = []
+        """
+        所有视频帧的音频特征一次切片得到，结果和逐帧调用 get_sliced_feature 一致
+        :return: [N, 10 * (n_layer + 1), 384]，N 为视频帧数
+        """
+        length = len(feature_array)
         whisper_idx_multiplier = 50./fps 
-        i = 0
         print(f"video in {fps} FPS, audio idx in 50FPS")
-        while 1:
-            start_idx = int(i * whisper_idx_multiplier)
-            selected_feature,selected_idx = self.get_sliced_feature(feature_array= feature_array,vid_idx = i,audio_feat_length=audio_feat_length,fps=fps)
-            #print(f"i:{i},selected_idx {selected_idx}")
-            whisper_chunks.append(selected_feature)
-            i += 1
-            if start_idx>len(feature_array):
-                break
 
-        return whisper_chunks
+        # 和逐帧切片的结束条件一致：第一个 int(i * whisper_idx_multiplier) > length 的帧也保留
+        last_idx = max(int(length / whisper_idx_multiplier) - 1, 0)
+        while int(last_idx * whisper_idx_multiplier) <= length:
+            last_idx += 1
 
+        vid_idx = np.arange(last_idx + 1)
+        center_idx = (vid_idx * 50 / fps).astype(np.int64)
+        offsets = np.arange(-audio_feat_length[0] * 2, (audio_feat_length[1] + 1) * 2)
+        selected_idx = np.clip(center_idx[:, None] + offsets[None, :], 0, length - 1)
+
+        whisper_chunks = feature_array[selected_idx]  # [N, 10, n_layer + 1, 384]
+        return whisper_chunks.reshape(len(vid_idx), -1, feature_array.shape[-1])
+
+    @torch.no_grad()
     def audio2feat(self,audio_path):
-        # get the sample rate of the audio
-        result = self.model.transcribe(audio_path)
+        """
+        只运行 whisper encoder，按 30s 窗口批量推理，得到每层的输出
+        :return: [T, n_layer + 1, 384]，T 为 50 FPS 的音频帧数
+        """
+        device = self.model.device
+        dtype = torch.float16 if device.type == "cuda" else torch.float32
+
+        audio = torch.from_numpy(load_audio(audio_path)).to(device)
+        mel = log_mel_spectrogram(audio)  # [80, n_frames]
+        num_frames = mel.shape[-1]
+
+        # 按 30s 切分窗口，最后一个窗口补 0，和 transcribe 中的 pad_or_trim 一致
+        num_windows = max((num_frames + N_FRAMES - 1) // N_FRAMES, 1)
+        mel = torch.nn.functional.pad(mel, (0, num_windows * N_FRAMES - num_frames))
+        mel = mel.reshape(mel.shape[0], num_windows, N_FRAMES).permute(1, 0, 2).to(dtype)  # [num_windows, 80, 3000]
+
         embed_list = []
-        for emb in result['segments']:
-            encoder_embeddings = emb['encoder_embeddings']
-            encoder_embeddings = encoder_embeddings.transpose(0,2,1,3)
-            encoder_embeddings = encoder_embeddings.squeeze(0)
-            start_idx = int(emb['start'])
-            end_idx = int(emb['end'])
-            emb_end_idx = int((end_idx - start_idx)/2)
-            embed_list.append(encoder_embeddings[:emb_end_idx])
-        concatenated_array = np.concatenate(embed_list, axis=0)
-        return concatenated_array
+        for start in range(0, num_windows, self.max_batch_windows):
+            embeddings = self.model.encoder.forward_embeddings(mel[start : start + self.max_batch_windows])
+            embed_list.append(embeddings)
+        embeddings = torch.cat(embed_list, dim=0)  # [num_windows, n_layer + 1, 1500, 384]
+
+        # 每个 mel 帧对应 encoder 的 2 帧下采样，丢弃补 0 部分的输出
+        embeddings = embeddings.permute(0, 2, 1, 3).reshape(-1, embeddings.shape[1], embeddings.shape[-1])
+        embeddings = embeddings[: num_frames // 2]
+
+        # 只在最后拷贝一次到 CPU
+        return embeddings.float().cpu().numpy()
 
 if __name__ == "__main__":
     audio_processor = Audio2Feature(model_path="../../models/whisper/whisper_tiny.pt")
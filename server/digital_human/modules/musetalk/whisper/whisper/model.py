@@ -170,6 +170,28 @@ class AudioEncoder(nn.Module):
         else:
             return x
 
+    def forward_embeddings(self, x: Tensor) -> Tensor:
+        """
+        x : torch.Tensor, shape = (batch_size, n_mels, n_ctx)
+            the mel spectrogram of the audio
+
+        Returns the input embedding and the output of every block, kept on the model device
+        torch.Tensor, shape = (batch_size, n_layer + 1, n_audio_ctx, n_state)
+        """
+        x = F.gelu(self.conv1(x))
+        x = F.gelu(self.conv2(x))
+        x = x.permute(0, 2, 1)
+
+        assert x.shape[1:] == self.positional_embedding.shape, "incorrect audio shape"
+        x = (x + self.positional_embedding).to(x.dtype)
+
+        embeddings = [x]
+        for block in self.blocks:
+            x = block(x)
+            embeddings.append(x)
+
+        return torch.stack(embeddings, dim=1)
+
 
 class TextDecoder(nn.Module):
     def __init__(self, n_vocab: int, n_ctx: int, n_state: int, n_head: int, n_layer: int):
@@ -1,26 +1,34 @@
-import copy
 import glob
 import json
 import os
 import pickle
-import queue
 import shutil
 import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import List
 
 import cv2
 import numpy as np
 import torch
 import wget
 from loguru import logger
-from tqdm import tqdm
 
 from ...web_configs import WEB_CONFIGS
-from .musetalk.utils.blending import get_image_blending, get_image_prepare_material, init_face_parsing_model
-from .musetalk.utils.preprocessing import get_landmark_and_bbox, read_imgs
-from .musetalk.utils.utils import datagen, load_all_model
+from .avatar_bundle import (
+    AvatarBundle,
+    ResidentAvatarCache,
+    avatar_bundle_exists,
+    get_avatar_bundle_version,
+    load_avatar_bundle,
+    make_palindrome_index,
+    save_avatar_bundle,
+)
+from .musetalk.utils.blending import FrameBlender, get_image_prepare_material_batch, init_face_parsing_model
+from .musetalk.utils.preprocessing import get_landmark_and_bbox_batch, read_imgs
+from .musetalk.utils.utils import load_all_model
 
 
 def setup_ffmpeg_env(model_dir):
@@ -142,18 +150,17 @@ def load_face_parsing_model(model_dir):
     return face_parsing_model
 
 
-def video2imgs(vid_path, save_path, ext=".png", cut_frame=10000000):
+def read_video_frames(vid_path, cut_frame=10000000) -> List[np.ndarray]:
+    """视频解码到内存，不再逐帧保存为图片"""
     cap = cv2.VideoCapture(vid_path)
-    count = 0
-    while True:
-        if count > cut_frame:
-            break
+    frames = []
+    while len(frames) <= cut_frame:
         ret, frame = cap.read()
-        if ret:
-            cv2.imwrite(f"{save_path}/{count:08d}.png", frame)
-            count += 1
-        else:
+        if not ret:
             break
+        frames.append(frame)
+    cap.release()
+    return frames
 
 
 def osmakedirs(path_list):
@@ -161,6 +168,48 @@ def osmakedirs(path_list):
         os.makedirs(path) if not os.path.exists(path) else None
 
 
+@dataclass
+class PreprocessProgress:
+    """数字人预处理进度"""
+
+    avatar_id: str
+    status: str = "running"  # running / done / failed
+    stage: str = "queued"  # queued / decode / landmark / latent / mask / save
+    done: int = 0  # 当前阶段已完成的帧数
+    total: int = 0  # 当前阶段总帧数
+    error: str = ""
+    start_time: float = field(default_factory=time.time)
+    end_time: float = 0.0
+
+    def update(self, stage: str, done: int, total: int):
+        self.stage, self.done, self.total = stage, done, total
+        logger.info(f"avatar {self.avatar_id} preprocess {stage}: {done}/{total}")
+
+    def to_dict(self) -> dict:
+        return {
+            "avatar_id": self.avatar_id,
+            "status": self.status,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error,
+            "elapsed": (self.end_time or time.time()) - self.start_time,
+        }
+
+
+@dataclass
+class ResidentAvatar:
+    """常驻内存的数字人素材"""
+
+    bundle: AvatarBundle
+    frame_blender: FrameBlender
+    latent_cycle: List[torch.Tensor]
+
+    @property
+    def nbytes(self) -> int:
+        return self.bundle.nbytes + self.frame_blender.nbytes
+
+
 @torch.no_grad()
 class Avatar:
     def __init__(self, avatar_id, work_dir, model_dir, video_path, bbox_shift, batch_size, fps, preparation_force):
@@ -172,14 +221,15 @@ class Avatar:
         self.work_dir = work_dir
         self.preparation_force = preparation_force
         self.batch_size = batch_size
-        self.idx = 0
         self.fps = fps
 
-        self.frame_list_cycle = []
-        self.coord_list_cycle = []
-        self.input_latent_list_cycle = []
-        self.mask_coords_list_cycle = []
-        self.mask_list_cycle = []
+        # 多个数字人常驻内存，切换时无需重新加载
+        self.avatar_lock = threading.RLock()
+        self.resident_avatars = ResidentAvatarCache(int(WEB_CONFIGS.DIGITAL_HUMAN_AVATAR_CACHE_GB * 1024**3))
+        self.blend_pool = ThreadPoolExecutor(max_workers=WEB_CONFIGS.DIGITAL_HUMAN_BLEND_WORKERS, thread_name_prefix="frame_blender")
+
+        # 预处理进度，预处理时由 gen_digital_human_preprocess 设置
+        self.preprocess_progress: PreprocessProgress | None = None
 
         # 模型初始化，防止 pose 导致 OOM，放到最后加载
         self.face_parsing_model = load_face_parsing_model(self.model_dir)
@@ -190,7 +240,28 @@ class Avatar:
 
         self.change_character(avatar_id)
 
-    def change_character(self, avatar_id, video_path=""):
+    def get_resident_avatar(self, avatar_id) -> ResidentAvatar:
+        """获取数字人素材，不在内存中则加载，供并发渲染使用，每个任务持有各自的素材引用"""
+        # 已常驻的数字人直接返回，不等待预处理等持有锁的操作
+        resident_avatar = self.resident_avatars.get(str(avatar_id))
+        if resident_avatar is not None:
+            return resident_avatar
+
+        with self.avatar_lock:
+            resident_avatar = self.resident_avatars.get(str(avatar_id))
+            if resident_avatar is None:
+                resident_avatar = self.change_character(avatar_id)
+            return resident_avatar
+
+    def get_bundle_version(self, avatar_id) -> str:
+        """数字人素材包版本，用于判断已生成的视频是否可以复用"""
+        return get_avatar_bundle_version(f"{self.work_dir}/{avatar_id}/bundle")
+
+    def change_character(self, avatar_id, video_path="") -> ResidentAvatar:
+        with self.avatar_lock:
+            return self._change_character(avatar_id, video_path)
+
+    def _change_character(self, avatar_id, video_path="") -> ResidentAvatar:
 
         if video_path != "":
             logger.info(f"Switch video from {self.video_path} to {video_path}")
@@ -203,12 +274,32 @@ class Avatar:
         self.latents_out_path = f"{self.avatar_path}/latents.pt"
         self.mask_out_path = f"{self.avatar_path}/mask"
         self.mask_coords_path = f"{self.avatar_path}/mask_coords.pkl"
+        self.bundle_path = f"{self.avatar_path}/bundle"
         self.avatar_info_path = f"{self.avatar_path}/avator_info.json"
         self.avatar_info = {"avatar_id": self.avatar_id, "video_path": self.video_path, "bbox_shift": self.bbox_shift}
 
-        self.init(vae_model=self.vae, face_parsing_model=self.face_parsing_model)
+        resident_avatar = None if self.preparation_force else self.resident_avatars.get(self.avatar_id)
+        if resident_avatar is None:
+            t0 = time.time()
+            resident_avatar = self.load_resident_avatar(self.init(vae_model=self.vae, face_parsing_model=self.face_parsing_model))
+            self.resident_avatars.put(self.avatar_id, resident_avatar, resident_avatar.nbytes)
+            logger.info(f"load avatar {self.avatar_id} costs {(time.time() - t0) * 1000}ms")
+
+        return resident_avatar
+
+    def load_resident_avatar(self, bundle: AvatarBundle) -> ResidentAvatar:
+        frame_blender = FrameBlender(
+            bundle.frame_list(),
+            bundle.coord_list(),
+            bundle.mask_list(),
+            bundle.mask_coord_list(),
+            max_batch_size=self.batch_size,
+            cycle_index=bundle.frame_cycle_index,
+            pool=self.blend_pool,
+        )
+        return ResidentAvatar(bundle=bundle, frame_blender=frame_blender, latent_cycle=bundle.latent_cycle())
 
-    def init(self, vae_model, face_parsing_model):
+    def init(self, vae_model, face_parsing_model) -> AvatarBundle:
         need_to_prepare = False
 
         if self.preparation_force and os.path.exists(self.avatar_path):
@@ -225,189 +316,126 @@ class Avatar:
                 need_to_prepare = True
                 shutil.rmtree(self.avatar_path)
 
-        if need_to_prepare is False:
-            # 对文件再进行一个判断，避免中途出错导致文件没生成全
-            for prepare_file in [
-                self.full_imgs_path,
-                self.coords_path,
-                self.latents_out_path,
-                self.mask_out_path,
-                self.mask_coords_path,
-                self.avatar_info_path,
-            ]:
-                if not os.path.exists(prepare_file):
-                    # 如有文件不存在，则需要重新生成
-                    logger.info(f"Missing file {prepare_file}, will process prerpare...")
-                    need_to_prepare = True
-                    shutil.rmtree(self.avatar_path)
-                    break
+        if need_to_prepare is False and not avatar_bundle_exists(self.bundle_path):
+            legacy_files = [self.full_imgs_path, self.coords_path, self.latents_out_path, self.mask_out_path, self.mask_coords_path]
+            if all([os.path.exists(legacy_file) for legacy_file in legacy_files]):
+                # 旧版本逐帧保存图片的预处理结果，转换为素材包
+                self.convert_legacy_material()
+            else:
+                # 避免中途出错导致文件没生成全，需要重新生成
+                logger.info(f"Missing avatar bundle {self.bundle_path}, will process prerpare...")
+                need_to_prepare = True
+                shutil.rmtree(self.avatar_path)
 
         if need_to_prepare:
             logger.info("*********************************")
             logger.info(f"  creating avator: {self.avatar_id}")
             logger.info("*********************************")
-            osmakedirs([self.avatar_path, self.full_imgs_path, self.mask_out_path])
+            osmakedirs([self.avatar_path])
             self.prepare_material(vae_model=vae_model, face_parsing_model=face_parsing_model)
 
-        self.input_latent_list_cycle = torch.load(self.latents_out_path)
+        return load_avatar_bundle(self.bundle_path, self.avatar_id, device=self.unet.device)
+
+    def convert_legacy_material(self):
+        logger.info(f"converting legacy avatar material: {self.avatar_path}")
+        input_latent_list = torch.load(self.latents_out_path)
         with open(self.coords_path, "rb") as f:
-            self.coord_list_cycle = pickle.load(f)
+            coord_list = pickle.load(f)
         input_img_list = glob.glob(os.path.join(self.full_imgs_path, "*.[jpJP][pnPN]*[gG]"))
         input_img_list = sorted(input_img_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
-        self.frame_list_cycle = read_imgs(input_img_list)
+        frame_list = read_imgs(input_img_list)
         with open(self.mask_coords_path, "rb") as f:
-            self.mask_coords_list_cycle = pickle.load(f)
+            mask_coords_list = pickle.load(f)
         input_mask_list = glob.glob(os.path.join(self.mask_out_path, "*.[jpJP][pnPN]*[gG]"))
         input_mask_list = sorted(input_mask_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
-        self.mask_list_cycle = read_imgs(input_mask_list)
+        mask_list = read_imgs(input_mask_list)
+
+        # 旧版本保存的已经是正放 + 倒放的循环列表，按顺序播放即可
+        save_avatar_bundle(
+            self.bundle_path,
+            self.avatar_id,
+            frame_list,
+            mask_list,
+            coord_list,
+            mask_coords_list,
+            input_latent_list,
+            frame_cycle_index=np.arange(len(frame_list)),
+            latent_cycle_index=np.arange(len(input_latent_list)),
+        )
+
+    def _update_preprocess_progress(self, stage, done, total):
+        if self.preprocess_progress is not None:
+            self.preprocess_progress.update(stage, done, total)
 
     def prepare_material(self, vae_model, face_parsing_model):
         logger.info("preparing data materials ... ...")
         with open(self.avatar_info_path, "w") as f:
             json.dump(self.avatar_info, f)
 
+        batch_size = WEB_CONFIGS.DIGITAL_HUMAN_PREPROCESS_BATCH_SIZE
+
+        # 视频直接解码到内存，图片目录使用线程池并行读取
+        self._update_preprocess_progress("decode", 0, 0)
         if os.path.isfile(self.video_path):
-            video2imgs(self.video_path, self.full_imgs_path, ext="png")
+            frame_list = read_video_frames(self.video_path)
         else:
-            logger.info(f"copy files in {self.video_path}")
-            files = os.listdir(self.video_path)
-            files.sort()
-            files = [file for file in files if file.split(".")[-1] == "png"]
-            for filename in files:
-                shutil.copyfile(f"{self.video_path}/{filename}", f"{self.full_imgs_path}/{filename}")
-        input_img_list = sorted(glob.glob(os.path.join(self.full_imgs_path, "*.[jpJP][pnPN]*[gG]")))
+            logger.info(f"read files in {self.video_path}")
+            files = sorted([file for file in os.listdir(self.video_path) if file.split(".")[-1] == "png"])
+            frame_list = read_imgs([f"{self.video_path}/{filename}" for filename in files], self.blend_pool)
+        self._update_preprocess_progress("decode", len(frame_list), len(frame_list))
 
         logger.info("extracting landmarks...")
         pose_model = load_pose_model(self.model_dir)
-        coord_list, frame_list = get_landmark_and_bbox(input_img_list, pose_model, self.bbox_shift)
+        coord_list = get_landmark_and_bbox_batch(
+            frame_list,
+            pose_model,
+            self.bbox_shift,
+            batch_size=batch_size,
+            pool=self.blend_pool,
+            progress_callback=lambda done, total: self._update_preprocess_progress("landmark", done, total),
+        )
         del pose_model
         torch.cuda.empty_cache()
 
-        input_latent_list = []
-        idx = -1
         # maker if the bbox is not sufficient
         coord_placeholder = (0.0, 0.0, 0.0, 0.0)
-        for bbox, frame in zip(coord_list, frame_list):
-            idx = idx + 1
-            if bbox == coord_placeholder:
-                continue
-            x1, y1, x2, y2 = bbox
-            crop_frame = frame[y1:y2, x1:x2]
-            resized_crop_frame = cv2.resize(crop_frame, (256, 256), interpolation=cv2.INTER_LANCZOS4)
-            latents = vae_model.get_latents_for_unet(resized_crop_frame)
-            input_latent_list.append(latents)
-
-        self.frame_list_cycle = frame_list + frame_list[::-1]
-        self.coord_list_cycle = coord_list + coord_list[::-1]
-        self.input_latent_list_cycle = input_latent_list + input_latent_list[::-1]
-        self.mask_coords_list_cycle = []
-        self.mask_list_cycle = []
-
-        for i, frame in enumerate(tqdm(self.frame_list_cycle)):
-            cv2.imwrite(f"{self.full_imgs_path}/{str(i).zfill(8)}.png", frame)
-
-            face_box = self.coord_list_cycle[i]
-            mask, crop_box = get_image_prepare_material(frame, face_box, face_parsing_model)
-            cv2.imwrite(f"{self.mask_out_path}/{str(i).zfill(8)}.png", mask)
-            self.mask_coords_list_cycle += [crop_box]
-            self.mask_list_cycle.append(mask)
-
-        with open(self.mask_coords_path, "wb") as f:
-            pickle.dump(self.mask_coords_list_cycle, f)
-
-        with open(self.coords_path, "wb") as f:
-            pickle.dump(self.coord_list_cycle, f)
-
-        torch.save(self.input_latent_list_cycle, os.path.join(self.latents_out_path))
-
-    def process_frames(self, res_frame_queue, video_len, skip_save_images, save_dir_name):
-        logger.info(video_len)
-        while True:
-            if self.idx >= video_len - 1:
-                break
-            try:
-                res_frame = res_frame_queue.get(block=True, timeout=1)
-            except queue.Empty:
-                continue
-
-            bbox = self.coord_list_cycle[self.idx % (len(self.coord_list_cycle))]
-            ori_frame = copy.deepcopy(self.frame_list_cycle[self.idx % (len(self.frame_list_cycle))])
-            x1, y1, x2, y2 = bbox
-            try:
-                res_frame = cv2.resize(res_frame.astype(np.uint8), (x2 - x1, y2 - y1))
-            except:
-                continue
-            mask = self.mask_list_cycle[self.idx % (len(self.mask_list_cycle))]
-            mask_crop_box = self.mask_coords_list_cycle[self.idx % (len(self.mask_coords_list_cycle))]
-            # combine_frame = get_image(ori_frame,res_frame,bbox)
-            combine_frame = get_image_blending(ori_frame, res_frame, bbox, mask, mask_crop_box)
-
-            if skip_save_images is False:
-                cv2.imwrite(f"{self.avatar_path}/{save_dir_name}/{str(self.idx).zfill(8)}.png", combine_frame)
-            self.idx = self.idx + 1
-
-    def inference(self, audio_path, output_vid, fps, skip_save_images=False):
-
-        tmp_tag = "tmp_" + datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-
-        os.makedirs(self.avatar_path + f"/{tmp_tag}", exist_ok=True)
-        logger.info("start inference")
-        ############################################## extract audio feature ##############################################
-        start_time = time.time()
-        whisper_feature = self.audio_processor.audio2feat(audio_path)
-        whisper_chunks = self.audio_processor.feature2chunks(feature_array=whisper_feature, fps=fps)
-        logger.info(f"processing audio:{audio_path} costs {(time.time() - start_time) * 1000}ms")
-        ############################################## inference batch by batch ##############################################
-        video_num = len(whisper_chunks)
-        res_frame_queue = queue.Queue()
-        self.idx = 0
-        # # Create a sub-thread and start it
-        process_thread = threading.Thread(
-            target=self.process_frames, args=(res_frame_queue, video_num, skip_save_images, tmp_tag)
-        )
-        process_thread.start()
-
-        gen = datagen(whisper_chunks, self.input_latent_list_cycle, self.batch_size)
-        start_time = time.time()
-
-        for i, (whisper_batch, latent_batch) in enumerate(tqdm(gen, total=int(np.ceil(float(video_num) / self.batch_size)))):
-            audio_feature_batch = torch.from_numpy(whisper_batch)
-            audio_feature_batch = audio_feature_batch.to(device=self.unet.device, dtype=self.unet.model.dtype)
-            audio_feature_batch = self.pe(audio_feature_batch)
-            latent_batch = latent_batch.to(dtype=self.unet.model.dtype)
+        face_indexes = [idx for idx, bbox in enumerate(coord_list) if bbox != coord_placeholder]
 
-            timesteps = torch.tensor([0], device="cuda")
-            pred_latents = self.unet.model(latent_batch, timesteps, encoder_hidden_states=audio_feature_batch).sample
-            recon = self.vae.decode_latents(pred_latents)
-            for res_frame in recon:
-                res_frame_queue.put(res_frame)
-        # Close the queue and sub-thread after all tasks are completed
-        logger.info("waitting for all queue...")
-        process_thread.join()
+        def _crop_face(idx):
+            x1, y1, x2, y2 = coord_list[idx]
+            crop_frame = frame_list[idx][y1:y2, x1:x2]
+            return cv2.resize(crop_frame, (256, 256), interpolation=cv2.INTER_LANCZOS4)
 
-        logger.info("Total process time of {} frames including saving images = {}s".format(video_num, time.time() - start_time))
-
-        cmd_img2video = f"ffmpeg -y -v warning -r {fps} -f image2 -i {self.avatar_path}/{tmp_tag}/%08d.png -vcodec libx264 -vf format=rgb24,scale=out_color_matrix=bt709,format=yuv420p -crf 18 {self.avatar_path}/{tmp_tag}.mp4"
-        logger.info(cmd_img2video)
-        os.system(cmd_img2video)
-
-        # output_vid = os.path.join(self.video_out_path, out_vid_name + ".mp4")  # on
-        cmd_combine_audio = f"ffmpeg -y -v warning -i {audio_path} -i {self.avatar_path}/{tmp_tag}.mp4 {output_vid}"
-        logger.info(cmd_combine_audio)
-        os.system(cmd_combine_audio)
-
-        logger.info("Remove tmp files...")
-        os.remove(f"{self.avatar_path}/{tmp_tag}.mp4")
-        shutil.rmtree(f"{self.avatar_path}/{tmp_tag}")
-
-        # 保存好之后写一个文件，防止在没保存好的时候直接 push 到前端了
-        with open(Path(output_vid).with_suffix(".txt"), "w") as f:
-            f.write("")
-
-        logger.info(f"result is save to {output_vid}")
-
-        return str(output_vid)
+        input_latent_list = []
+        for start_idx in range(0, len(face_indexes), batch_size):
+            crop_frames = list(self.blend_pool.map(_crop_face, face_indexes[start_idx : start_idx + batch_size]))
+            latents = vae_model.get_latents_for_unet_batch(crop_frames)
+            input_latent_list += list(latents.split(1, dim=0))
+            self._update_preprocess_progress("latent", len(input_latent_list), len(face_indexes))
+
+        # 正放 + 倒放循环播放，只需对原始帧计算 mask，循环只保存索引
+        mask_list, mask_coords_list = get_image_prepare_material_batch(
+            frame_list,
+            coord_list,
+            face_parsing_model,
+            batch_size=batch_size,
+            pool=self.blend_pool,
+            progress_callback=lambda done, total: self._update_preprocess_progress("mask", done, total),
+        )
 
+        self._update_preprocess_progress("save", 0, 1)
+        save_avatar_bundle(
+            self.bundle_path,
+            self.avatar_id,
+            frame_list,
+            mask_list,
+            coord_list,
+            mask_coords_list,
+            input_latent_list,
+            frame_cycle_index=make_palindrome_index(len(frame_list)),
+            latent_cycle_index=make_palindrome_index(len(input_latent_list)),
+        )
+        self._update_preprocess_progress("save", 1, 1)
 
 def digital_human_preprocess(model_dir, use_float16, video_path, work_dir, fps, bbox_shift):
 
@@ -428,52 +456,36 @@ def digital_human_preprocess(model_dir, use_float16, video_path, work_dir, fps,
 
 
 @torch.no_grad()
-def gen_digital_human_video(
-    avatar_handler: Avatar,
-    stream_id,
-    audio_path,
-    work_dir,
-    video_path,
-    fps,
-):
-    if not Path(work_dir).exists():
-        Path(work_dir).mkdir(exist_ok=True, parents=True)
-
-    # output_vid_image_dir = Path(work_dir).joinpath(f"{Path(video_path).stem}+{Path(audio_path).stem}")
-    # output_vid_file_path = output_vid_image_dir.with_suffix(".mp4")
-
-    if avatar_handler.avatar_id != str(stream_id):
-        logger.info(f"Change digital human avatar from {avatar_handler.avatar_id} to {stream_id}")
-        avatar_handler.change_character(str(stream_id))
-
-    output_vid_file_path = Path(work_dir).joinpath(video_path)
-    output_vid = avatar_handler.inference(
-        audio_path=audio_path,  # wav file
-        output_vid=str(output_vid_file_path),
-        fps=fps,
-        skip_save_images=False,
-    )
-
-    return output_vid
-
-
-@torch.no_grad()
-def gen_digital_human_preprocess(avatar_handler: Avatar, stream_id, work_dir, video_path):
+def gen_digital_human_preprocess(avatar_handler: Avatar, stream_id, work_dir, video_path, progress: PreprocessProgress | None = None):
     """更换数字人并进行预处理"""
 
     if not Path(work_dir).exists():
         Path(work_dir).mkdir(exist_ok=True, parents=True)
 
-    old_id = avatar_handler.avatar_id  # 方便后续切回去
-    old_video_path = avatar_handler.video_path  # 方便后续切回去
-    avatar_handler.preparation_force = True  # 强制生成，避免在一个 ID 重复上传
-
-    logger.info(f"Processing for id: {stream_id}")
-    avatar_handler.change_character(str(stream_id), video_path)
-
-    # 还原配置
-    avatar_handler.preparation_force = False
-    avatar_handler.change_character(old_id, old_video_path)
+    # 预处理期间不能有其他线程切换数字人
+    with avatar_handler.avatar_lock:
+        old_id = avatar_handler.avatar_id  # 方便后续切回去
+        old_video_path = avatar_handler.video_path  # 方便后续切回去
+        avatar_handler.preparation_force = True  # 强制生成，避免在一个 ID 重复上传
+
+        avatar_handler.preprocess_progress = progress
+
+        logger.info(f"Processing for id: {stream_id}")
+        try:
+            avatar_handler.change_character(str(stream_id), video_path)
+            if progress is not None:
+                progress.status = "done"
+        except Exception as e:
+            if progress is not None:
+                progress.status, progress.error = "failed", str(e)
+            raise
+        finally:
+            # 还原配置
+            if progress is not None:
+                progress.end_time = time.time()
+            avatar_handler.preprocess_progress = None
+            avatar_handler.preparation_force = False
+            avatar_handler.change_character(old_id, old_video_path)
 
     return True
 
@@ -490,19 +502,3 @@ if WEB_CONFIGS.ENABLE_DIGITAL_HUMAN:
 else:
     DIGITAL_HUMAN_HANDLER = None
 
-
-if __name__ == "__main__":
-
-    data_preparation = False
-    video_path = "./work_dirs/tts_wavs/2024-06-05-20-48-53.wav"
-    bbox_shift = 5
-    avatar = Avatar(
-        avatar_id="lelemiao", video_path=video_path, bbox_shift=bbox_shift, batch_size=4, preparation=data_preparation
-    )
-
-    avatar.inference(
-        audio_path=r"./work_dirs/tts_wavs/2024-06-05-20-48-53.wav",
-        out_vid_name="avatar_1",
-        fps=25,
-        skip_save_images=False,
-    )
@@ -0,0 +1,392 @@
+import asyncio
+import math
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
+import torch
+from loguru import logger
+
+from ...web_configs import WEB_CONFIGS
+from .audio_activity import detect_silent_frames
+from .live_stream import HLSSource, LiveStreamManager
+from .musetalk.utils.blending import FrameBlender
+from .realtime_inference import Avatar, ResidentAvatar
+from .video_encoder import FFmpegVideoWriter
+
+
+@dataclass
+class RenderJob:
+    """单个数字人视频渲染任务的状态，渲染过程中的可变状态都保存在任务中，不修改共用的 Avatar"""
+
+    job_id: str
+    avatar_id: str
+    audio_path: str
+    output_path: str
+    fps: int
+    live_room_id: str = ""  # 不为空时同时输出 HLS 分片到该直播间的直播流
+
+    status: str = "queued"  # queued -> preparing -> rendering -> done / failed
+    total_frames: int = 0
+    inferred_frames: int = 0  # 已经推理或跳过推理的帧数
+    skipped_frames: int = 0  # 静音跳过推理的帧数
+    rendered_frames: int = 0  # 已经合成并编码的帧数
+    error: str = ""
+    created_time: float = field(default_factory=time.time)
+    started_time: float = 0.0
+    finished_time: float = 0.0
+
+    # 渲染过程中使用，不对外展示
+    whisper_chunks: np.ndarray | None = None
+    silent_frames: np.ndarray | None = None  # 每帧是否静音
+    run_ends: np.ndarray | None = None  # 每帧所在的连续静音 / 有声片段的结束帧
+    resident_avatar: ResidentAvatar | None = None
+    live_source: HLSSource | None = None
+    frame_queue: queue.Queue = field(default_factory=queue.Queue)
+    future: asyncio.Future | None = None
+    loop: asyncio.AbstractEventLoop | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "avatar_id": self.avatar_id,
+            "live_room_id": self.live_room_id,
+            "status": self.status,
+            "total_frames": self.total_frames,
+            "inferred_frames": self.inferred_frames,
+            "skipped_frames": self.skipped_frames,
+            "rendered_frames": self.rendered_frames,
+            "progress": self.rendered_frames / self.total_frames if self.total_frames > 0 else 0.0,
+            "error": self.error,
+            "created_time": self.created_time,
+            "started_time": self.started_time,
+            "finished_time": self.finished_time,
+            "output_path": self.output_path if self.status == "done" else "",
+        }
+
+    def set_result(self, result=None, exception: Exception | None = None):
+        """在渲染线程中调用，唤醒等待的请求"""
+
+        def _set():
+            if self.future.done():
+                return
+            if exception is not None:
+                self.future.set_exception(exception)
+            else:
+                self.future.set_result(result)
+
+        self.loop.call_soon_threadsafe(_set)
+
+
+class DigitalHumanRenderScheduler:
+    """数字人并发渲染调度
+
+    所有任务共用一个 GPU 推理线程，每次从正在渲染的任务中各取一部分帧拼成一个 unet / vae batch，
+    latent 和音频特征都是逐帧的，不同任务、不同数字人的帧可以放在同一个 batch 中推理；
+    推理结果按任务拆分后交给各任务的合成线程，合成后直接写入该任务的编码器。
+    """
+
+    def __init__(
+        self, avatar_handler: Avatar, batch_size: int, max_history: int = 100, live_stream: LiveStreamManager | None = None
+    ) -> None:
+        """
+        Args:
+            avatar_handler (Avatar): 模型和常驻数字人素材
+            batch_size (int): unet / vae 每次推理的最大帧数
+            max_history (int, optional): 保留多少个已结束任务的状态用于查询. Defaults to 100.
+            live_stream (LiveStreamManager | None, optional): 直播间直播流，任务指定直播间时使用. Defaults to None.
+        """
+        self.avatar_handler = avatar_handler
+        self.live_stream = live_stream
+        self.batch_size = batch_size
+        self.max_history = max_history
+
+        self.jobs: OrderedDict[str, RenderJob] = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._stop_event = threading.Event()
+        self._render_thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._render_thread = threading.Thread(target=self._render_loop, name="digital_human_render", daemon=True)
+        self._render_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._render_thread is not None:
+            self._render_thread.join()
+            self._render_thread = None
+
+    def get_job(self, job_id: str) -> RenderJob | None:
+        with self._jobs_lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[RenderJob]:
+        with self._jobs_lock:
+            return list(self.jobs.values())
+
+    def _add_job(self, job: RenderJob):
+        with self._jobs_lock:
+            self.jobs[job.job_id] = job
+            # 只淘汰已经结束的任务
+            finished_ids = [job_id for job_id, item in self.jobs.items() if item.status in ["done", "failed"]]
+            for job_id in finished_ids[: max(len(self.jobs) - self.max_history, 0)]:
+                del self.jobs[job_id]
+
+    async def submit(self, job_id: str, avatar_id: str, audio_path: str, output_path: str, fps: int, live_room_id: str = "") -> RenderJob:
+        """提交渲染任务，音频特征提取和数字人素材加载在线程中进行，完成后进入渲染队列
+
+        Returns:
+            RenderJob: 任务，可以 await job.future 等待渲染完成
+        """
+        loop = asyncio.get_running_loop()
+        job = RenderJob(
+            job_id=job_id,
+            avatar_id=str(avatar_id),
+            audio_path=audio_path,
+            output_path=output_path,
+            fps=fps,
+            live_room_id=live_room_id,
+            future=loop.create_future(),
+            loop=loop,
+        )
+        self._add_job(job)
+
+        try:
+            await asyncio.to_thread(self._prepare_job, job)
+        except Exception as e:
+            logger.exception(f"prepare digital human job failed: {job_id}")
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_time = time.time()
+            job.future.set_exception(e)
+            return job
+
+        self._pending.put(job)
+        return job
+
+    @torch.no_grad()
+    def _prepare_job(self, job: RenderJob):
+        job.status = "preparing"
+        job.resident_avatar = self.avatar_handler.get_resident_avatar(job.avatar_id)
+
+        start_time = time.time()
+        audio_processor = self.avatar_handler.audio_processor
+        whisper_feature = audio_processor.audio2feat(job.audio_path)
+        job.whisper_chunks = audio_processor.feature2chunks(feature_array=whisper_feature, fps=job.fps)
+        job.total_frames = len(job.whisper_chunks)
+
+        if WEB_CONFIGS.DIGITAL_HUMAN_SILENCE_SKIP:
+            job.silent_frames = detect_silent_frames(
+                job.audio_path,
+                job.total_frames,
+                job.fps,
+                silence_db=WEB_CONFIGS.DIGITAL_HUMAN_SILENCE_DB,
+                min_silence_sec=WEB_CONFIGS.DIGITAL_HUMAN_SILENCE_MIN_SEC,
+            )
+            change_idx = np.flatnonzero(np.diff(job.silent_frames.astype(np.int8))) + 1
+            run_ends = np.concatenate([change_idx, [job.total_frames]])
+            job.run_ends = np.repeat(run_ends, np.diff(np.concatenate([[0], run_ends])))
+            logger.info(f"silent frames: {int(job.silent_frames.sum())} / {job.total_frames}")
+
+        logger.info(f"processing audio:{job.audio_path} costs {(time.time() - start_time) * 1000}ms")
+
+    def _start_job(self, job: RenderJob):
+        """任务开始渲染，启动该任务的合成线程"""
+        job.status = "rendering"
+        job.started_time = time.time()
+        threading.Thread(
+            target=self._composite_loop,
+            args=(job, job.resident_avatar.frame_blender),
+            name=f"digital_human_composite_{job.job_id}",
+            daemon=True,
+        ).start()
+
+    def _composite_loop(self, job: RenderJob, frame_blender: FrameBlender):
+        """合成线程：合成推理结果并写入编码器"""
+        frame_h, frame_w = frame_blender.frame_list[0].shape[:2]
+        output_buffer = frame_blender.make_output_buffer(self.batch_size)
+
+        video_writer = None
+        live_opened = None
+        if job.live_room_id != "" and self.live_stream is not None:
+            # 只推送到已经开始的直播间，直播间已下播时只生成视频文件
+            live_opened = self.live_stream.open_source(job.live_room_id)
+            if live_opened is None:
+                logger.warning(f"live room {job.live_room_id} not started, skip live stream for job {job.job_id}")
+
+        try:
+            if live_opened is not None:
+                # 同一次编码输出直播分片，渲染完成前直播间即可开始播放
+                live_room, source_id, hls_dir = live_opened
+                video_writer = FFmpegVideoWriter(
+                    job.output_path,
+                    frame_w,
+                    frame_h,
+                    job.fps,
+                    audio_path=job.audio_path,
+                    hls_dir=hls_dir,
+                    hls_segment_sec=self.live_stream.segment_sec,
+                )
+                job.live_source = self.live_stream.push_source(live_room, source_id, video_writer.hls_playlist_path)
+            else:
+                video_writer = FFmpegVideoWriter(job.output_path, frame_w, frame_h, job.fps, audio_path=job.audio_path)
+            while True:
+                item = job.frame_queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                start_idx, res_frame_batch, count = item
+                if res_frame_batch is None:
+                    # 静音帧直接使用原始帧
+                    combine_frames = frame_blender.copy_frames(start_idx, count, output_buffer)
+                else:
+                    combine_frames = frame_blender.blend_batch(start_idx, res_frame_batch, output_buffer)
+                for combine_frame in combine_frames:
+                    video_writer.write(combine_frame)
+                job.rendered_frames += count
+
+            video_writer.close()
+        except Exception as e:
+            logger.exception(f"digital human job failed: {job.job_id}")
+            if video_writer is not None:
+                video_writer.abort()
+            if job.live_source is not None:
+                job.live_source.failed = True
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_time = time.time()
+            job.set_result(exception=e)
+            return
+        finally:
+            if live_opened is not None:
+                self.live_stream.close_source(live_opened[0], live_opened[1])
+
+        job.status = "done"
+        job.finished_time = time.time()
+        logger.info(f"digital human job {job.job_id} done, {job.total_frames} frames costs {job.finished_time - job.started_time}s")
+        job.set_result(result=job.output_path)
+
+    def _take_batch(self, active_jobs: List[RenderJob]):
+        """从各个任务中取帧拼成一个 batch，每个任务平均分配，剩余名额按顺序补齐
+
+        Returns:
+            List[Tuple[RenderJob, int, int]]: (任务, 起始帧, 帧数)
+        """
+        remains = [self._voiced_remain(job) for job in active_jobs]
+        share = math.ceil(self.batch_size / len(active_jobs))
+        counts = [min(share, remain) for remain in remains]
+
+        left = self.batch_size - sum(counts)
+        for idx, remain in enumerate(remains):
+            if left <= 0:
+                break
+            extra = min(left, remain - counts[idx])
+            counts[idx] += extra
+            left -= extra
+
+        return [(job, job.inferred_frames, count) for job, count in zip(active_jobs, counts) if count > 0]
+
+    @staticmethod
+    def _voiced_remain(job: RenderJob) -> int:
+        """当前有声片段剩余的帧数，batch 不跨越静音片段"""
+        if job.silent_frames is None:
+            return job.total_frames - job.inferred_frames
+        return int(job.run_ends[job.inferred_frames]) - job.inferred_frames
+
+    def _skip_silent(self, job: RenderJob, active_jobs: List[RenderJob]):
+        """跳过当前位置的静音片段，直接交给合成线程使用原始帧"""
+        if job.silent_frames is None:
+            return
+
+        while job.inferred_frames < job.total_frames and job.silent_frames[job.inferred_frames]:
+            start_idx = job.inferred_frames
+            count = min(int(job.run_ends[start_idx]), start_idx + self.batch_size) - start_idx
+            job.frame_queue.put((start_idx, None, count))
+            job.inferred_frames += count
+            job.skipped_frames += count
+
+        if job.inferred_frames >= job.total_frames:
+            job.frame_queue.put(None)
+            self._finish_infer(job, active_jobs)
+
+    @torch.no_grad()
+    def _infer_batch(self, batch_items):
+        avatar_handler = self.avatar_handler
+
+        whisper_batch, latent_batch = [], []
+        for job, start_idx, count in batch_items:
+            latent_cycle = job.resident_avatar.latent_cycle
+            whisper_batch.append(job.whisper_chunks[start_idx : start_idx + count])
+            latent_batch += [latent_cycle[frame_idx % len(latent_cycle)] for frame_idx in range(start_idx, start_idx + count)]
+
+        audio_feature_batch = torch.from_numpy(np.concatenate(whisper_batch, axis=0))
+        audio_feature_batch = audio_feature_batch.to(device=avatar_handler.unet.device, dtype=avatar_handler.unet.model.dtype)
+        audio_feature_batch = avatar_handler.pe(audio_feature_batch)
+        latent_batch = torch.cat(latent_batch, dim=0).to(dtype=avatar_handler.unet.model.dtype)
+
+        timesteps = torch.tensor([0], device=avatar_handler.unet.device)
+        pred_latents = avatar_handler.unet.model(latent_batch, timesteps, encoder_hidden_states=audio_feature_batch).sample
+        return avatar_handler.vae.decode_latents(pred_latents)
+
+    @staticmethod
+    def _finish_infer(job: RenderJob, active_jobs: List[RenderJob]):
+        """任务推理结束，释放音频特征和素材引用，数字人被淘汰后内存可以回收（合成线程持有各自需要的引用）"""
+        active_jobs.remove(job)
+        job.whisper_chunks = None
+        job.resident_avatar = None
+
+    def _render_loop(self):
+        active_jobs: List[RenderJob] = []
+        while not self._stop_event.is_set():
+            # 没有正在渲染的任务时阻塞等待新任务
+            try:
+                while True:
+                    job = self._pending.get(block=len(active_jobs) == 0, timeout=0.5)
+                    self._start_job(job)
+                    active_jobs.append(job)
+            except queue.Empty:
+                pass
+
+            # 合成失败的任务不再推理
+            for job in [job for job in active_jobs if job.status == "failed"]:
+                self._finish_infer(job, active_jobs)
+
+            # 静音片段不需要推理
+            for job in list(active_jobs):
+                self._skip_silent(job, active_jobs)
+
+            if len(active_jobs) == 0:
+                continue
+
+            batch_items = self._take_batch(active_jobs)
+            try:
+                recon = self._infer_batch(batch_items)
+            except Exception as e:
+                logger.exception("digital human render batch failed")
+                for job, _, _ in batch_items:
+                    job.frame_queue.put(e)
+                    self._finish_infer(job, active_jobs)
+                continue
+
+            # 推理结果按任务拆分，交给各任务的合成线程
+            offset = 0
+            for job, start_idx, count in batch_items:
+                job.frame_queue.put((start_idx, recon[offset : offset + count], count))
+                offset += count
+                job.inferred_frames += count
+
+                if job.inferred_frames >= job.total_frames:
+                    job.frame_queue.put(None)
+                    self._finish_infer(job, active_jobs)
+
+        # 服务停止，未完成的任务直接结束
+        for job in active_jobs:
+            job.frame_queue.put(RuntimeError("digital human render scheduler stopped"))
@@ -0,0 +1,163 @@
+import subprocess
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+
+def make_hls_output_args(hls_dir, segment_sec: float) -> tuple[str, str]:
+    """fMP4 HLS 输出参数
+
+    Returns:
+        Tuple[str, str]: (tee 输出中的 hls 描述, 播放列表路径)
+    """
+    hls_dir = Path(hls_dir).absolute()
+    hls_dir.mkdir(parents=True, exist_ok=True)
+    playlist_path = hls_dir.joinpath("index.m3u8")
+    hls_options = ":".join(
+        [
+            "f=hls",
+            f"hls_time={segment_sec}",
+            "hls_list_size=0",
+            "hls_playlist_type=event",
+            "hls_segment_type=fmp4",
+            "hls_fmp4_init_filename=init.mp4",
+            f"hls_segment_filename={hls_dir.joinpath('seg_%05d.m4s')}",
+        ]
+    )
+    return f"[{hls_options}]{playlist_path}", str(playlist_path)
+
+
+class FFmpegVideoWriter:
+    """通过 rawvideo 管道将内存中的 BGR 帧直接送入 ffmpeg 编码，同一次编码合入音频，无需将每帧保存为图片再读取"""
+
+    def __init__(
+        self,
+        output_path,
+        width: int,
+        height: int,
+        fps: int,
+        audio_path=None,
+        crf: int = 18,
+        hls_dir=None,
+        hls_segment_sec: float = 1.0,
+    ) -> None:
+        """
+        Args:
+            output_path (str): 输出视频路径，为 None 则只输出 HLS
+            width (int): 帧宽
+            height (int): 帧高
+            fps (int): 帧率
+            audio_path (str, optional): 需要合入的音频，为 None 则只有视频，输出 HLS 时使用静音音轨. Defaults to None.
+            crf (int, optional): x264 质量参数. Defaults to 18.
+            hls_dir (str, optional): 同一次编码额外输出 fMP4 HLS 分片的目录，分片随编码进度逐个生成. Defaults to None.
+            hls_segment_sec (float, optional): HLS 分片时长，单位秒. Defaults to 1.0.
+        """
+        self.output_path = None if output_path is None else str(output_path)
+        self.width = width
+        self.height = height
+        self.frame_count = 0
+        self.hls_playlist_path = None
+
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-v",
+            "warning",
+            # 视频输入：stdin 的 BGR 裸数据
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgr24",
+            "-s",
+            f"{width}x{height}",
+            "-r",
+            str(fps),
+            "-i",
+            "pipe:0",
+        ]
+        if audio_path is not None:
+            cmd += ["-i", str(audio_path), "-map", "0:v", "-map", "1:a", "-c:a", "aac"]
+        elif hls_dir is not None:
+            # 直播流前后片段的音轨需要一致，没有音频时使用静音
+            cmd += ["-f", "lavfi", "-i", "anullsrc=r=44100:cl=mono", "-map", "0:v", "-map", "1:a", "-c:a", "aac", "-shortest"]
+
+        cmd += [
+            "-vcodec",
+            "libx264",
+            "-vf",
+            "format=rgb24,scale=out_color_matrix=bt709,format=yuv420p",
+            "-crf",
+            str(crf),
+        ]
+
+        if hls_dir is None:
+            cmd += [self.output_path]
+        else:
+            # 固定间隔插入关键帧，保证分片时长一致；编码一次，通过 tee 同时输出 mp4 和 HLS
+            hls_output, self.hls_playlist_path = make_hls_output_args(hls_dir, hls_segment_sec)
+            tee_outputs = [hls_output] if self.output_path is None else [f"[f=mp4]{self.output_path}", hls_output]
+            cmd += [
+                "-force_key_frames",
+                f"expr:gte(t,n_forced*{hls_segment_sec})",
+                "-flags",
+                "+global_header",
+                "-f",
+                "tee",
+                "|".join(tee_outputs),
+            ]
+        logger.info(" ".join(cmd))
+
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray):
+        """写入一帧，frame 为 [H, W, 3] uint8 BGR"""
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(f"frame shape {frame.shape} mismatch with ({self.height}, {self.width}, 3)")
+
+        # 连续内存直接写入管道，不额外拷贝
+        self._proc.stdin.write(memoryview(np.ascontiguousarray(frame, dtype=np.uint8)))
+        self.frame_count += 1
+
+    def close(self) -> str:
+        """结束输入并等待编码完成
+
+        Returns:
+            str: 输出视频路径
+        """
+        if self._proc.stdin is not None and not self._proc.stdin.closed:
+            self._proc.stdin.close()
+        return_code = self._proc.wait()
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg encode failed, return code = {return_code}, output = {self.output_path or self.hls_playlist_path}")
+
+        logger.info(f"encoded {self.frame_count} frames to {self.output_path or self.hls_playlist_path}")
+        return self.output_path
+
+    def abort(self):
+        """出错时终止编码进程"""
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def remux_to_hls(video_path, hls_dir, segment_sec: float = 1.0) -> str:
+    """已生成的视频不重新编码，直接切分为 fMP4 HLS 分片，分片在关键帧处切分
+
+    Returns:
+        str: 播放列表路径
+    """
+    hls_output, playlist_path = make_hls_output_args(hls_dir, segment_sec)
+    cmd = ["ffmpeg", "-y", "-v", "warning", "-i", str(video_path), "-map", "0", "-c", "copy", "-f", "tee", hls_output]
+    logger.info(" ".join(cmd))
+    subprocess.run(cmd, check=True)
+    return playlist_path
@@ -9,8 +9,9 @@ from torchmetrics.classification import MulticlassAccuracy
 from tqdm import tqdm
 
 from ..modules.embedding import SinePositionalEmbedding, TokenEmbedding
+from ..modules.kv_cache import KVCachePool
 from ..modules.transformer import LayerNorm, TransformerEncoder, TransformerEncoderLayer
-from .utils import dpo_loss, get_batch_logps, make_pad_mask, make_reject_y, sample, topk_sampling
+from .utils import dpo_loss, get_batch_logps, make_pad_mask, make_reject_y, sample, sample_batch, topk_sampling
 
 default_config = {
     "embedding_dim": 512,
@@ -63,6 +64,9 @@ class Text2SemanticDecoder(nn.Module):
         self.ar_predict_layer = nn.Linear(self.model_dim, self.vocab_size, bias=False)
         self.loss_fct = nn.CrossEntropyLoss(reduction="sum")
 
+        # 推理时复用预分配的 kv cache
+        self.kv_cache_pool = KVCachePool()
+
         self.ar_accuracy_metric = MulticlassAccuracy(
             self.vocab_size,
             top_k=top_k,
@@ -290,6 +294,11 @@ class Text2SemanticDecoder(nn.Module):
             y = torch.concat([y, samples], dim=1)
         return y
 
+    def _acquire_kv_cache(self, x_len, prefix_len, bsz, early_stop_num, dtype, device):
+        """按本次解码的最大长度从池中获取预分配的 kv cache"""
+        max_steps = 1500 if early_stop_num == -1 else min(1500, early_stop_num + 2)
+        return self.kv_cache_pool.acquire(self.num_layers, x_len + prefix_len + max_steps, bsz, self.model_dim, dtype, device)
+
     def pad_y_eos(self, y, y_mask_int, eos_id):
         targets = F.pad(y, (0, 1), value=0) + eos_id * F.pad(y_mask_int, (0, 1), value=1)
         # 错位
@@ -315,7 +324,6 @@ class Text2SemanticDecoder(nn.Module):
 
         x_len = x.shape[1]
         x_attn_mask = torch.zeros((x_len, x_len), dtype=torch.bool)
-        stop = False
         # print(1111111,self.num_layers)
         cache = {
             "all_stage": self.num_layers,
@@ -327,6 +335,7 @@ class Text2SemanticDecoder(nn.Module):
             # "xy_dec":None,###不需要，本来只需要最后一个做logits
             "first_infer": 1,
             "stage": 0,
+            "kv_cache": None,  # 预分配的 kv cache，不为空时 k v 原地写入其中
         }
         ###################  first step ##########################
         if y is not None:
@@ -346,6 +355,8 @@ class Text2SemanticDecoder(nn.Module):
             y = torch.zeros(x.shape[0], 0, dtype=torch.int, device=x.device)
             ref_free = True
 
+        cache["kv_cache"] = self._acquire_kv_cache(x_len, prefix_len, x.shape[0], early_stop_num, x.dtype, x.device)
+
         x_attn_mask_pad = F.pad(
             x_attn_mask,
             (0, y_len),  ###xx的纯0扩展到xx纯0+xy纯1，(x,x+y)
@@ -358,6 +369,19 @@ class Text2SemanticDecoder(nn.Module):
         )
         xy_attn_mask = torch.concat([x_attn_mask_pad, y_attn_mask], dim=0).to(x.device)
 
+        try:
+            y, idx = self._infer_panel_loop(
+                xy_pos, xy_attn_mask, cache, y, x_len, prefix_len, top_k, top_p, early_stop_num, temperature
+            )
+        finally:
+            self.kv_cache_pool.release(cache["kv_cache"])
+
+        if ref_free:
+            return y[:, :-1], 0
+        return y[:, :-1], idx - 1
+
+    def _infer_panel_loop(self, xy_pos, xy_attn_mask, cache, y, x_len, prefix_len, top_k, top_p, early_stop_num, temperature):
+        stop = False
         for idx in tqdm(range(1500)):
 
             xy_dec, _ = self.h((xy_pos, None), mask=xy_attn_mask, cache=cache)
@@ -391,23 +415,150 @@ class Text2SemanticDecoder(nn.Module):
 
             ####################### update next step ###################################
             cache["first_infer"] = 0
-            if cache["y_emb"] is not None:
-                y_emb = torch.cat([cache["y_emb"], self.ar_audio_embedding(y[:, -1:])], dim=1)
-                cache["y_emb"] = y_emb
-                y_pos = self.ar_audio_position(y_emb)
-                xy_pos = y_pos[:, -1:]
-            else:
-                y_emb = self.ar_audio_embedding(y[:, -1:])
-                cache["y_emb"] = y_emb
-                y_pos = self.ar_audio_position(y_emb)
-                xy_pos = y_pos
-            y_len = y_pos.shape[1]
+            # 只对最新的 token 求 emb 和位置编码，历史 y 的信息已经在 kv cache 中，无需重新拼接
+            y_len = y.shape[1]
+            xy_pos = self.ar_audio_position.forward_step(self.ar_audio_embedding(y[:, -1:]), y_len - 1)
 
             ###最右边一列（是错的）
             # xy_attn_mask=torch.ones((1, x_len+y_len), dtype=torch.bool,device=xy_pos.device)
             # xy_attn_mask[:,-1]=False
             ###最下面一行（是对的）
             xy_attn_mask = torch.zeros((1, x_len + y_len), dtype=torch.bool, device=xy_pos.device)
-        if ref_free:
-            return y[:, :-1], 0
-        return y[:, :-1], idx - 1
+
+        return y, idx
+
+    def infer_panel_batch(
+        self,
+        x_list,  #####每句的全部文本token，[L_i]
+        prompts,  ####参考音频token，batch 内共用，[1, T]
+        bert_feature_list,  #####每句的 bert 特征，[1024, L_i]
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+    ):
+        """infer_panel 的 batch 版本，多句一起解码。
+
+        文本 token 右侧 padding 到同一长度，padding 位置通过 attn mask 屏蔽；参考音频 token 在 batch 内共用，
+        所以每句的 y 位置对齐，每步所有句子一起生成一个 token，每句单独判断 EOS，全部结束后退出。
+
+        Returns:
+            List[Tuple[torch.Tensor, int]]: 每句的 (y, idx)，和 infer_panel 的返回一致
+        """
+        device = x_list[0].device
+        bsz = len(x_list)
+        x_lens = torch.tensor([x.shape[0] for x in x_list], device=device)
+        x_len = int(x_lens.max())
+
+        x = torch.stack([F.pad(x, (0, x_len - x.shape[0]), value=0) for x in x_list])
+        bert_feature = torch.stack([F.pad(bert, (0, x_len - bert.shape[1]), value=0) for bert in bert_feature_list])
+
+        x = self.ar_text_embedding(x)
+        x = x + self.bert_proj(bert_feature.transpose(1, 2))
+        x = self.ar_text_position(x)
+
+        # True 为需要屏蔽的位置
+        x_pad_mask = make_pad_mask(x_lens, x_len)  # [B, x_len]
+
+        cache = {
+            "all_stage": self.num_layers,
+            "k": [None] * self.num_layers,
+            "v": [None] * self.num_layers,
+            "y_emb": None,
+            "first_infer": 1,
+            "stage": 0,
+            "kv_cache": None,
+        }
+        ###################  first step ##########################
+        if prompts is not None:
+            y = prompts.expand(bsz, -1)
+            y_emb = self.ar_audio_embedding(y)
+            y_len = y_emb.shape[1]
+            prefix_len = y.shape[1]
+            y_pos = self.ar_audio_position(y_emb)
+            xy_pos = torch.concat([x, y_pos], dim=1)
+            cache["y_emb"] = y_emb
+            ref_free = False
+        else:
+            y_len = 0
+            prefix_len = 0
+            xy_pos = x
+            y = torch.zeros(bsz, 0, dtype=torch.int, device=device)
+            ref_free = True
+
+        # x 只看有效的 x，y 看有效的 x 和之前的 y
+        src_len = x_len + y_len
+        xy_attn_mask = torch.zeros((bsz, src_len, src_len), dtype=torch.bool, device=device)
+        xy_attn_mask[:, :, x_len:] = True
+        xy_attn_mask[:, x_len:, x_len:] = torch.triu(torch.ones(y_len, y_len, dtype=torch.bool, device=device), diagonal=1)
+        xy_attn_mask[:, :, :x_len] |= x_pad_mask.unsqueeze(1)
+        # padding 位置的 query 只看自己，避免整行被屏蔽导致 softmax 出现 nan 并污染 kv cache
+        pad_diag = torch.eye(x_len, dtype=torch.bool, device=device).unsqueeze(0) & x_pad_mask.unsqueeze(2)
+        xy_attn_mask[:, :x_len, :x_len] &= ~pad_diag
+        xy_attn_mask = self._expand_attn_mask_to_heads(xy_attn_mask)
+
+        cache["kv_cache"] = self._acquire_kv_cache(x_len, prefix_len, bsz, early_stop_num, x.dtype, device)
+        try:
+            y, idx, stop_idx = self._infer_panel_batch_loop(
+                xy_pos, xy_attn_mask, cache, y, x_pad_mask, prefix_len, top_k, top_p, early_stop_num, temperature
+            )
+        finally:
+            self.kv_cache_pool.release(cache["kv_cache"])
+
+        res = []
+        for batch_idx in range(bsz):
+            seq_idx = idx if stop_idx[batch_idx] is None else stop_idx[batch_idx]
+            seq_y = y[batch_idx : batch_idx + 1, : prefix_len + seq_idx + 1]
+            if seq_y.shape[1] == 0:
+                seq_y = torch.zeros_like(y[batch_idx : batch_idx + 1, :1])
+                print("bad zero prediction")
+            print(f"T2S Decoding EOS [{prefix_len} -> {seq_y.shape[1]}]")
+            res.append((seq_y[:, :-1], 0 if ref_free else seq_idx - 1))
+
+        return res
+
+    def _infer_panel_batch_loop(
+        self, xy_pos, xy_attn_mask, cache, y, x_pad_mask, prefix_len, top_k, top_p, early_stop_num, temperature
+    ):
+        bsz = y.shape[0]
+        finished = torch.zeros(bsz, dtype=torch.bool, device=y.device)
+        stop_idx = [None] * bsz
+
+        for idx in tqdm(range(1500)):
+
+            xy_dec, _ = self.h((xy_pos, None), mask=xy_attn_mask, cache=cache)
+            logits = self.ar_predict_layer(xy_dec[:, -1])
+            if idx == 0:  ###第一次跑不能EOS否则没有了
+                logits = logits[:, :-1]  ###刨除1024终止符号的概率
+            samples = sample_batch(logits, y, top_k=top_k, top_p=top_p, repetition_penalty=1.35, temperature=temperature)[0]
+            y = torch.concat([y, samples.to(y.dtype)], dim=1)
+
+            # 每句单独判断是否结束
+            seq_stop = (torch.argmax(logits, dim=-1) == self.EOS) | (samples[:, 0] == self.EOS)
+            if early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num:
+                print("use early stop num:", early_stop_num)
+                seq_stop[:] = True
+
+            new_finished = seq_stop & ~finished
+            for batch_idx in new_finished.nonzero().flatten().tolist():
+                stop_idx[batch_idx] = idx
+            finished |= seq_stop
+            if bool(finished.all()):
+                break
+
+            ####################### update next step ###################################
+            cache["first_infer"] = 0
+            # 只对最新的 token 求 emb 和位置编码，历史 y 的信息已经在 kv cache 中
+            y_len = y.shape[1]
+            xy_pos = self.ar_audio_position.forward_step(self.ar_audio_embedding(y[:, -1:]), y_len - 1)
+
+            # 新的 token 看有效的 x 和全部 y
+            xy_attn_mask = F.pad(x_pad_mask, (0, y_len), value=False).unsqueeze(1)
+            xy_attn_mask = self._expand_attn_mask_to_heads(xy_attn_mask)
+
+        return y, idx, stop_idx
+
+    def _expand_attn_mask_to_heads(self, attn_mask):
+        """[B, tgt, src] -> [B * num_head, tgt, src]"""
+        bsz, tgt_len, src_len = attn_mask.shape
+        return attn_mask.unsqueeze(1).expand(-1, self.num_head, -1, -1).reshape(bsz * self.num_head, tgt_len, src_len)
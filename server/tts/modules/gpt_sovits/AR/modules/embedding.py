@@ -79,3 +79,15 @@ class SinePositionalEmbedding(nn.Module):
         output = x.unsqueeze(-1) if x.ndim == 2 else x
         output = output * self.x_scale + self.alpha * self.pe[:, : x.size(1)]
         return self.dropout(output)
+
+    def forward_step(self, x: torch.Tensor, position: int) -> torch.Tensor:
+        """只计算从 position 开始的位置编码，用于自回归解码时只对新 token 编码，无需拼接历史
+
+        Args:
+            x (torch.Tensor): [B, T, E]，新 token 的 embedding
+            position (int): x 第一个 token 在整个序列中的位置
+        """
+        self.extend_pe(torch.tensor(0.0, dtype=x.dtype, device=x.device).expand(1, position + x.size(1)))
+        output = x.unsqueeze(-1) if x.ndim == 2 else x
+        output = output * self.x_scale + self.alpha * self.pe[:, position : position + x.size(1)]
+        return self.dropout(output)
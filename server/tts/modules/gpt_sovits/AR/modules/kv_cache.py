@@ -0,0 +1,93 @@
+# T2S 自回归解码的预分配 KV cache，按最大长度一次性分配显存，每步原地写入，避免逐步 torch.cat 带来的显存拷贝和分配
+
+import threading
+from typing import List, Tuple
+
+import torch
+
+
+class PreallocatedKVCache:
+    def __init__(self, num_layers: int, capacity: int, bsz: int, embed_dim: int, dtype: torch.dtype, device) -> None:
+        """
+        Args:
+            num_layers (int): transformer 层数，每层一份 kv
+            capacity (int): 最大序列长度（文本 + 参考音频 + 生成的 token）
+            bsz (int): batch size
+            embed_dim (int): 特征维度
+        """
+        self.num_layers = num_layers
+        self.capacity = capacity
+        self.bsz = bsz
+        self.embed_dim = embed_dim
+
+        # 和 patched mha 中的 k / v 排布一致：[T, B, E]，按时间维切片后依然连续，可以直接 view
+        self.k = torch.empty((num_layers, capacity, bsz, embed_dim), dtype=dtype, device=device)
+        self.v = torch.empty((num_layers, capacity, bsz, embed_dim), dtype=dtype, device=device)
+        self.lens: List[int] = [0] * num_layers
+
+    def reset(self):
+        self.lens = [0] * self.num_layers
+
+    def matches(self, bsz: int, embed_dim: int, dtype: torch.dtype, device) -> bool:
+        return self.bsz == bsz and self.embed_dim == embed_dim and self.k.dtype == dtype and self.k.device == torch.device(device)
+
+    def update(self, layer: int, k: torch.Tensor, v: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """写入本步的 k v，返回该层到目前为止全部的 k v
+
+        Args:
+            layer (int): 层 ID
+            k (torch.Tensor): [T, B, E]
+            v (torch.Tensor): [T, B, E]
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: [T_all, B, E] 的 k v，为 cache 的视图
+        """
+        start = self.lens[layer]
+        end = start + k.shape[0]
+        if end > self.capacity:
+            self._grow(end)
+
+        self.k[layer, start:end].copy_(k)
+        self.v[layer, start:end].copy_(v)
+        self.lens[layer] = end
+        return self.k[layer, :end], self.v[layer, :end]
+
+    def _grow(self, min_capacity: int):
+        # 超过预估长度时扩容为两倍，正常情况下不会触发
+        capacity = max(min_capacity, self.capacity * 2)
+        for name in ["k", "v"]:
+            old = getattr(self, name)
+            new = torch.empty((self.num_layers, capacity, self.bsz, self.embed_dim), dtype=old.dtype, device=old.device)
+            new[:, : self.capacity] = old[:, : self.capacity]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+
+class KVCachePool:
+    """KV cache 池，每个解码 worker 复用已经分配好的 cache，避免每次推理重新申请显存"""
+
+    def __init__(self, max_cached: int = 4) -> None:
+        """
+        Args:
+            max_cached (int, optional): 最多保留的空闲 cache 个数. Defaults to 4.
+        """
+        self.max_cached = max_cached
+        self._free: List[PreallocatedKVCache] = []
+        self._lock = threading.Lock()
+
+    def acquire(self, num_layers: int, capacity: int, bsz: int, embed_dim: int, dtype: torch.dtype, device) -> PreallocatedKVCache:
+        with self._lock:
+            for idx, kv_cache in enumerate(self._free):
+                if kv_cache.num_layers == num_layers and kv_cache.capacity >= capacity and kv_cache.matches(bsz, embed_dim, dtype, device):
+                    self._free.pop(idx)
+                    kv_cache.reset()
+                    return kv_cache
+
+        return PreallocatedKVCache(num_layers, capacity, bsz, embed_dim, dtype, device)
+
+    def release(self, kv_cache: PreallocatedKVCache):
+        with self._lock:
+            self._free.append(kv_cache)
+            if len(self._free) > self.max_cached:
+                # 淘汰最早放回的
+                self._free.pop(0)
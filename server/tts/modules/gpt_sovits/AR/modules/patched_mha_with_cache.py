@@ -266,7 +266,11 @@ def multi_head_attention_forward_patched(
             b_v,
         )
     if cache != None:
-        if cache["first_infer"] == 1:
+        if cache.get("kv_cache") is not None:
+            # 预分配的 kv cache，原地写入，返回该层全部的 k v
+            k, v = cache["kv_cache"].update(cache["stage"], k, v)
+            src_len = k.shape[0]
+        elif cache["first_infer"] == 1:
             cache["k"][cache["stage"]] = k
             # print(0,cache["k"].shape)
             cache["v"][cache["stage"]] = v
@@ -7,6 +7,7 @@ import os
 import re
 import shutil
 import time
+from contextlib import nullcontext
 from dataclasses import dataclass
 from io import BytesIO
 from pathlib import Path
@@ -29,6 +30,8 @@ from .module import cnhubert
 from .module.cnhubert import CNHubert
 from .module.mel_processing import spectrogram_torch
 from .module.models import SynthesizerTrn
+from .reference_prompt_cache import ReferencePromptCache, get_model_version
+from .text_frontend_cache import TextFrontendCache
 from .text import cleaned_text_to_sequence
 from .text.cleaner import clean_text
 from .utils import load_audio
@@ -52,6 +55,9 @@ symbol_splits = {
 DEVICE = "cuda"
 HZ = 50
 
+# 文本前端缓存，所有请求共用
+TEXT_FRONTEND_CACHE = TextFrontendCache(WEB_CONFIGS.TTS_FRONTEND_CACHE_SIZE)
+
 
 def get_bert_feature(text, bert_tokenizer, bert_model, word2ph):
     with torch.no_grad():
@@ -139,6 +145,24 @@ def get_bert_inf(phones, word2ph, bert_tokenizer, bert_model, norm_text, languag
     return bert
 
 
+def get_phones_and_bert_cached(text, bert_tokenizer, bert_model, language, is_half=True):
+    """单个语种文本段的 phones 和 bert 特征，重复的文本段直接读取缓存
+
+    Returns:
+        Tuple: (phones, word2ph, norm_text, bert)
+    """
+    cache_key = TEXT_FRONTEND_CACHE.make_key(text, language, is_half)
+    cache = TEXT_FRONTEND_CACHE.get(cache_key)
+    if cache is not None:
+        phones, word2ph, norm_text, bert = cache
+        return phones, word2ph, norm_text, bert.to(DEVICE)
+
+    phones, word2ph, norm_text = clean_text_inf(text, language)
+    bert = get_bert_inf(phones, word2ph, bert_tokenizer, bert_model, norm_text, language, is_half)
+    TEXT_FRONTEND_CACHE.put(cache_key, phones, word2ph, norm_text, bert)
+    return phones, word2ph, norm_text, bert
+
+
 def get_first(text):
     pattern = "[" + "".join(re.escape(sep) for sep in symbol_splits) + "]"
     text = re.split(pattern, text)[0].strip()
@@ -156,14 +180,7 @@ def get_phones_and_bert(text, bert_tokenizer, bert_model, language, is_half=True
             formattext = text
         while "  " in formattext:
             formattext = formattext.replace("  ", " ")
-        phones, word2ph, norm_text = clean_text_inf(formattext, language)
-        if language == "zh":
-            bert = get_bert_feature(norm_text, bert_tokenizer, bert_model, word2ph).to(DEVICE)
-        else:
-            bert = torch.zeros(
-                (1024, len(phones)),
-                dtype=torch.float16 if is_half else torch.float32,
-            ).to(DEVICE)
+        phones, word2ph, norm_text, bert = get_phones_and_bert_cached(formattext, bert_tokenizer, bert_model, language, is_half)
     elif language in {"zh", "ja", "auto"}:
         textlist = []
         langlist = []
@@ -191,8 +208,7 @@ def get_phones_and_bert(text, bert_tokenizer, bert_model, language, is_half=True
         norm_text_list = []
         for i in range(len(textlist)):
             lang = langlist[i]
-            phones, word2ph, norm_text = clean_text_inf(textlist[i], lang)
-            bert = get_bert_inf(phones, word2ph, bert_tokenizer, bert_model, norm_text, lang, is_half)
+            phones, word2ph, norm_text, bert = get_phones_and_bert_cached(textlist[i], bert_tokenizer, bert_model, lang, is_half)
             phones_list.append(phones)
             norm_text_list.append(norm_text)
             bert_list.append(bert)
@@ -221,6 +237,113 @@ def merge_short_text_in_array(texts, threshold):
     return result
 
 
+def get_tts_segments(text, text_language, bert_tokenizer, bert_model, how_to_cut="不切", is_half=True):
+    """文本前端：切句并生成每句的 phones 和 bert 特征
+
+    Args:
+        text (str): 目标文本
+        text_language (str): 已经映射后的语种，e.g. zh
+        how_to_cut (str, optional): 切句方式. Defaults to "不切".
+
+    Returns:
+        List[Tuple[list, torch.Tensor]]: 每句的 (phones, bert)
+    """
+
+    text = text.strip("\n")
+    if text[0] not in symbol_splits and len(get_first(text)) < 4:
+        text = "。" + text
+    print("=" * 20, "\n实际输入的目标文本:", text)
+
+    text = cut_sentences(text, how_to_cut)
+    print("=" * 20, "\n实际输入的目标文本(切句后):", text)
+
+    texts = text.split("\n")
+    texts = merge_short_text_in_array(texts, 5)  # 小于 5 个字符的句子和上一句合并
+
+    segments = []
+    for text in texts:
+        # 解决输入目标文本的空行导致报错的问题
+        if len(text.strip()) == 0:
+            continue
+        if text[-1] not in symbol_splits:
+            text += "。" if text_language != "en" else "."
+        print("=" * 20, "\n实际输入的目标文本(每句):", text)
+        phones2, bert2, norm_text2 = get_phones_and_bert(text, bert_tokenizer, bert_model, text_language, is_half)
+        print("=" * 20, "\n前端处理后的文本(每句):", norm_text2)
+        segments.append((phones2, bert2))
+
+    return segments
+
+
+def infer_semantic_batch(
+    t2s_model: Text2SemanticLightningModule,
+    segments,
+    prompt,
+    bert1,
+    phones1,
+    max_sec,
+    top_k=20,
+    top_p=0.6,
+    temperature=0.6,
+    ref_free=False,
+    batch_size=8,
+):
+    """多句一起进行 T2S 自回归解码，句子可以来自不同的请求，但需要使用同一个参考音频
+
+    Args:
+        segments (List[Tuple[list, torch.Tensor]]): 每句的 (phones, bert)
+        batch_size (int, optional): 每次一起解码的最大句子数. Defaults to 8.
+
+    Returns:
+        List[torch.Tensor]: 每句的 semantic token，[1, 1, T]，顺序和 segments 一致
+    """
+    x_list = []
+    bert_list = []
+    for phones2, bert2 in segments:
+        if not ref_free:
+            x_list.append(torch.LongTensor(phones1 + phones2).to(DEVICE))
+            bert_list.append(torch.cat([bert1, bert2], 1).to(DEVICE))
+        else:
+            x_list.append(torch.LongTensor(phones2).to(DEVICE))
+            bert_list.append(bert2.to(DEVICE))
+
+    # 按长度排序后分组，减少 padding
+    order = sorted(range(len(segments)), key=lambda seg_idx: x_list[seg_idx].shape[0])
+    pred_semantic_list = [None] * len(segments)
+    for batch_start in range(0, len(order), batch_size):
+        batch_order = order[batch_start : batch_start + batch_size]
+        with torch.no_grad():
+            batch_res = t2s_model.model.infer_panel_batch(
+                [x_list[seg_idx] for seg_idx in batch_order],
+                None if ref_free else prompt,
+                [bert_list[seg_idx] for seg_idx in batch_order],
+                top_k=top_k,
+                top_p=top_p,
+                temperature=temperature,
+                early_stop_num=HZ * max_sec,
+            )
+        for seg_idx, (pred_semantic, idx) in zip(batch_order, batch_res):
+            pred_semantic_list[seg_idx] = pred_semantic[:, -idx:].unsqueeze(0)  # .unsqueeze(0) # mq要多unsqueeze一次
+
+    return pred_semantic_list
+
+
+def decode_semantic(vq_model, phones2, pred_semantic, refer):
+    """将 semantic token 解码为音频
+
+    Returns:
+        np.ndarray: float 音频
+    """
+    # audio = vq_model.decode(pred_semantic, all_phoneme_ids, refer).detach().cpu().numpy()[0, 0]
+    audio = (
+        vq_model.decode(pred_semantic, torch.LongTensor(phones2).to(DEVICE).unsqueeze(0), refer).detach().cpu().numpy()[0, 0]
+    )  ###试试重建不带上prompt部分
+    max_audio = np.abs(audio).max()  # 简单防止 16bit 爆音
+    if max_audio > 1:
+        audio /= max_audio
+    return audio
+
+
 def get_tts_wav(
     text,
     text_language,
@@ -246,6 +369,7 @@ def get_tts_wav(
     ref_free=False,
     is_half=True,
     process_bar=None,
+    batch_size=8,
 ):
 
     dict_language = {
@@ -260,68 +384,24 @@ def get_tts_wav(
     prompt_language = dict_language[prompt_language]
     text_language = dict_language[text_language]
 
-    text = text.strip("\n")
-    if text[0] not in symbol_splits and len(get_first(text)) < 4:
-        text = "。" + text
-    print("=" * 20, "\n实际输入的目标文本:", text)
+    # if not ref_free:
+    #     phones1, bert1, _ = get_phones_and_bert(prompt_text, bert_tokenizer, bert_model, prompt_language, is_half)
 
-    text = cut_sentences(text, how_to_cut)
-    print("=" * 20, "\n实际输入的目标文本(切句后):", text)
+    segments = get_tts_segments(text, text_language, bert_tokenizer, bert_model, how_to_cut, is_half)
 
-    texts = text.split("\n")
-    texts = merge_short_text_in_array(texts, 5)  # 小于 5 个字符的句子和上一句合并
+    # 所有句子一起解码
+    pred_semantic_list = infer_semantic_batch(
+        t2s_model, segments, prompt, bert1, phones1, max_sec, top_k, top_p, temperature, ref_free, batch_size
+    )
 
     audio_opt = []
-    # if not ref_free:
-    #     phones1, bert1, _ = get_phones_and_bert(prompt_text, bert_tokenizer, bert_model, prompt_language, is_half)
-
-    for text_idx, text in enumerate(texts):
+    for text_idx, ((phones2, _), pred_semantic) in enumerate(zip(segments, pred_semantic_list)):
 
         if process_bar is not None:
-            percent_complete = (text_idx + 1) / len(texts)
+            percent_complete = (text_idx + 1) / len(segments)
             process_bar.progress(percent_complete, text=f"正在生成语音 {round(percent_complete * 100, 2)} % ...")
 
-        # 解决输入目标文本的空行导致报错的问题
-        if len(text.strip()) == 0:
-            continue
-        if text[-1] not in symbol_splits:
-            text += "。" if text_language != "en" else "."
-        print("=" * 20, "\n实际输入的目标文本(每句):", text)
-        phones2, bert2, norm_text2 = get_phones_and_bert(text, bert_tokenizer, bert_model, text_language, is_half)
-        print("=" * 20, "\n前端处理后的文本(每句):", norm_text2)
-
-        if not ref_free:
-            bert = torch.cat([bert1, bert2], 1)
-            all_phoneme_ids = torch.LongTensor(phones1 + phones2).to(DEVICE).unsqueeze(0)
-        else:
-            pass
-            # bert = bert2
-            # all_phoneme_ids = torch.LongTensor(phones2).to(DEVICE).unsqueeze(0)
-
-        bert = bert.to(DEVICE).unsqueeze(0)
-        all_phoneme_len = torch.tensor([all_phoneme_ids.shape[-1]]).to(DEVICE)
-
-        with torch.no_grad():
-            pred_semantic, idx = t2s_model.model.infer_panel(
-                all_phoneme_ids,
-                all_phoneme_len,
-                None if ref_free else prompt,
-                bert,
-                top_k=top_k,
-                top_p=top_p,
-                temperature=temperature,
-                early_stop_num=HZ * max_sec,
-            )
-        pred_semantic = pred_semantic[:, -idx:].unsqueeze(0)  # .unsqueeze(0) # mq要多unsqueeze一次
-
-        # audio = vq_model.decode(pred_semantic, all_phoneme_ids, refer).detach().cpu().numpy()[0, 0]
-        audio = (
-            vq_model.decode(pred_semantic, torch.LongTensor(phones2).to(DEVICE).unsqueeze(0), refer).detach().cpu().numpy()[0, 0]
-        )  ###试试重建不带上prompt部分
-        max_audio = np.abs(audio).max()  # 简单防止 16bit 爆音
-        if max_audio > 1:
-            audio /= max_audio
-        audio_opt.append(audio)
+        audio_opt.append(decode_semantic(vq_model, phones2, pred_semantic, refer))
         audio_opt.append(zero_wav)
 
     return hps.data.sampling_rate, (np.concatenate(audio_opt, 0) * 32768).astype(np.int16)
@@ -445,43 +525,34 @@ class HandlerTTS:
     zero_wav: np.ndarray
 
 
-def get_tts_model(voice_character_name="艾丝妲", is_half=True):
-
-    os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
-    from huggingface_hub import hf_hub_download, snapshot_download
-
-    # https://huggingface.co/baicai1145/GPT-SoVITS-STAR/tree/main
-    tts_star_model_root = Path(WEB_CONFIGS.TTS_MODEL_DIR).joinpath("star")
-
-    gpt_path, sovits_path = get_gpt_and_sovits_model_path(tts_star_model_root)
+@dataclass
+class TTSSharedModels:
+    """所有音色共用的模型"""
 
-    if gpt_path is None:
-        if tts_star_model_root.exists():
-            # 有可能中断了下载，先删除文件夹
-            shutil.rmtree(tts_star_model_root)
+    bert_tokenizer: BertTokenizerFast
+    bert_model: BertForMaskedLM
+    ssl_model: CNHubert
 
-        # 直接下载单个文件
-        tts_model_dir = hf_hub_download(
-            repo_id="baicai1145/GPT-SoVITS-STAR",
-            filename=f"{voice_character_name}.zip",
-            local_dir=str(tts_star_model_root),
-        )
 
-        # 解压
-        os.system(f"cd {str(tts_star_model_root)} && unzip {voice_character_name}.zip")
+@dataclass
+class TTSVoiceWeights:
+    """单个音色的 GPT / SoVITS 权重"""
 
-    logger.info(f"============ TTS 模型信息 ============")
+    voice_character_name: str
+    model_root: Path
+    max_sec: int
+    t2s_model: Text2SemanticLightningModule
+    vq_model: SynthesizerTrn
+    hps: HParams
+    zero_wav: np.ndarray
+    gpu_bytes: int  # 权重占用的显存，用于按显存预算淘汰
+    model_version: str  # 权重版本，用于参考音频缓存的 key
 
-    gpt_path, sovits_path = get_gpt_and_sovits_model_path(tts_star_model_root)
-    logger.info(f"gpt_path dir = {gpt_path}")
-    logger.info(f"sovits_path dir = {sovits_path}")
 
-    ref_wav_path = Path(tts_star_model_root).joinpath("参考音频", WEB_CONFIGS.TTS_INF_NAME)
-    prompt_text = WEB_CONFIGS.TTS_INF_NAME.split("-")[-1].replace(".wav", "")
-    logger.info(f"ref_wav_path = {ref_wav_path}")
-    logger.info(f"prompt_text = {prompt_text}")
+def load_tts_shared_models(is_half=True) -> TTSSharedModels:
 
-    logger.info(f"====================================")
+    os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
+    from huggingface_hub import snapshot_download
 
     # https://huggingface.co/lj1995/GPT-SoVITS/tree/main
     tts_model_dir = snapshot_download(repo_id="lj1995/GPT-SoVITS", local_dir=Path(WEB_CONFIGS.TTS_MODEL_DIR).joinpath("pretrain"))
@@ -506,6 +577,53 @@ def get_tts_model(voice_character_name="艾丝妲", is_half=True):
     ssl_model = ssl_model.to(DEVICE)
     print("load tts ssl model done !")
 
+    return TTSSharedModels(bert_tokenizer=bert_tokenizer, bert_model=bert_model, ssl_model=ssl_model)
+
+
+def get_tts_voice_model_root(voice_character_name: str) -> Path:
+    """音色权重目录，每个音色一个子目录；兼容旧版本直接解压在 star 目录下的权重"""
+    # https://huggingface.co/baicai1145/GPT-SoVITS-STAR/tree/main
+    tts_star_model_root = Path(WEB_CONFIGS.TTS_MODEL_DIR).joinpath("star")
+    legacy_gpt_path, _ = get_gpt_and_sovits_model_path(tts_star_model_root)
+    if legacy_gpt_path is not None and voice_character_name in Path(legacy_gpt_path).name:
+        return tts_star_model_root
+
+    return tts_star_model_root.joinpath(voice_character_name)
+
+
+def load_tts_voice_weights(voice_character_name="艾丝妲", is_half=True) -> TTSVoiceWeights:
+
+    os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
+    from huggingface_hub import hf_hub_download
+
+    tts_voice_model_root = get_tts_voice_model_root(voice_character_name)
+
+    gpt_path, sovits_path = get_gpt_and_sovits_model_path(tts_voice_model_root)
+
+    if gpt_path is None:
+        if tts_voice_model_root.exists():
+            # 有可能中断了下载，先删除文件夹
+            shutil.rmtree(tts_voice_model_root)
+
+        # 直接下载单个文件
+        tts_model_dir = hf_hub_download(
+            repo_id="baicai1145/GPT-SoVITS-STAR",
+            filename=f"{voice_character_name}.zip",
+            local_dir=str(tts_voice_model_root),
+        )
+
+        # 解压
+        os.system(f"cd {str(tts_voice_model_root)} && unzip {voice_character_name}.zip")
+
+    logger.info(f"============ TTS 模型信息 ============")
+
+    gpt_path, sovits_path = get_gpt_and_sovits_model_path(tts_voice_model_root)
+    logger.info(f"voice = {voice_character_name}")
+    logger.info(f"gpt_path dir = {gpt_path}")
+    logger.info(f"sovits_path dir = {sovits_path}")
+
+    logger.info(f"====================================")
+
     max_sec, t2s_model = change_gpt_weights(gpt_path, is_half)
     vq_model, hps = change_sovits_weights(sovits_path, is_half)
 
@@ -513,6 +631,58 @@ def get_tts_model(voice_character_name="艾丝妲", is_half=True):
         int(hps.data.sampling_rate * 0.3),
         dtype=np.float16 if is_half else np.float32,
     )
+
+    gpu_bytes = sum(
+        [param.nelement() * param.element_size() for model in [t2s_model, vq_model] for param in model.parameters()]
+    )
+
+    return TTSVoiceWeights(
+        voice_character_name=voice_character_name,
+        model_root=tts_voice_model_root,
+        max_sec=max_sec,
+        t2s_model=t2s_model,
+        vq_model=vq_model,
+        hps=hps,
+        zero_wav=zero_wav,
+        gpu_bytes=gpu_bytes,
+        model_version=get_model_version(gpt_path, sovits_path),
+    )
+
+
+REFERENCE_PROMPT_CACHE = ReferencePromptCache(WEB_CONFIGS.TTS_PROMPT_CACHE_DIR)
+
+
+def get_default_reference(voice_weights: TTSVoiceWeights):
+    """音色自带的参考音频，返回 (参考音频路径, 参考文本)，参考音频文件名格式为 {情绪}-{参考文本}.wav"""
+    ref_wav_dir = Path(voice_weights.model_root).joinpath("参考音频")
+    ref_wav_path = ref_wav_dir.joinpath(WEB_CONFIGS.TTS_INF_NAME)
+    if not ref_wav_path.exists():
+        ref_wav_path = sorted(ref_wav_dir.glob("*.wav"))[0]
+
+    prompt_text = ref_wav_path.name.split("-")[-1].replace(".wav", "")
+    return ref_wav_path, prompt_text
+
+
+def make_tts_reference_prompt(shared_models: TTSSharedModels, voice_weights: TTSVoiceWeights, ref_wav_path, prompt_text, is_half=True):
+    """根据参考音频生成推理所需的参考信息，优先读取磁盘缓存
+
+    Returns:
+        Tuple: (prompt, refer, bert1, phones1, prompt_text)
+    """
+    logger.info(f"ref_wav_path = {ref_wav_path}")
+    logger.info(f"prompt_text = {prompt_text}")
+
+    cache_key = REFERENCE_PROMPT_CACHE.make_key(ref_wav_path, prompt_text, voice_weights.model_version, is_half)
+    t0 = time.time()
+    cache = REFERENCE_PROMPT_CACHE.load(cache_key, DEVICE)
+    if cache is not None:
+        logger.info(f"load reference prompt from cache: {cache_key}, 用时: {time.time() - t0}")
+        return cache
+
+    ssl_model = shared_models.ssl_model
+    vq_model = voice_weights.vq_model
+    hps = voice_weights.hps
+
     print("=" * 20, "\n加载参考音频 。。。")
     t1 = time.time()
     with torch.no_grad():
@@ -520,7 +690,7 @@ def get_tts_model(voice_character_name="艾丝妲", is_half=True):
         if wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000:
             raise OSError("参考音频在3~10秒范围外，请更换！")
         wav16k = torch.from_numpy(wav16k)
-        zero_wav_torch = torch.from_numpy(zero_wav)
+        zero_wav_torch = torch.from_numpy(voice_weights.zero_wav)
 
         wav16k = wav16k.half()
         zero_wav_torch = zero_wav_torch.half()
@@ -543,7 +713,6 @@ def get_tts_model(voice_character_name="艾丝妲", is_half=True):
     refer = refer.to(DEVICE)
     print("get_spepc 用时: ", time.time() - t3)
 
-    ref_free = False
     dict_language = {
         "中文": "all_zh",  # 全部按中文识别
         "英文": "en",  # 全部按英文识别#######不变
@@ -558,27 +727,54 @@ def get_tts_model(voice_character_name="艾丝妲", is_half=True):
         prompt_text += "。"
     print("=" * 20, "\n音频参考文本:", prompt_text)
 
-    if not ref_free:
-        phones1, bert1, _ = get_phones_and_bert(prompt_text, bert_tokenizer, bert_model, dict_language["中英混合"], is_half)
+    phones1, bert1, _ = get_phones_and_bert(
+        prompt_text, shared_models.bert_tokenizer, shared_models.bert_model, dict_language["中英混合"], is_half
+    )
 
-    tts_handler = HandlerTTS(
-        bert_tokenizer=bert_tokenizer,
-        bert_model=bert_model,
-        ssl_model=ssl_model,
-        max_sec=max_sec,
-        t2s_model=t2s_model,
-        vq_model=vq_model,
-        hps=hps,
+    try:
+        REFERENCE_PROMPT_CACHE.save(cache_key, prompt, refer, bert1, phones1, prompt_text)
+    except Exception:
+        # 缓存写入失败不影响推理
+        logger.exception(f"save reference prompt cache failed: {cache_key}")
+
+    return prompt, refer, bert1, phones1, prompt_text
+
+
+def make_tts_handler(
+    shared_models: TTSSharedModels, voice_weights: TTSVoiceWeights, ref_wav_path=None, prompt_text=None, is_half=True
+) -> HandlerTTS:
+    """组合共用模型、音色权重和参考音频，ref_wav_path 为空则使用音色自带的参考音频"""
+    if ref_wav_path is None:
+        ref_wav_path, prompt_text = get_default_reference(voice_weights)
+
+    prompt, refer, bert1, phones1, prompt_text = make_tts_reference_prompt(
+        shared_models, voice_weights, ref_wav_path, prompt_text, is_half
+    )
+
+    return HandlerTTS(
+        bert_tokenizer=shared_models.bert_tokenizer,
+        bert_model=shared_models.bert_model,
+        ssl_model=shared_models.ssl_model,
+        max_sec=voice_weights.max_sec,
+        t2s_model=voice_weights.t2s_model,
+        vq_model=voice_weights.vq_model,
+        hps=voice_weights.hps,
         inp_ref=str(ref_wav_path),
         prompt_text=prompt_text,
         prompt=prompt,
         refer=refer,
         bert1=bert1,
         phones1=phones1,
-        zero_wav=zero_wav,
+        zero_wav=voice_weights.zero_wav,
     )
 
-    return tts_handler
+
+def get_tts_model(voice_character_name="艾丝妲", is_half=True):
+
+    shared_models = load_tts_shared_models(is_half)
+    voice_weights = load_tts_voice_weights(voice_character_name, is_half)
+
+    return make_tts_handler(shared_models, voice_weights, is_half=is_half)
 
 
 def gen_tts_wav(
@@ -646,6 +842,134 @@ def gen_tts_wav(
     print("output:", wav_path_output)
 
 
+def gen_tts_wav_batch(
+    text_list,
+    text_language,
+    bert_tokenizer,
+    bert_model,
+    vq_model,
+    hps,
+    max_sec,
+    t2s_model,
+    prompt,
+    refer,
+    bert1,
+    phones1,
+    zero_wav,
+    how_to_cut="凑四句一切",
+    batch_size=8,
+):
+    """多个请求合并推理，所有请求的句子一起进行 T2S 解码
+
+    Args:
+        text_list (List[str]): 每个请求的文本
+        batch_size (int, optional): T2S 每次一起解码的最大句子数. Defaults to 8.
+
+    Returns:
+        List[np.ndarray | Exception]: 每个请求的 int16 音频，出错则为对应的异常
+    """
+    dict_language = {
+        "中文": "all_zh",
+        "英文": "en",
+        "日文": "all_ja",
+        "中英混合": "zh",
+        "日英混合": "ja",
+        "多语种混合": "auto",
+    }
+    text_language = dict_language[text_language]
+
+    # 文本前端每个请求单独处理，单个请求出错不影响其他请求
+    results = [None] * len(text_list)
+    request_segments = []
+    for req_idx, text in enumerate(text_list):
+        try:
+            request_segments.append(get_tts_segments(text, text_language, bert_tokenizer, bert_model, how_to_cut))
+        except Exception as e:
+            logger.exception(f"tts text frontend failed: {text}")
+            results[req_idx] = e
+            request_segments.append([])
+
+    all_segments = sum(request_segments, [])
+    pred_semantic_list = infer_semantic_batch(
+        t2s_model, all_segments, prompt, bert1, phones1, max_sec, top_k=5, top_p=1, temperature=1, batch_size=batch_size
+    )
+
+    seg_start = 0
+    for req_idx, segments in enumerate(request_segments):
+        req_pred_semantic_list = pred_semantic_list[seg_start : seg_start + len(segments)]
+        seg_start += len(segments)
+        if results[req_idx] is not None:
+            continue
+
+        if len(segments) == 0:
+            # 文本没有可合成的内容
+            results[req_idx] = np.zeros(0, dtype=np.int16)
+            continue
+
+        # 每个请求单独解码，单个请求出错不影响同一批的其他请求
+        try:
+            audio_opt = []
+            for (phones2, _), pred_semantic in zip(segments, req_pred_semantic_list):
+                audio_opt.append(decode_semantic(vq_model, phones2, pred_semantic, refer))
+                audio_opt.append(zero_wav)
+
+            results[req_idx] = (np.concatenate(audio_opt, 0) * 32768).astype(np.int16)
+        except Exception as e:
+            logger.exception(f"tts decode failed: {text_list[req_idx]}")
+            results[req_idx] = e
+
+    return results
+
+
+def get_tts_wav_stream(
+    text,
+    text_language,
+    bert_tokenizer,
+    bert_model,
+    vq_model,
+    max_sec,
+    t2s_model,
+    prompt,
+    refer,
+    bert1,
+    phones1,
+    zero_wav,
+    how_to_cut="凑四句一切",
+    gpu_lock=None,
+):
+    """流式推理，每个切句解码完成后立即返回该句的音频
+
+    Args:
+        text (str): 目标文本
+        gpu_lock (threading.Lock, optional): 和其他推理共用模型时的互斥锁，每句推理时持有. Defaults to None.
+
+    Yields:
+        np.ndarray: 每句的 int16 音频，句尾带静音
+    """
+    dict_language = {
+        "中文": "all_zh",
+        "英文": "en",
+        "日文": "all_ja",
+        "中英混合": "zh",
+        "日英混合": "ja",
+        "多语种混合": "auto",
+    }
+    text_language = dict_language[text_language]
+    gpu_lock = gpu_lock if gpu_lock is not None else nullcontext()
+
+    with gpu_lock:
+        segments = get_tts_segments(text, text_language, bert_tokenizer, bert_model, how_to_cut)
+
+    for phones2, bert2 in segments:
+        with gpu_lock:
+            pred_semantic = infer_semantic_batch(
+                t2s_model, [(phones2, bert2)], prompt, bert1, phones1, max_sec, top_k=5, top_p=1, temperature=1
+            )[0]
+            audio = decode_semantic(vq_model, phones2, pred_semantic, refer)
+
+        yield (np.concatenate([audio, zero_wav], 0) * 32768).astype(np.int16)
+
+
 def demo():
 
     # https://huggingface.co/baicai1145/GPT-SoVITS-STAR/tree/main
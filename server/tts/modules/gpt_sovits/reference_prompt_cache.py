@@ -0,0 +1,98 @@
+"""
+参考音频推理信息的磁盘缓存
+
+参考音频需要经过 CNHubert + vq_model.extract_latent、get_spepc、get_phones_and_bert 才能得到推理所需的
+prompt / refer / bert1 / phones1，耗时较长。按 (参考音频内容 hash, 参考文本, 模型版本) 保存到磁盘，
+重启服务或切换音色时直接 mmap 读取，无需重新计算。
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Tuple
+
+import torch
+from loguru import logger
+
+# 缓存内容格式变化时修改，使旧缓存失效
+PROMPT_CACHE_VERSION = 1
+
+
+def get_file_hash(file_path, chunk_size=1024 * 1024) -> str:
+    """文件内容的 sha256"""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_model_version(*model_paths) -> str:
+    """根据权重文件名、大小和修改时间生成模型版本，权重更新后缓存自动失效，无需读取整个权重文件"""
+    sha256 = hashlib.sha256()
+    for model_path in model_paths:
+        model_stat = Path(model_path).stat()
+        sha256.update(f"{Path(model_path).name}:{model_stat.st_size}:{model_stat.st_mtime_ns};".encode("utf-8"))
+    return sha256.hexdigest()[:16]
+
+
+class ReferencePromptCache:
+    def __init__(self, cache_dir: str) -> None:
+        """
+        Args:
+            cache_dir (str): 缓存保存目录
+        """
+        self.cache_dir = Path(cache_dir)
+
+    def make_key(self, ref_wav_path, prompt_text: str, model_version: str, is_half: bool) -> str:
+        """缓存 key：参考音频内容 + 参考文本 + 模型版本 + 精度"""
+        key_str = "|".join(
+            [str(PROMPT_CACHE_VERSION), get_file_hash(ref_wav_path), prompt_text, model_version, "half" if is_half else "float"]
+        )
+        return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+    def _cache_path(self, key: str) -> Path:
+        return self.cache_dir.joinpath(f"{key}.pt")
+
+    def load(self, key: str, device) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, list, str] | None:
+        """读取缓存，不存在或损坏返回 None
+
+        Returns:
+            Tuple | None: (prompt, refer, bert1, phones1, prompt_text)
+        """
+        cache_path = self._cache_path(key)
+        if not cache_path.exists():
+            return None
+
+        try:
+            # mmap 读取，不需要把整个文件读入内存后再拷贝
+            cache = torch.load(str(cache_path), map_location="cpu", mmap=True, weights_only=True)
+        except Exception:
+            logger.exception(f"tts reference prompt cache broken, remove it: {cache_path}")
+            cache_path.unlink(missing_ok=True)
+            return None
+
+        return (
+            cache["prompt"].to(device),
+            cache["refer"].to(device),
+            cache["bert1"].to(device),
+            cache["phones1"].tolist(),
+            cache["prompt_text"],
+        )
+
+    def save(self, key: str, prompt: torch.Tensor, refer: torch.Tensor, bert1: torch.Tensor, phones1: list, prompt_text: str):
+        """保存缓存，先写临时文件再重命名，避免多进程同时写入时读到不完整的文件"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        cache = {
+            "prompt": prompt.detach().cpu().contiguous(),
+            "refer": refer.detach().cpu().contiguous(),
+            "bert1": bert1.detach().cpu().contiguous(),
+            "phones1": torch.tensor(phones1, dtype=torch.int64),
+            "prompt_text": prompt_text,
+        }
+
+        cache_path = self._cache_path(key)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        torch.save(cache, str(tmp_path))
+        os.replace(tmp_path, cache_path)
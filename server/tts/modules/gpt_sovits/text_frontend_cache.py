@@ -0,0 +1,82 @@
+"""
+文本前端缓存
+
+直播话术中大量重复的短语（"家人们"、商品名、价格等），每次都需要重新经过 clean_text（jieba / pypinyin / 变调）
+和 BERT 前向，按 (文本内容 hash, 语种, 精度) 缓存 (phones, word2ph, norm_text, bert)，所有请求共用。
+bert 特征缓存在内存中，读取时由调用方移动到模型所在设备，缓存不占用显存。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+import torch
+
+
+class TextFrontendCache:
+    def __init__(self, max_size: int) -> None:
+        """
+        Args:
+            max_size (int): 最多缓存的文本段个数，超出后淘汰最久未使用的，为 0 则不缓存
+        """
+        self.max_size = max_size
+
+        self._cache: OrderedDict[str, Tuple[list, list, str, torch.Tensor]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, language: str, is_half: bool) -> str:
+        key_str = f"{language}|{'half' if is_half else 'float'}|{text}"
+        return hashlib.sha1(key_str.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Tuple[list, list, str, torch.Tensor] | None:
+        """读取缓存
+
+        Returns:
+            Tuple | None: (phones, word2ph, norm_text, bert)，phones 和 word2ph 为拷贝，调用方可以修改，bert 在 CPU 上
+        """
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            self._cache.move_to_end(key)
+            self.hits += 1
+
+        phones, word2ph, norm_text, bert = item
+        return list(phones), None if word2ph is None else list(word2ph), norm_text, bert
+
+    def put(self, key: str, phones: list, word2ph: list, norm_text: str, bert: torch.Tensor):
+        if self.max_size <= 0:
+            return
+
+        bert = bert.detach().cpu()
+        with self._lock:
+            self._cache[key] = (list(phones), None if word2ph is None else list(word2ph), norm_text, bert)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        """命中率等统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+            }
@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Tuple
+
+import torch
+from loguru import logger
+
+from ...web_configs import WEB_CONFIGS
+from .gpt_sovits.inference_gpt_sovits import (
+    HandlerTTS,
+    TTSSharedModels,
+    TTSVoiceWeights,
+    load_tts_shared_models,
+    load_tts_voice_weights,
+    make_tts_handler,
+)
+
+
+@dataclass(frozen=True)
+class TTSVoiceInfo:
+    """音色信息，字段为空则使用默认值"""
+
+    weight_tag: str = ""  # 音色权重名，e.g. 艾丝妲
+    reference_audio: str = ""  # 参考音频本地路径，为空则使用音色自带的参考音频
+    reference_sentence: str = ""  # 参考音频对应的文本
+
+    def key(self) -> Tuple[str, str, str]:
+        weight_tag = self.weight_tag or WEB_CONFIGS.TTS_DEFAULT_VOICE
+        if self.reference_audio == "":
+            return (weight_tag, "", "")
+        return (weight_tag, self.reference_audio, self.reference_sentence)
+
+
+class TTSVoiceRegistry:
+    """多音色管理：BERT / CNHubert 所有音色共用，GPT / SoVITS 权重按需加载，超出显存预算时按 LRU 淘汰"""
+
+    def __init__(self, gpu_memory_budget_gb: float, max_cached_voices: int, is_half=True) -> None:
+        """
+        Args:
+            gpu_memory_budget_gb (float): 音色权重最多占用的显存，单位 GB
+            max_cached_voices (int): 最多缓存的参考音频信息个数（prompt / refer / bert1 / phones1）
+            is_half (bool, optional): 是否使用半精度. Defaults to True.
+        """
+        self.gpu_memory_budget = int(gpu_memory_budget_gb * 1024**3)
+        self.max_cached_voices = max_cached_voices
+        self.is_half = is_half
+
+        self.shared_models: TTSSharedModels = load_tts_shared_models(is_half)
+
+        self._weights: OrderedDict[str, TTSVoiceWeights] = OrderedDict()  # weight_tag -> 权重
+        self._handlers: OrderedDict[Tuple[str, str, str], HandlerTTS] = OrderedDict()  # 音色 key -> 推理 handler
+        self._lock = threading.RLock()
+
+    def get_handler(self, voice_info: TTSVoiceInfo | None = None) -> HandlerTTS:
+        """获取音色对应的推理 handler，不存在则加载
+
+        Args:
+            voice_info (TTSVoiceInfo | None, optional): 音色信息，为空使用默认音色. Defaults to None.
+
+        Returns:
+            HandlerTTS: 推理 handler
+        """
+        if voice_info is None:
+            voice_info = TTSVoiceInfo()
+        voice_key = voice_info.key()
+
+        with self._lock:
+            if voice_key in self._handlers:
+                self._handlers.move_to_end(voice_key)
+                self._weights.move_to_end(voice_key[0])
+                return self._handlers[voice_key]
+
+            voice_weights = self._get_weights(voice_key[0])
+
+            weight_tag, reference_audio, reference_sentence = voice_key
+            handler = make_tts_handler(
+                self.shared_models,
+                voice_weights,
+                ref_wav_path=reference_audio or None,
+                prompt_text=reference_sentence or None,
+                is_half=self.is_half,
+            )
+            self._handlers[voice_key] = handler
+            logger.info(f"tts voice loaded: {voice_key}")
+
+            while len(self._handlers) > self.max_cached_voices:
+                evict_key, _ = self._handlers.popitem(last=False)
+                logger.info(f"tts voice evicted: {evict_key}")
+
+            return handler
+
+    def _get_weights(self, weight_tag: str) -> TTSVoiceWeights:
+        if weight_tag in self._weights:
+            self._weights.move_to_end(weight_tag)
+            return self._weights[weight_tag]
+
+        voice_weights = load_tts_voice_weights(weight_tag, self.is_half)
+        self._weights[weight_tag] = voice_weights
+        self._evict_weights()
+        return voice_weights
+
+    def _evict_weights(self):
+        """超出显存预算时淘汰最久未使用的权重，至少保留最新加载的一个"""
+        evicted = False
+        while len(self._weights) > 1 and sum([weights.gpu_bytes for weights in self._weights.values()]) > self.gpu_memory_budget:
+            weight_tag, _ = self._weights.popitem(last=False)
+
+            # 使用该权重的 handler 一并删除
+            for voice_key in [voice_key for voice_key in self._handlers if voice_key[0] == weight_tag]:
+                del self._handlers[voice_key]
+
+            logger.info(f"tts voice weights evicted: {weight_tag}")
+            evicted = True
+
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
@@ -1,50 +1,221 @@
+import asyncio
+import struct
+import threading
+from io import BytesIO
 from pathlib import Path
 
+import soundfile as sf
+from loguru import logger
 
 from ...web_configs import WEB_CONFIGS
-from .gpt_sovits.inference_gpt_sovits import gen_tts_wav, get_tts_model
+from .gpt_sovits.inference_gpt_sovits import HandlerTTS, gen_tts_wav_batch, get_tts_wav_stream
+from .tts_registry import TTSVoiceInfo, TTSVoiceRegistry
 
 if WEB_CONFIGS.ENABLE_TTS:
     # samber
     # from utils.tts.sambert_hifigan.tts_sambert_hifigan import get_tts_model
     # TTS_HANDLER = get_tts_model()
 
-    # gpt_sovits
-    TTS_HANDLER = get_tts_model()
+    # gpt_sovits，多音色共用 BERT / CNHubert，音色权重按需加载
+    TTS_REGISTRY = TTSVoiceRegistry(WEB_CONFIGS.TTS_GPU_MEMORY_BUDGET_GB, WEB_CONFIGS.TTS_MAX_CACHED_VOICES)
+    # 预先加载默认音色
+    TTS_REGISTRY.get_handler()
 else:
-    TTS_HANDLER = None
+    TTS_REGISTRY = None
 
 
-async def gen_tts_wav_app(cur_response, save_tag):
-    # if save_tag == "":
-    #     save_tag = datetime.now().strftime("%Y-%m-%d-%H-%M-%S") + ".wav"
-
+def make_tts_save_path(save_tag):
     tts_save_path = str(Path(WEB_CONFIGS.TTS_WAV_GEN_PATH).joinpath(save_tag).absolute())
     if not Path(WEB_CONFIGS.TTS_WAV_GEN_PATH).exists():
         Path(WEB_CONFIGS.TTS_WAV_GEN_PATH).mkdir(parents=True, exist_ok=True)
+    return tts_save_path
 
-    # gen_tts_wav(st.session_state.tts_handler, cur_response, tts_save_path)
 
-    # inp_ref = r"/root/hingwen_camp/utils/tts/gpt_sovits/weights/ref_wav/【开心】处理完之前的事情，这几天甚至都有空闲来车上转转了。.wav"
-    text_language = "中英混合"
-    gen_tts_wav(
-        cur_response,
-        text_language,
-        TTS_HANDLER.bert_tokenizer,
-        TTS_HANDLER.bert_model,
-        TTS_HANDLER.ssl_model,
-        TTS_HANDLER.vq_model,
-        TTS_HANDLER.hps,
-        TTS_HANDLER.max_sec,
-        TTS_HANDLER.t2s_model,
-        TTS_HANDLER.inp_ref,
-        TTS_HANDLER.prompt_text,
-        TTS_HANDLER.prompt,
-        TTS_HANDLER.refer,
-        TTS_HANDLER.bert1,
-        TTS_HANDLER.phones1,
-        TTS_HANDLER.zero_wav,
-        tts_save_path,
+def encode_wav(audio_data, sampling_rate) -> bytes:
+    """int16 音频编码为 wav 文件内容"""
+    wav = BytesIO()
+    sf.write(wav, audio_data, sampling_rate, format="wav")
+    return wav.getvalue()
+
+
+def make_stream_wav_header(sampling_rate: int, channels: int = 1, sample_width: int = 2) -> bytes:
+    """流式 wav 的文件头，总长度未知，数据长度按最大值填写，播放器会一直读到流结束"""
+    data_size = 0xFFFFFFFF - 36
+    byte_rate = sampling_rate * channels * sample_width
+    return (
+        b"RIFF"
+        + struct.pack("<I", 0xFFFFFFFF)
+        + b"WAVE"
+        + b"fmt "
+        + struct.pack("<IHHIIHH", 16, 1, channels, sampling_rate, byte_rate, channels * sample_width, sample_width * 8)
+        + b"data"
+        + struct.pack("<I", data_size)
     )
 
-    return tts_save_path
+
+def gen_tts_stream_app(tts_handler: HandlerTTS, cur_response, stream_format="wav"):
+    """流式生成，每句推理完成后返回该句的音频数据
+
+    Args:
+        tts_handler (HandlerTTS): 音色对应的推理 handler
+        cur_response (str): 文本
+        stream_format (str, optional): wav 首个数据块前带 wav 头，pcm 为 int16 单声道裸数据. Defaults to "wav".
+
+    Yields:
+        bytes: 音频数据
+    """
+    if stream_format == "wav":
+        yield make_stream_wav_header(tts_handler.hps.data.sampling_rate)
+
+    for audio_data in get_tts_wav_stream(
+        cur_response,
+        "中英混合",
+        tts_handler.bert_tokenizer,
+        tts_handler.bert_model,
+        tts_handler.vq_model,
+        tts_handler.max_sec,
+        tts_handler.t2s_model,
+        tts_handler.prompt,
+        tts_handler.refer,
+        tts_handler.bert1,
+        tts_handler.phones1,
+        tts_handler.zero_wav,
+        gpu_lock=TTS_GPU_LOCK,
+    ):
+        yield audio_data.tobytes()
+
+
+class TTSBatchScheduler:
+    """合并同时到达的 TTS 请求，同一音色的请求句子一起进行 T2S 批量解码"""
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float) -> None:
+        """
+        Args:
+            max_batch_size (int): 合并请求的最大个数，同时也是 T2S 每次一起解码的最大句子数
+            max_wait_ms (float): 收到第一个请求后最多再等待多久，单位毫秒
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    def start(self):
+        """在服务启动时调用，需要在事件循环中"""
+        self._worker = asyncio.create_task(self._run(), name="tts_batch_scheduler")
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def submit(self, text: str, save_tag: str | None, voice_info: TTSVoiceInfo | None = None) -> str | bytes:
+        """提交 TTS 请求，等待合并推理完成
+
+        Args:
+            text (str): 文本
+            save_tag (str | None): wav 文件名，为 None 则不落盘，直接返回 wav 内容
+            voice_info (TTSVoiceInfo | None, optional): 音色，为空使用默认音色. Defaults to None.
+
+        Returns:
+            str | bytes: wav 保存路径 or wav 内容
+        """
+        future = asyncio.get_running_loop().create_future()
+        save_path = None if save_tag is None else make_tts_save_path(save_tag)
+        voice_info = voice_info or TTSVoiceInfo()
+        await self._queue.put((text, save_path, voice_info, future))
+        return await future
+
+    async def _collect_batch(self):
+        batch = [await self._queue.get()]
+
+        # 第一个请求到达后再等一小段时间，收集同时到达的请求
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    def _infer_batch(self, voice_info: TTSVoiceInfo, text_list, save_path_list):
+        with TTS_GPU_LOCK:
+            # 加载音色也需要占用 GPU，放在锁内
+            tts_handler = TTS_REGISTRY.get_handler(voice_info)
+            results = gen_tts_wav_batch(
+                text_list,
+                "中英混合",
+                tts_handler.bert_tokenizer,
+                tts_handler.bert_model,
+                tts_handler.vq_model,
+                tts_handler.hps,
+                tts_handler.max_sec,
+                tts_handler.t2s_model,
+                tts_handler.prompt,
+                tts_handler.refer,
+                tts_handler.bert1,
+                tts_handler.phones1,
+                tts_handler.zero_wav,
+                batch_size=self.max_batch_size,
+            )
+
+        outputs = []
+        for audio_data, save_path in zip(results, save_path_list):
+            if isinstance(audio_data, Exception):
+                outputs.append(audio_data)
+                continue
+
+            wav_bytes = encode_wav(audio_data, tts_handler.hps.data.sampling_rate)
+            if save_path is None:
+                outputs.append(wav_bytes)
+                continue
+
+            with open(save_path, "wb") as f:
+                f.write(wav_bytes)
+            print("output:", save_path)
+            outputs.append(save_path)
+
+        return outputs
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            # 请求方已经断开的不再推理
+            batch = [item for item in batch if not item[3].done()]
+            if len(batch) == 0:
+                continue
+
+            # 不同音色的模型 / 参考音频不同，按音色分组推理
+            voice_groups = {}
+            for item in batch:
+                voice_groups.setdefault(item[2].key(), []).append(item)
+
+            for voice_batch in voice_groups.values():
+                logger.info(f"tts batch size = {len(voice_batch)}, voice = {voice_batch[0][2].key()}")
+                try:
+                    # 推理在线程中执行，避免阻塞事件循环
+                    outputs = await asyncio.to_thread(
+                        self._infer_batch, voice_batch[0][2], [item[0] for item in voice_batch], [item[1] for item in voice_batch]
+                    )
+                except Exception as e:
+                    logger.exception("tts batch failed")
+                    outputs = [e] * len(voice_batch)
+
+                for (_, _, _, future), output in zip(voice_batch, outputs):
+                    if future.done():
+                        continue
+                    if isinstance(output, Exception):
+                        future.set_exception(output)
+                    else:
+                        future.set_result(output)
+
+
+# 流式推理和合并推理共用模型，同一时间只有一个在使用 GPU
+TTS_GPU_LOCK = threading.Lock()
+TTS_SCHEDULER = TTSBatchScheduler(WEB_CONFIGS.TTS_BATCH_SIZE, WEB_CONFIGS.TTS_BATCH_WAIT_MS)
@@ -1,29 +1,88 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
 from loguru import logger
 from pydantic import BaseModel
 
 
-from .modules.tts_worker import gen_tts_wav_app
+from .modules.gpt_sovits.inference_gpt_sovits import TEXT_FRONTEND_CACHE
+from .modules.tts_registry import TTSVoiceInfo
+from .modules.tts_worker import TTS_REGISTRY, TTS_SCHEDULER, gen_tts_stream_app
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """服务生命周期函数"""
+    # 启动合并推理调度
+    TTS_SCHEDULER.start()
+
+    yield
+
+    await TTS_SCHEDULER.stop()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
-class TextToSpeechItem(BaseModel):
+class TextToSpeechVoiceItem(BaseModel):
+    tts_weight_tag: str = ""  # 音色权重名，为空使用默认音色
+    tts_reference_audio: str = ""  # 参考音频本地路径，为空使用音色自带的参考音频
+    tts_reference_sentence: str = ""  # 参考音频对应的文本
+
+    def voice_info(self) -> TTSVoiceInfo:
+        return TTSVoiceInfo(self.tts_weight_tag, self.tts_reference_audio, self.tts_reference_sentence)
+
+
+class TextToSpeechItem(TextToSpeechVoiceItem):
     user_id: str  # User 识别号，用于区分不用的用户调用
     request_id: str  # 请求 ID，用于生成 TTS & 数字人
     sentence: str  # 文本
     chunk_id: int  # 句子 ID
+    return_bytes: bool = False  # True 直接返回 wav 内容，不落盘
+
+
+class TextToSpeechStreamItem(TextToSpeechVoiceItem):
+    user_id: str  # User 识别号，用于区分不用的用户调用
+    request_id: str  # 请求 ID
+    sentence: str  # 文本
+    stream_format: str = "wav"  # wav 带 wav 头的流，pcm 为 int16 单声道裸数据
 
 
 @app.post("/tts")
 async def get_tts(tts_item: TextToSpeechItem):
-    # 语音转文字
-    wav_path = await gen_tts_wav_app(tts_item.sentence, tts_item.request_id + f"-{str(tts_item.chunk_id).zfill(8)}.wav")
+    # 文字转语音，同时到达的请求会合并一起推理
+    if tts_item.return_bytes:
+        wav_bytes = await TTS_SCHEDULER.submit(tts_item.sentence, None, tts_item.voice_info())
+        return Response(content=wav_bytes, media_type="audio/wav")
+
+    wav_path = await TTS_SCHEDULER.submit(
+        tts_item.sentence, tts_item.request_id + f"-{str(tts_item.chunk_id).zfill(8)}.wav", tts_item.voice_info()
+    )
     logger.info(f"tts wav path = {wav_path}")
     return {"user_id": tts_item.user_id, "request_id": tts_item.request_id, "wav_path": wav_path}
 
 
+@app.post("/tts/stream")
+async def get_tts_stream(tts_item: TextToSpeechStreamItem):
+    # 每个切句推理完成后立即返回该句的音频，无需等待整段文本生成完成
+    media_type = "audio/wav" if tts_item.stream_format == "wav" else "application/octet-stream"
+    # 首次使用的音色需要加载模型，在线程中执行
+    tts_handler = await asyncio.to_thread(TTS_REGISTRY.get_handler, tts_item.voice_info())
+    return StreamingResponse(
+        gen_tts_stream_app(tts_handler, tts_item.sentence, tts_item.stream_format),
+        media_type=media_type,
+        headers={"X-Sample-Rate": str(tts_handler.hps.data.sampling_rate), "X-Sample-Width": "2", "X-Channels": "1"},
+    )
+
+
+@app.get("/tts/frontend-cache")
+async def get_frontend_cache_stats():
+    # 文本前端缓存命中率
+    return TEXT_FRONTEND_CACHE.stats()
+
+
 @app.get("/tts/check")
 async def check_server():
     return {"message": "server enabled"}
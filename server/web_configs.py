@@ -59,13 +59,27 @@ class WebConfigs:
     ENABLE_AGENT: bool = os.environ.get("ENABLE_AGENT", "true") == "true"  # True 启动 Agent，False 不启用
     ENABLE_ASR: bool = os.environ.get("ENABLE_ASR", "true") == "true"  # True 启动 语音转文字，False 不启用
 
+    # ==================================================================
+    #                             任务总线 配置
+    # ==================================================================
+    JOB_BUS_BROKER: str = "local"  # local 进程内分发（任务 worker 运行在事件循环中），process 任务在子进程中执行时跨进程分发
+
     # ==================================================================
     #                               RAG 配置
     # ==================================================================
     RAG_CONFIG_PATH: str = r"./configs/rag_config.yaml"
     RAG_VECTOR_DB_DIR: str = r"./work_dirs/instruction_db"
-    PRODUCT_INSTRUCTION_DIR_GEN_DB_TMP: str = r"./work_dirs/instructions_gen_db_tmp"
     RAG_MODEL_DIR: str = r"./weights/rag_weights/"
+    RAG_RETRIEVER_CACHE_SIZE: int = 64  # 每个商品一个子向量库，最多同时加载的个数，超出按最久未使用淘汰
+    RAG_DOC_TEXT_CACHE_MB: int = 256  # 检索时拼接上下文用的说明书文本缓存，按文件修改时间失效，超出按最久未使用淘汰
+    RAG_QUERY_CACHE_SIZE: int = 4096  # 问题向量和 rerank 结果的缓存条数，0 为不缓存
+    RAG_QUERY_CACHE_TTL: int = 30 * 60  # 问题向量和 rerank 结果的缓存有效时间，单位秒
+
+    # 直播间问答语义缓存，相似问题直接复用之前的回答和数字人视频
+    RAG_ANSWER_CACHE_ENABLED: bool = True
+    RAG_ANSWER_CACHE_THRESHOLD: float = 0.92  # 问题余弦相似度阈值，越高越严格
+    RAG_ANSWER_CACHE_MAX_ENTRIES: int = 256  # 每个商品最多缓存的问答数
+    RAG_ANSWER_CACHE_TTL: int = 6 * 60 * 60  # 缓存有效时间，单位秒
 
     # ==================================================================
     #                               TTS 配置
@@ -73,6 +87,13 @@ class WebConfigs:
     TTS_WAV_GEN_PATH: str = r"./work_dirs/tts_wavs"
     TTS_MODEL_DIR: str = r"./weights/gpt_sovits_weights/"
     TTS_INF_NAME: str = "激动说话-列车巡游银河，我不一定都能帮上忙，但只要是花钱能解决的事，尽管和我说吧。.wav"
+    TTS_BATCH_SIZE: int = 8  # T2S 每次一起解码的最大句子数，同时也是合并请求的最大个数
+    TTS_BATCH_WAIT_MS: float = 20  # 合并请求时，收到第一个请求后最多再等待多久，单位毫秒
+    TTS_DEFAULT_VOICE: str = "艾丝妲"  # 请求未指定音色时使用的音色
+    TTS_GPU_MEMORY_BUDGET_GB: float = 4.0  # 同时驻留显存的音色权重（GPT + SoVITS）最多占用的显存，超出按最久未使用淘汰
+    TTS_MAX_CACHED_VOICES: int = 16  # 最多缓存的音色 + 参考音频组合个数
+    TTS_PROMPT_CACHE_DIR: str = r"./work_dirs/tts_prompt_cache"  # 参考音频推理信息的磁盘缓存
+    TTS_FRONTEND_CACHE_SIZE: int = 4096  # 文本前端（phones + bert 特征）缓存的文本段个数，0 为不缓存
 
     # ==================================================================
     #                             数字人 配置
@@ -81,11 +102,29 @@ class WebConfigs:
     DIGITAL_HUMAN_GEN_PATH: str = r"./work_dirs/digital_human"
     DIGITAL_HUMAN_MODEL_DIR: str = r"./weights/digital_human_weights/"
     DIGITAL_HUMAN_BBOX_SHIFT: int = 0
+    DIGITAL_HUMAN_BLEND_WORKERS: int = 4  # 数字人帧合成的线程数
+    DIGITAL_HUMAN_AVATAR_CACHE_GB: float = 8.0  # 常驻内存的数字人素材最多占用的内存，超出按最久未使用淘汰
+    DIGITAL_HUMAN_PREPROCESS_BATCH_SIZE: int = 16  # 数字人预处理时关键点检测、VAE 编码、人脸解析每次一起推理的帧数
+    DIGITAL_HUMAN_SILENCE_SKIP: bool = True  # True 静音片段不进行口型推理，直接使用数字人原始帧
+    DIGITAL_HUMAN_SILENCE_DB: float = -45.0  # 帧内音量低于该值（dBFS）视为静音
+    DIGITAL_HUMAN_SILENCE_MIN_SEC: float = 0.3  # 连续静音超过该时长才跳过推理
     DIGITAL_HUMAN_VIDEO_PATH: str = rf"{SERVER_FILE_ROOT}/{STREAMER_FILE_DIR}/{STREAMER_INFO_FILES_DIR}/lelemiao.mp4"
     DIGITAL_HUMAN_VIDEO_OUTPUT_PATH: str = rf"{SERVER_FILE_ROOT}/{STREAMER_FILE_DIR}/vid_output"
 
     DIGITAL_HUMAN_FPS: str = 25
 
+    # 相同主播、素材、音色、文案的视频直接复用，缓存放在视频输出目录下
+    DIGITAL_HUMAN_RENDER_CACHE_DIR: str = rf"{DIGITAL_HUMAN_VIDEO_OUTPUT_PATH}/render_cache"
+    DIGITAL_HUMAN_RENDER_CACHE_GB: float = 20.0  # 缓存最多占用的磁盘空间，超出按最久未使用淘汰
+
+    # 直播间 HLS 直播流，每个直播间一个滚动播放列表：{DIGITAL_HUMAN_LIVE_DIR}/{room_id}/live.m3u8
+    DIGITAL_HUMAN_LIVE_DIR: str = rf"{SERVER_FILE_ROOT}/{STREAMER_FILE_DIR}/live"
+    DIGITAL_HUMAN_LIVE_SEGMENT_SEC: float = 1.0  # 分片时长，单位秒
+    DIGITAL_HUMAN_LIVE_WINDOW: int = 6  # 播放列表保留的分片数
+
+    # True 每句 TTS 完成后立即生成该句的数字人视频并流式返回，False 等全部 TTS 完成后合并再生成
+    DIGITAL_HUMAN_STREAMING: bool = True
+
     # ==================================================================
     #                             Agent 配置
     # ==================================================================
@@ -122,6 +161,10 @@ class ApiConfig:
     DIGITAL_HUMAN_URL: str = f"http://{DIGITAL_ROUTER_NAME}:8002/digital_human/gen"
     DIGITAL_HUMAN_CHECK_URL: str = f"http://{DIGITAL_ROUTER_NAME}:8002/digital_human/check"
     DIGITAL_HUMAN_PREPROCESS_URL: str = f"http://{DIGITAL_ROUTER_NAME}:8002/digital_human/preprocess"
+    DIGITAL_HUMAN_AVATAR_INFO_URL: str = f"http://{DIGITAL_ROUTER_NAME}:8002/digital_human/avatar"
+    DIGITAL_HUMAN_LIVE_START_URL: str = f"http://{DIGITAL_ROUTER_NAME}:8002/digital_human/live/start"
+    DIGITAL_HUMAN_LIVE_PUSH_URL: str = f"http://{DIGITAL_ROUTER_NAME}:8002/digital_human/live/push"
+    DIGITAL_HUMAN_LIVE_STOP_URL: str = f"http://{DIGITAL_ROUTER_NAME}:8002/digital_human/live/stop"
 
     BASE_SERVER_URL: str = f"http://{BASE_ROUTER_NAME}:8000{API_V1_STR}"
     CHAT_URL: str = f"{BASE_SERVER_URL}/streamer-sales/chat"
@@ -132,6 +175,27 @@ class ApiConfig:
 
     REQUEST_FILES_URL = f"{BASE_SERVER_URL}/files"
 
+    # ==================================================================
+    #                           服务间调用 配置
+    # ==================================================================
+    HTTP_CONNECT_TIMEOUT: float = 3.0  # 建立连接超时，单位秒，同时用于组件健康检查
+
+    # 读超时，单位秒
+    TTS_TIMEOUT: float = 60.0
+    ASR_TIMEOUT: float = 60.0
+    LLM_TIMEOUT: float = 120.0
+    DIGITAL_HUMAN_TIMEOUT: float = 300.0
+    DIGITAL_HUMAN_PREPROCESS_TIMEOUT: float = 1800.0  # 数字人视频预处理耗时较长
+    DIGITAL_HUMAN_CONTROL_TIMEOUT: float = 30.0  # 素材版本查询、直播流控制等不需要等待渲染的请求
+
+    # 同时发往各服务的最大请求数，超出后排队，避免压垮 GPU 服务
+    TTS_MAX_CONCURRENCY: int = 8  # TTS 服务端会合并同时到达的请求一起推理
+    ASR_MAX_CONCURRENCY: int = 4
+    LLM_MAX_CONCURRENCY: int = 16
+    DIGITAL_HUMAN_MAX_CONCURRENCY: int = 2
+
+    LLM_MODEL_LIST_TTL: float = 300.0  # LLM 模型列表缓存时间，单位秒
+
 
 # 实例化
 WEB_CONFIGS = WebConfigs()
@@ -0,0 +1,85 @@
+"""T2S 预分配 kv cache 解码测试，只用 CPU 和随机初始化的小模型"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchmetrics")
+
+from server.tts.modules.gpt_sovits.AR.models.t2s_model import Text2SemanticDecoder  # noqa: E402
+from server.tts.modules.gpt_sovits.AR.modules.kv_cache import PreallocatedKVCache  # noqa: E402
+
+DECODE_STEPS = 4
+
+TINY_CONFIG = {
+    "model": {
+        "hidden_dim": 16,
+        "embedding_dim": 16,
+        "head": 2,
+        "n_layer": 2,
+        "vocab_size": 33,
+        "phoneme_vocab_size": 20,
+        "dropout": 0.0,
+        "EOS": 32,
+    }
+}
+
+
+def make_model():
+    torch.manual_seed(0)
+    return Text2SemanticDecoder(TINY_CONFIG).eval()
+
+
+def make_dict_cache(num_layers, kv_cache=None):
+    return {
+        "all_stage": num_layers,
+        "k": [None] * num_layers,
+        "v": [None] * num_layers,
+        "y_emb": None,
+        "first_infer": 1,
+        "stage": 0,
+        "kv_cache": kv_cache,
+    }
+
+
+@torch.no_grad()
+def test_kv_cache_matches_dict_cache():
+    """多步解码时预分配 kv cache 与原来 torch.cat 的结果一致"""
+    model = make_model()
+    num_layers = model.num_layers
+    prefix_len = 5
+
+    kv_cache = PreallocatedKVCache(num_layers, prefix_len + 2, 1, model.model_dim, torch.float32, "cpu")
+    caches = [make_dict_cache(num_layers), make_dict_cache(num_layers, kv_cache)]
+
+    xy_pos = torch.randn(1, prefix_len, model.model_dim)
+    xy_attn_mask = torch.zeros((prefix_len, prefix_len), dtype=torch.bool)
+    outputs = [model.h((xy_pos, None), mask=xy_attn_mask, cache=cache)[0] for cache in caches]
+    torch.testing.assert_close(outputs[0], outputs[1])
+
+    # 超过预估长度时会扩容
+    for step in range(DECODE_STEPS):
+        for cache in caches:
+            cache["first_infer"] = 0
+        xy_pos = torch.randn(1, 1, model.model_dim)
+        xy_attn_mask = torch.zeros((1, prefix_len + step + 1), dtype=torch.bool)
+        outputs = [model.h((xy_pos, None), mask=xy_attn_mask, cache=cache)[0] for cache in caches]
+        torch.testing.assert_close(outputs[0], outputs[1])
+
+    assert kv_cache.lens == [prefix_len + DECODE_STEPS] * num_layers
+
+
+@torch.no_grad()
+def test_infer_panel_decodes_multiple_steps():
+    model = make_model()
+    # 屏蔽 EOS，保证解码到 early_stop_num
+    model.ar_predict_layer.register_forward_hook(lambda module, inputs, output: output.index_fill(-1, torch.tensor([model.EOS]), -1e4))
+
+    x = torch.randint(0, TINY_CONFIG["model"]["phoneme_vocab_size"], (1, 6))
+    prompts = torch.randint(0, model.EOS, (1, 3))
+    bert_feature = torch.randn(1, 1024, x.shape[1])
+
+    y, idx = model.infer_panel(x, torch.tensor([x.shape[1]]), prompts, bert_feature, top_k=1, early_stop_num=DECODE_STEPS)
+
+    assert idx >= 3
+    assert y.shape[1] == prompts.shape[1] + DECODE_STEPS
+    assert len(model.kv_cache_pool._free) == 1